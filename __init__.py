@@ -52,7 +52,9 @@ Safety pig:
 
 """
 
-__all__ = ["common", "scanner", "reader", "image", "database"]
+__all__ = ["common", "scanner", "reader", "image", "database", "writer",
+           "ocrcache", "watcher", "thumbnail", "preprocess", "prefilter",
+           "scheduler", "pipeline", "metrics"]
 
 # Local Variables: #
 # python-indent: 4 #
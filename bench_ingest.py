@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 15:12:40 krylon>
+#
+# /data/code/python/memex/bench_ingest.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.bench_ingest
+
+(c) 2026 Benjamin Walkenhorst
+
+Measure indexing throughput on synthetic image corpora of 1k, 10k and
+100k files (or whatever sizes are requested).
+
+The corpus is generated locally and reproducibly: image i is rendered
+from a random generator seeded with the seed and i, so the images of a
+smaller corpus are the same as the first images of a larger one, and a
+corpus that already exists with the same parameters is reused. Each
+image is a light noise background, and a fraction of them (the text
+density) carry a few lines of dark text. The text is also stored next
+to the image (e.g. 000042.png.txt), which bench_reader uses as the
+reference text.
+
+For each size, the benchmark times
+- Scanner.scan over the whole corpus,
+- Database.file_add and Database.file_add_many for all files, and
+- the Reader and Writer of a Pipeline on a sample of the corpus, since
+  OCR is orders of magnitude slower than the other stages.
+
+The results, including the per-stage metrics, are written as JSON and
+can be compared with those of an earlier run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from queue import Queue
+from typing import Any, Final, Optional, Union
+
+from PIL import Image, ImageDraw, ImageFont
+
+from memex import (common, database, image, metrics, pipeline, reader,
+                   scanner, writer)
+
+SIZES: Final[tuple[int, ...]] = (1_000, 10_000, 100_000)
+FILES_PER_DIR: Final[int] = 100
+MANIFEST: Final[str] = "corpus.json"
+FONT: Final[str] = "DejaVuSans.ttf"
+WORDS: Final[tuple[str, ...]] = (
+    "the", "of", "and", "to", "in", "is", "that", "for", "it", "as", "was",
+    "with", "be", "by", "on", "not", "he", "this", "are", "or", "his",
+    "from", "at", "which", "but", "have", "an", "had", "they", "you",
+    "were", "their", "one", "all", "we", "can", "her", "has", "there",
+    "been", "if", "more", "when", "will", "would", "who", "so", "no",
+    "invoice", "total", "amount", "date", "number", "account", "receipt",
+    "meeting", "project", "report", "screenshot", "error", "warning",
+    "memory", "index", "search", "window", "file", "folder", "image",
+)
+
+Snapshot = dict[str, Union[float, dict[str, float]]]
+
+
+class Corpus:  # pylint: disable-msg=R0903
+    """Corpus generates a reproducible set of synthetic images."""
+
+    __slots__ = ["seed", "density", "lines", "width", "height", "font"]
+
+    seed: int
+    density: float
+    lines: int
+    width: int
+    height: int
+    font: Any
+
+    def __init__(self,
+                 seed: int = 0,
+                 density: float = 0.5,
+                 lines: int = 8,
+                 width: int = 640,
+                 height: int = 480) -> None:
+        self.seed = seed
+        self.density = density
+        self.lines = lines
+        self.width = width
+        self.height = height
+        try:
+            self.font = ImageFont.truetype(FONT, 20)
+        except OSError:
+            self.font = ImageFont.load_default()
+
+    def params(self) -> dict[str, Any]:
+        """Return the parameters that determine the images."""
+        return {
+            "seed": self.seed,
+            "density": self.density,
+            "lines": self.lines,
+            "width": self.width,
+            "height": self.height,
+        }
+
+    def path(self, i: int) -> str:
+        """Return the path of image i relative to the corpus root."""
+        ext: str = ".jpg" if i % 4 == 3 else ".png"
+        return os.path.join(f"{i // (FILES_PER_DIR * 100):02d}",
+                            f"{i // FILES_PER_DIR % 100:02d}",
+                            f"{i:06d}{ext}")
+
+    def render(self, i: int) -> tuple[Image.Image, str]:
+        """Render image i and return it along with its text."""
+        rng = random.Random(f"{self.seed}:{i}")
+        w, h = self.width, self.height
+        noise = Image.frombytes("L",
+                                (w // 8, h // 8),
+                                rng.randbytes((w // 8) * (h // 8)))
+        low: int = rng.randint(150, 200)
+        bg = noise.resize((w, h), Image.BILINEAR).point(
+            lambda v: low + v * (255 - low) // 255)
+        text: list[str] = []
+        if rng.random() < self.density:
+            draw = ImageDraw.Draw(bg)
+            y: int = rng.randint(10, 40)
+            for _ in range(rng.randint(1, self.lines)):
+                line: str = " ".join(rng.choice(WORDS)
+                                     for _ in range(rng.randint(2, 8)))
+                draw.text((rng.randint(10, 60), y), line,
+                          fill=rng.randint(0, 60), font=self.font)
+                text.append(line)
+                y += rng.randint(28, 48)
+                if y > h - 30:
+                    break
+        return bg, "\n".join(text)
+
+    def generate(self, root: str, count: int) -> list[str]:
+        """Make sure the first count images exist below root.
+
+        If root holds a corpus generated with different parameters, it
+        is removed first. Return the paths of all images.
+        """
+        mpath: str = os.path.join(root, MANIFEST)
+        try:
+            with open(mpath, "r", encoding="UTF-8") as fh:
+                manifest: dict[str, Any] = json.load(fh)
+        except FileNotFoundError:
+            manifest = {"params": self.params(), "count": 0}
+        if manifest["params"] != self.params():
+            shutil.rmtree(root)
+            manifest = {"params": self.params(), "count": 0}
+
+        paths: list[str] = [os.path.join(root, self.path(i))
+                            for i in range(count)]
+        for i in range(manifest["count"], count):
+            os.makedirs(os.path.dirname(paths[i]), exist_ok=True)
+            img, text = self.render(i)
+            img.save(paths[i])
+            with open(paths[i] + ".txt", "w", encoding="UTF-8") as fh:
+                fh.write(text)
+            if (i + 1) % 1000 == 0:
+                print(f"Generated {i + 1}/{count} images", end="\r")
+
+        if count > manifest["count"]:
+            manifest["count"] = count
+            with open(mpath, "w", encoding="UTF-8") as fh:
+                json.dump(manifest, fh)
+        return paths
+
+
+def delta(before: Snapshot, after: Snapshot) -> Snapshot:
+    """Return how much each metric changed between two snapshots.
+
+    Gauges are reported with their value in after.
+    """
+    diff: Snapshot = {}
+    for name, val in after.items():
+        old = before.get(name)
+        if isinstance(val, dict):
+            if not isinstance(old, dict):
+                old = {"count": 0, "sum": 0}
+            count: float = val["count"] - old["count"]
+            total: float = val["sum"] - old["sum"]
+            if count > 0:
+                diff[name] = {"count": count, "sum": total}
+        elif name.endswith("_total"):
+            if val != (old or 0):
+                diff[name] = val - (old or 0)  # type: ignore
+        else:
+            diff[name] = val
+    return diff
+
+
+def stage(results: list[dict[str, Any]],
+          size: int,
+          name: str,
+          files: int,
+          seconds: float,
+          snap: Optional[Snapshot] = None) -> None:
+    """Record and print the result of one stage."""
+    rate: float = files / seconds if seconds > 0 else 0.0
+    print(f"{size:7d} {name:<14} {files:7d} files in {seconds:8.2f}s "
+          f"=> {rate:9.1f} files/sec")
+    results.append({
+        "size": size,
+        "stage": name,
+        "files": files,
+        "seconds": seconds,
+        "rate": rate,
+        "metrics": snap or {},
+    })
+
+
+def bench_size(root: str,
+               paths: list[str],
+               sample: int,
+               prefilter: Optional[bool]) -> list[dict[str, Any]]:
+    """Run every stage on one corpus, using a fresh database."""
+    results: list[dict[str, Any]] = []
+    size: int = len(paths)
+    texts: list[str] = []
+    for p in paths:
+        with open(p + ".txt", "r", encoding="UTF-8") as fh:
+            texts.append(fh.read())
+    stamp: datetime = datetime.now()
+
+    # Scan
+    q: Queue[str] = Queue()
+    sc = scanner.Scanner(q)
+    snap = metrics.registry.snapshot()
+    t1: float = time.perf_counter()
+    sc.scan(root)
+    t2: float = time.perf_counter()
+    stage(results, size, "scan", q.qsize(), t2 - t1,
+          delta(snap, metrics.registry.snapshot()))
+
+    # Database
+    db = database.Database(common.path.db())
+    t1 = time.perf_counter()
+    for p, txt in zip(paths, texts):
+        db.file_add(p, txt, timestamp=stamp)
+    t2 = time.perf_counter()
+    stage(results, size, "file_add", size, t2 - t1)
+
+    # A second database, so the batches are inserted, not updated.
+    db = database.Database(os.path.join(common.path.base(), "batch.db"))
+    t1 = time.perf_counter()
+    for i in range(0, size, writer.BATCH_SIZE):
+        db.file_add_many([image.Image(0, p, txt, "", stamp)
+                          for p, txt in zip(paths[i:i+writer.BATCH_SIZE],
+                                            texts[i:i+writer.BATCH_SIZE])])
+    t2 = time.perf_counter()
+    stage(results, size, "file_add_many", size, t2 - t1)
+
+    # Reader and Writer
+    pipe = pipeline.Pipeline(skip_textless=prefilter)
+    pipe.start()
+    snap = metrics.registry.snapshot()
+    t1 = time.perf_counter()
+    try:
+        for p in paths[:sample]:
+            pipe.submit(p)
+        pipe.drain()
+    finally:
+        pipe.stop()
+    t2 = time.perf_counter()
+    stage(results, size, "read", min(sample, size), t2 - t1,
+          delta(snap, metrics.registry.snapshot()))
+
+    return results
+
+
+def link(src: str, dst: str) -> None:
+    """Hard link src to dst, or copy it if that is not possible."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]) -> None:
+    """Print how the throughput of each stage changed."""
+    prev: dict[tuple[int, str], float] = {(r["size"], r["stage"]): r["rate"]
+                                          for r in old["results"]}
+    print(f"\nCompared to {old['date']} ({old['host']}):")
+    for r in new["results"]:
+        before: Optional[float] = prev.get((r["size"], r["stage"]))
+        if not before:
+            continue
+        print(f"{r['size']:7d} {r['stage']:<14} {before:9.1f} => "
+              f"{r['rate']:9.1f} files/sec ({r['rate'] / before:5.2f}x)")
+
+
+def main() -> None:
+    """Run the benchmark."""
+    argp: argparse.ArgumentParser = argparse.ArgumentParser()
+    argp.add_argument("-f", "--folder",
+                      default=os.path.join(tempfile.gettempdir(),
+                                           "memex-corpus"),
+                      help="Folder to generate the corpus in")
+    argp.add_argument("-s", "--sizes",
+                      default=",".join(str(s) for s in SIZES),
+                      help="Comma-separated corpus sizes to benchmark")
+    argp.add_argument("--seed",
+                      type=int,
+                      default=0,
+                      help="Seed for generating the corpus")
+    argp.add_argument("--density",
+                      type=float,
+                      default=0.5,
+                      help="Fraction of images that contain text")
+    argp.add_argument("--lines",
+                      type=int,
+                      default=8,
+                      help="Maximum number of lines of text per image")
+    argp.add_argument("--sample",
+                      type=int,
+                      default=200,
+                      help="Number of images to run OCR on for each size")
+    argp.add_argument("--prefilter",
+                      action="store_true",
+                      default=None,
+                      help="Skip OCR for images that do not appear to "
+                      "contain text")
+    argp.add_argument("-o", "--output",
+                      default=f"bench-ingest-"
+                      f"{datetime.now():%Y%m%d-%H%M%S}.json",
+                      help="File to write the results to")
+    argp.add_argument("-c", "--compare",
+                      help="Results of an earlier run to compare with")
+
+    args = argp.parse_args()
+    sizes: list[int] = sorted(int(s) for s in args.sizes.split(","))
+    corpus = Corpus(args.seed, args.density, args.lines)
+    os.makedirs(args.folder, exist_ok=True)
+    paths: list[str] = corpus.generate(args.folder, sizes[-1])
+
+    out: dict[str, Any] = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "workers": reader.CPU_COUNT,
+        "corpus": corpus.params(),
+        "sample": args.sample,
+        "results": [],
+    }
+    for size in sizes:
+        # Each size gets its own copy of the corpus prefix and an empty
+        # database, so the scanner finds exactly size images.
+        work: str = tempfile.mkdtemp(prefix="memex-bench-")
+        try:
+            common.set_basedir(os.path.join(work, "base"))
+            root: str = os.path.join(work, "corpus")
+            local: list[str] = []
+            for p in paths[:size]:
+                dst: str = os.path.join(root,
+                                        os.path.relpath(p, args.folder))
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                link(p, dst)
+                link(p + ".txt", dst + ".txt")
+                local.append(dst)
+            out["results"].extend(bench_size(root,
+                                             local,
+                                             args.sample,
+                                             args.prefilter))
+        finally:
+            shutil.rmtree(work)
+
+    with open(args.output, "w", encoding="UTF-8") as fh:
+        json.dump(out, fh, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="UTF-8") as fh:
+            compare(json.load(fh), out)
+
+
+if __name__ == "__main__":
+    main()
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 14:02:11 krylon>
+#
+# /data/code/python/memex/bench_reader.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.bench_reader
+
+(c) 2026 Benjamin Walkenhorst
+
+Measure OCR throughput in images/sec, comparing a fresh Tesseract API
+per image (tesserocr.file_to_text) against a persistent reader.Engine.
+
+If preprocessing is requested, compare the Engine with and without it
+instead, and report how close the preprocessed text comes to the
+reference text. The reference for an image is the content of a .txt file
+next to it (e.g. shot.png.txt), if there is one, and the text recognized
+without preprocessing otherwise.
+"""
+
+import argparse
+import difflib
+import os
+import time
+from typing import Callable
+
+import tesserocr  # type: ignore
+
+from memex import preprocess, reader, scanner
+
+
+def collect_images(folder: str, count: int) -> list[str]:
+    """Return up to count image files below folder."""
+    images: list[str] = []
+    for path, _, files in os.walk(folder):
+        for f in sorted(files):
+            if scanner.is_image(f):
+                images.append(os.path.join(path, f))
+                if len(images) >= count:
+                    return images
+    return images
+
+
+def warm_up(images: list[str]) -> None:
+    """Read all images once, so no run pays for the cold page cache."""
+    for path in images:
+        with open(path, "rb") as fh:
+            while fh.read(1 << 20):
+                pass
+
+
+def measure(label: str,
+            images: list[str],
+            ocr: Callable[[str], str]) -> tuple[float, list[str]]:
+    """Run ocr on all images.
+
+    Return the throughput in images/sec and the text of each image.
+    """
+    texts: list[str] = []
+    t1: float = time.perf_counter()
+    for path in images:
+        texts.append(ocr(path))
+    t2: float = time.perf_counter()
+    rate: float = len(images) / (t2 - t1)
+    print(f"{label:<16} {len(images):6d} images in {t2 - t1:8.2f}s "
+          f"=> {rate:7.2f} images/sec")
+    return rate, texts
+
+
+def similarity(ref: str, text: str) -> float:
+    """Return how similar two texts are, word by word, from 0 to 1."""
+    return difflib.SequenceMatcher(None, ref.split(), text.split()).ratio()
+
+
+def reference(path: str, fallback: str) -> str:
+    """Return the reference text for an image."""
+    try:
+        with open(path + ".txt", "r", encoding="UTF-8") as fh:
+            return fh.read()
+    except FileNotFoundError:
+        return fallback
+
+
+def compare_preprocessing(images: list[str],
+                          lang: str,
+                          prep: preprocess.Settings) -> None:
+    """Compare the Engine with and without preprocessing."""
+    print(f"Preprocessing: {prep.profile()}")
+    eng = reader.Engine(lang)
+    try:
+        before, raw = measure("Engine", images, eng.read)
+        eng.configure(lang, prep=prep)
+        after, texts = measure("Engine+prep", images, eng.read)
+    finally:
+        eng.close()
+
+    refs: list[str] = [reference(p, t) for p, t in zip(images, raw)]
+    q_raw: float = sum(similarity(r, t) for r, t in zip(refs, raw))
+    q_prep: float = sum(similarity(r, t) for r, t in zip(refs, texts))
+    print(f"Speedup: {after / before:.2f}x")
+    print(f"Quality: {q_raw / len(images):.3f} without, "
+          f"{q_prep / len(images):.3f} with preprocessing")
+
+
+def main() -> None:
+    """Run the benchmark."""
+    argp: argparse.ArgumentParser = argparse.ArgumentParser()
+    argp.add_argument("-f", "--folder",
+                      required=True,
+                      help="Folder containing the images to read")
+    argp.add_argument("-n", "--count",
+                      type=int,
+                      default=100,
+                      help="Maximum number of images to read")
+    argp.add_argument("-l", "--lang",
+                      default=reader.DEFAULT_LANG,
+                      help="OCR language")
+    argp.add_argument("--max-dim",
+                      type=int,
+                      default=0,
+                      help="Scale images down to at most this many pixels")
+    argp.add_argument("--dpi",
+                      type=int,
+                      default=0,
+                      help="Scale images down to this resolution")
+    argp.add_argument("--grayscale",
+                      action="store_true",
+                      help="Convert images to grayscale")
+    argp.add_argument("--binarize",
+                      action="store_true",
+                      help="Convert images to black and white")
+    argp.add_argument("--crop",
+                      action="store_true",
+                      help="Crop uniform borders")
+    argp.add_argument("--config",
+                      action="store_true",
+                      help="Use the preprocessing from the configuration "
+                      "file")
+
+    args = argp.parse_args()
+    images: list[str] = collect_images(args.folder, args.count)
+    if len(images) == 0:
+        print(f"No images found in {args.folder}")
+        return
+
+    prep: preprocess.Settings = preprocess.Settings(max_dim=args.max_dim,
+                                                    dpi=args.dpi,
+                                                    grayscale=args.grayscale,
+                                                    binarize=args.binarize,
+                                                    crop=args.crop)
+    if args.config:
+        prep = preprocess.load_settings()
+    warm_up(images)
+    if prep.enabled():
+        compare_preprocessing(images, args.lang, prep)
+        return
+
+    before, _ = measure(
+        "file_to_text",
+        images,
+        # pylint: disable-msg=I1101,E1101
+        lambda p: tesserocr.file_to_text(p, lang=args.lang))
+
+    eng = reader.Engine(args.lang)
+    try:
+        after, _ = measure("Engine", images, eng.read)
+    finally:
+        eng.close()
+
+    print(f"Speedup: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
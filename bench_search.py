@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 15:58:03 krylon>
+#
+# /data/code/python/memex/bench_search.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.bench_search
+
+(c) 2026 Benjamin Walkenhorst
+
+Measure search latency on databases of 10k, 100k and 1M synthetic OCR
+rows (or whatever sizes are requested).
+
+The text of each row is drawn from a vocabulary of made-up words with a
+Zipf distribution, much like real text, so the most frequent words match
+most rows and the rarest ones only a handful. Databases are generated
+reproducibly from a seed and kept in the benchmark folder, so later runs
+with the same parameters skip the (slow) filling step.
+
+The workload mixes frequent and rare single terms, phrases taken from
+stored rows, prefixes, and two-term queries. Each query is run
+- as Database.file_search, i.e. fetching all results ordered by time,
+- for the first page of results without content, as the GUI does, and
+- for the first page of results ordered by relevance,
+with the search cache disabled. For each kind of query and mode, we
+report the p50/p95/p99 latency, and for each size the peak RSS of the
+process that ran the queries. The results are written as JSON and can
+be compared with those of an earlier run.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import accumulate
+from typing import Any, Callable, Final, Iterator, Optional
+
+from memex import common, database, image
+
+SIZES: Final[tuple[int, ...]] = (10_000, 100_000, 1_000_000)
+VOCABULARY: Final[int] = 50_000
+SYLLABLES: Final[tuple[str, ...]] = (
+    "ka", "lo", "mi", "ne", "su", "ta", "ri", "po", "da", "ve", "go", "hu",
+    "zi", "ba", "fe", "ju", "qua", "sto", "tri", "len", "mor", "pas", "cre",
+    "dol",
+)
+FILL_BATCH: Final[int] = 10_000
+PAGE_SIZE: Final[int] = 256  # gui.PAGE_SIZE, without importing Gtk
+SPAN: Final[int] = 5 * 365 * 86400  # seconds
+KINDS: Final[tuple[str, ...]] = ("frequent",
+                                 "rare",
+                                 "phrase",
+                                 "prefix",
+                                 "and")
+MODES: Final[tuple[str, ...]] = ("all", "page", "rank")
+
+
+def make_vocabulary(seed: int) -> list[str]:
+    """Return a list of distinct made-up words, most frequent first."""
+    rng = random.Random(f"{seed}:vocabulary")
+    words: list[str] = []
+    seen: set[str] = set()
+    while len(words) < VOCABULARY:
+        w: str = "".join(rng.choice(SYLLABLES)
+                         for _ in range(rng.randint(2, 4)))
+        if w not in seen:
+            seen.add(w)
+            words.append(w)
+    return words
+
+
+class Corpus:  # pylint: disable-msg=R0903
+    """Corpus generates the rows of a synthetic database."""
+
+    __slots__ = ["seed", "words", "weights", "vocab"]
+
+    seed: int
+    words: int
+    weights: list[float]
+    vocab: list[str]
+
+    def __init__(self, seed: int = 0, words: int = 60) -> None:
+        self.seed = seed
+        self.words = words
+        self.vocab = make_vocabulary(seed)
+        self.weights = list(accumulate(1.0 / (r + 1)
+                                       for r in range(VOCABULARY)))
+
+    def params(self) -> dict[str, Any]:
+        """Return the parameters that determine the rows."""
+        return {"seed": self.seed, "words": self.words}
+
+    def text(self, i: int) -> str:
+        """Return the text of row i."""
+        rng = random.Random(f"{self.seed}:{i}")
+        n: int = rng.randint(self.words // 4, self.words * 7 // 4)
+        return " ".join(rng.choices(self.vocab,
+                                    cum_weights=self.weights,
+                                    k=n))
+
+    def rows(self, count: int) -> Iterator[image.Image]:
+        """Yield count rows."""
+        now: int = int(time.time())
+        for i in range(count):
+            age: int = random.Random(f"{self.seed}:t{i}").randrange(SPAN)
+            stamp: int = now - age
+            yield image.Image(0,
+                              f"/corpus/{i // 10000:03d}/{i:07d}.png",
+                              self.text(i),
+                              "",
+                              datetime.fromtimestamp(stamp))
+
+    def queries(self, size: int, count: int) -> dict[str, list[str]]:
+        """Return count queries of each kind for a database of size rows.
+
+        Except for the frequent terms and prefixes, the queries are taken
+        from random rows, so each of them matches at least one row.
+        """
+        rng = random.Random(f"{self.seed}:queries")
+        rank: dict[str, int] = {w: r for r, w in enumerate(self.vocab)}
+        workload: dict[str, list[str]] = {k: [] for k in KINDS}
+        for _ in range(count):
+            workload["frequent"].append(rng.choice(self.vocab[:20]))
+            word: str = rng.choice(self.vocab[100:2000])
+            workload["prefix"].append(word[:3] + "*")
+            words: list[str] = self.text(rng.randrange(size)).split()
+            workload["rare"].append(max(words, key=rank.__getitem__))
+            j: int = rng.randrange(len(words) - 1)
+            workload["phrase"].append(f'"{words[j]} {words[j+1]}"')
+            workload["and"].append(" ".join(rng.sample(words, 2)))
+        return workload
+
+
+def fill(path: str, corpus: Corpus, size: int) -> None:
+    """Create the database at path with size rows, unless it exists."""
+    manifest: str = path + ".json"
+    want: dict[str, Any] = {"params": corpus.params(), "size": size}
+    try:
+        with open(manifest, "r", encoding="UTF-8") as fh:
+            if json.load(fh) == want:
+                return
+    except FileNotFoundError:
+        pass
+    for f in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(f):
+            os.remove(f)
+
+    db = database.Database(path)
+    batch: list[image.Image] = []
+    t1: float = time.perf_counter()
+    for i, img in enumerate(corpus.rows(size)):
+        batch.append(img)
+        if len(batch) == FILL_BATCH:
+            db.file_add_many(batch)
+            batch.clear()
+            print(f"Filled {i + 1}/{size} rows", end="\r", file=sys.stderr)
+    if len(batch) > 0:
+        db.file_add_many(batch)
+    db.checkpoint("TRUNCATE")
+    t2: float = time.perf_counter()
+    print(f"Filled {size} rows in {t2 - t1:.1f}s", file=sys.stderr)
+    with open(manifest, "w", encoding="UTF-8") as fh:
+        json.dump(want, fh)
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """Return the q-th percentile of the sorted samples (nearest rank)."""
+    idx: int = round(q / 100 * len(samples)) - 1
+    idx = max(0, min(len(samples) - 1, idx))
+    return samples[idx]
+
+
+def peak_rss() -> int:
+    """Return the peak resident set size of this process in bytes."""
+    rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_queries(path: str,
+                corpus: Corpus,
+                size: int,
+                count: int) -> dict[str, Any]:
+    """Run the workload against the database at path."""
+    db = database.Database(path, cache_size=0)
+    runners: dict[str, Callable[[str], int]] = {
+        "all": lambda q: len(db.file_search(q)),
+        "page": lambda q: sum(1 for _ in db.file_search_iter(q,
+                                                             limit=PAGE_SIZE,
+                                                             content=False)),
+        "rank": lambda q: sum(1 for _ in db.file_search_iter(q,
+                                                             limit=PAGE_SIZE,
+                                                             rank=True)),
+    }
+    workload: dict[str, list[str]] = corpus.queries(size, count)
+    # Warm up the page cache, so the first kind is not at a disadvantage.
+    for q in workload["frequent"][:3]:
+        runners["page"](q)
+
+    results: list[dict[str, Any]] = []
+    for kind, queries in workload.items():
+        for mode, run in runners.items():
+            lat: list[float] = []
+            hits: int = 0
+            for q in queries:
+                t1: float = time.perf_counter()
+                hits += run(q)
+                t2: float = time.perf_counter()
+                lat.append(t2 - t1)
+            lat.sort()
+            res: dict[str, Any] = {
+                "size": size,
+                "kind": kind,
+                "mode": mode,
+                "queries": len(queries),
+                "hits": hits / len(queries),
+                "p50": percentile(lat, 50),
+                "p95": percentile(lat, 95),
+                "p99": percentile(lat, 99),
+            }
+            print(f"{size:8d} {kind:<8} {mode:<4} "
+                  f"{res['hits']:10.0f} hits  "
+                  f"p50 {res['p50'] * 1000:9.2f}ms  "
+                  f"p95 {res['p95'] * 1000:9.2f}ms  "
+                  f"p99 {res['p99'] * 1000:9.2f}ms")
+            results.append(res)
+    return {"size": size,
+            "db_bytes": os.path.getsize(path),
+            "peak_rss": peak_rss(),
+            "results": results}
+
+
+def in_process(func: Callable, *args: Any) -> Any:
+    """Call func in a fresh process, so its peak RSS is its own."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def compare(old: dict[str, Any], new: dict[str, Any]) -> None:
+    """Print how the latency of each query kind and mode changed."""
+    prev: dict[tuple[int, str, str], float] = {
+        (r["size"], r["kind"], r["mode"]): r["p95"]
+        for s in old["sizes"] for r in s["results"]}
+    print(f"\nCompared to {old['date']} ({old['host']}), p95:")
+    for s in new["sizes"]:
+        for r in s["results"]:
+            before: Optional[float] = prev.get((r["size"],
+                                                r["kind"],
+                                                r["mode"]))
+            if not before:
+                continue
+            print(f"{r['size']:8d} {r['kind']:<8} {r['mode']:<4} "
+                  f"{before * 1000:9.2f}ms => {r['p95'] * 1000:9.2f}ms "
+                  f"({r['p95'] / before:5.2f}x)")
+
+
+def main() -> None:
+    """Run the benchmark."""
+    argp: argparse.ArgumentParser = argparse.ArgumentParser()
+    argp.add_argument("-f", "--folder",
+                      default=os.path.join(tempfile.gettempdir(),
+                                           "memex-search"),
+                      help="Folder to keep the benchmark databases in")
+    argp.add_argument("-s", "--sizes",
+                      default=",".join(str(s) for s in SIZES),
+                      help="Comma-separated database sizes to benchmark")
+    argp.add_argument("--seed",
+                      type=int,
+                      default=0,
+                      help="Seed for generating the databases")
+    argp.add_argument("--words",
+                      type=int,
+                      default=60,
+                      help="Average number of words per row")
+    argp.add_argument("-n", "--queries",
+                      type=int,
+                      default=20,
+                      help="Number of queries of each kind")
+    argp.add_argument("-o", "--output",
+                      default=f"bench-search-"
+                      f"{datetime.now():%Y%m%d-%H%M%S}.json",
+                      help="File to write the results to")
+    argp.add_argument("-c", "--compare",
+                      help="Results of an earlier run to compare with")
+
+    args = argp.parse_args()
+    os.makedirs(args.folder, exist_ok=True)
+    common.set_basedir(os.path.join(args.folder, "base"))
+    corpus = Corpus(args.seed, args.words)
+    out: dict[str, Any] = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "corpus": corpus.params(),
+        "sizes": [],
+    }
+    for size in sorted(int(s) for s in args.sizes.split(",")):
+        path: str = os.path.join(args.folder, f"search-{size}.db")
+        in_process(fill, path, corpus, size)
+        res: dict[str, Any] = in_process(run_queries,
+                                         path,
+                                         corpus,
+                                         size,
+                                         args.queries)
+        print(f"{size:8d} rows, {res['db_bytes'] / 2**20:.1f} MiB, "
+              f"peak RSS {res['peak_rss'] / 2**20:.1f} MiB")
+        out["sizes"].append(res)
+
+    with open(args.output, "w", encoding="UTF-8") as fh:
+        json.dump(out, fh, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="UTF-8") as fh:
+            compare(json.load(fh), out)
+
+
+if __name__ == "__main__":
+    main()
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
@@ -34,20 +34,123 @@ memex.cli
 """
 
 import argparse
+import json
+import logging
 import os
+import sys
 import time
-from queue import Queue
+from typing import Any, Final, Iterable
 
-from memex import common, database, reader, scanner
+from memex import (common, database, image, metrics, pipeline, reader,
+                   scheduler, watcher)
+
+OUTPUT_FORMATS: Final[tuple[str, ...]] = ("plain", "nul", "jsonl")
+REPORT_INTERVAL: Final[float] = 5.0  # seconds
+
+
+def highlight(snippet: image.Snippet) -> str:
+    """Render a snippet on a single line, with the matches in brackets."""
+    parts: list[str] = []
+    pos: int = 0
+    for start, end in snippet.matches:
+        parts.append(snippet.text[pos:start])
+        parts.append(f"[{snippet.text[start:end]}]")
+        pos = end
+    parts.append(snippet.text[pos:])
+    return " ".join("".join(parts).split())
+
+
+def print_results(files: Iterable[image.Image], fmt: str) -> None:
+    """Write search results to stdout as they arrive."""
+    out = sys.stdout
+    for f in files:
+        if fmt == "nul":
+            out.write(f.path)
+            out.write("\0")
+        elif fmt == "jsonl":
+            rec: dict[str, Any] = {
+                "id": f.dbid,
+                "path": f.path,
+                "timestamp": f.timestamp.isoformat(),
+                "comment": f.comment,
+            }
+            if f.content != "":
+                rec["content"] = f.content
+            if f.snippet is not None:
+                rec["snippet"] = f.snippet.text
+                rec["matches"] = f.snippet.matches
+            out.write(json.dumps(rec))
+            out.write("\n")
+        else:
+            out.write(f.path)
+            if f.snippet is not None:
+                out.write("\t")
+                out.write(highlight(f.snippet))
+            out.write("\n")
+    out.flush()
+
+
+def watch(pipe: pipeline.Pipeline, folders: list[str]) -> None:
+    """Index changes below the given folders until interrupted."""
+    w = watcher.Watcher(pipe.queue, folders)
+    w.start()
+    try:
+        # Catch up on whatever changed while nobody was watching.
+        pipe.scan(*folders, incremental=True)
+        print(f"Watching {', '.join(w.folders)}, press Ctrl-C to stop.")
+        while True:
+            time.sleep(1)
+    finally:
+        w.stop()
+
+
+def drain(pipe: pipeline.Pipeline) -> None:
+    """Wait for the Pipeline to store all images, reporting the progress.
+
+    Returns as soon as the last image has been committed.
+    """
+    while not pipe.drain(timeout=REPORT_INTERVAL):
+        p: pipeline.Progress = pipe.progress()
+        eta: str = "?" if p.eta is None else f"{p.eta:.0f}s"
+        print(f"{p.stored}/{p.found} files stored, "
+              f"{p.rate:.2f} files/sec, ETA {eta}")
+
+
+def cleanup(folders: list[str]) -> None:
+    """Remove the images whose files are gone, reporting the progress.
+
+    If folders is empty, all images are checked.
+    """
+    db = database.Database(common.path.db())
+    last: float = time.monotonic()
+
+    def report(checked: int, removed: int) -> None:
+        nonlocal last
+        now: float = time.monotonic()
+        if now - last >= REPORT_INTERVAL:
+            print(f"{checked} files checked, {removed} removed")
+            last = now
+
+    removed: int = 0
+    if len(folders) == 0:
+        removed = db.cleanup(None, report)
+    for folder in folders:
+        removed += db.cleanup(folder, report)
+    print(f"Removed {removed} files that no longer exist.")
 
 
 def main() -> None:
     """Run the the CLI version."""
     argp: argparse.ArgumentParser = argparse.ArgumentParser()
     argp.add_argument("-a", "--action",
-                      choices=["scan", "search"],
+                      choices=["scan", "refresh", "watch", "search",
+                               "force", "resume", "cleanup"],
                       required=True,
-                      help="Which action to perform: scan, search")
+                      help="Which action to perform: scan, refresh, watch, "
+                      "search, force (OCR the images the prefilter "
+                      "skipped), resume (finish the images left over by an "
+                      "interrupted run), cleanup (forget the images that no "
+                      "longer exist, below the given folders or anywhere)")
     argp.add_argument("-f", "--folders",
                       metavar="folders",
                       nargs="*",
@@ -56,39 +159,135 @@ def main() -> None:
                       type=int,
                       default=os.cpu_count(),
                       help="Number of worker threads to use")
+    argp.add_argument("-b", "--backend",
+                      choices=reader.BACKENDS,
+                      default="thread",
+                      help="Run OCR in worker threads or worker processes")
+    argp.add_argument("--schedule",
+                      choices=sorted(scheduler.POLICIES),
+                      help="The order in which images are read: newest "
+                      "first, smallest first, taking turns between folders, "
+                      "or as found")
+    argp.add_argument("--no-cache",
+                      action="store_true",
+                      help="Do not use the OCR cache")
+    argp.add_argument("--ocr-cache",
+                      metavar="path",
+                      help="Path of the OCR cache, it can be shared "
+                      "between databases")
+    argp.add_argument("--thumbnails",
+                      action="store_true",
+                      help="Render thumbnails for the GUI while scanning")
+    argp.add_argument("--prefilter",
+                      action="store_true",
+                      default=None,
+                      help="Skip OCR for images that do not appear to "
+                      "contain text")
     argp.add_argument("-q", "--query",
                       help="Query string")
+    argp.add_argument("-l", "--limit",
+                      type=int,
+                      default=-1,
+                      help="Print at most this many search results")
+    argp.add_argument("-o", "--format",
+                      choices=OUTPUT_FORMATS,
+                      default="plain",
+                      help="Print search results one per line, "
+                      "NUL-separated, or as JSON lines")
+    argp.add_argument("--content",
+                      action="store_true",
+                      help="Include the extracted text in JSON output")
+    argp.add_argument("-s", "--snippets",
+                      action="store_true",
+                      help="Show the text around the matches")
+    argp.add_argument("--rank",
+                      action="store_true",
+                      help="Order search results by relevance instead of "
+                      "time")
+    argp.add_argument("--stats",
+                      action="store_true",
+                      help="Print the metrics of the indexing stages when "
+                      "done")
+    argp.add_argument("--export-metrics",
+                      action="store_true",
+                      default=None,
+                      help=f"Write the metrics to {common.path.metrics()} "
+                      "periodically")
     argp.add_argument("-v", "--verbose",
-                      help="Emit additional messages",
+                      help="Log debug messages, regardless of the "
+                      "configured level",
                       action="store_true")
 
     args = argp.parse_args()
 
-    # if args.verbose:
-    #     logging.setLevel(logging.DEBUG)
-    # else:
-    #     logging.setLevel(logging.INFO)
-
     common.init_app()
+    if args.verbose:
+        common.set_log_level(logging.DEBUG)
 
-    print(f"Action: {args.action} / Folders: {args.folders}")
-
-    if args.action == "scan":
-        # pylint: disable-msg=C0103
-        q: Queue[str] = Queue(os.cpu_count())  # type: ignore
-        sc = scanner.Scanner(q)
-        rdr = reader.Reader(q, args.workers)
-        sc.scan(*args.folders)
-        print("Done.")
-        while rdr.file_queue.qsize() > 0:
-            print(f"Waiting for {q.qsize()} files to be processed.")
-            time.sleep(1)
+    if args.action in ("scan", "refresh", "watch", "force", "resume"):
+        print(f"Action: {args.action} / Folders: {args.folders}")
+        # Jobs left over from an interrupted run are queued right away,
+        # whatever the action.
+        pipe = pipeline.Pipeline(args.workers,
+                                 args.schedule,
+                                 backend=args.backend,
+                                 cache=not args.no_cache,
+                                 cache_path=args.ocr_cache,
+                                 thumbnails=args.thumbnails,
+                                 skip_textless=(False
+                                                if args.action == "force"
+                                                else args.prefilter))
+        exporter = metrics.load_exporter(enabled=args.export_metrics)
+        if exporter is not None:
+            exporter.start()
+        pipe.start()
+        try:
+            if args.action == "scan":
+                pipe.scan(*args.folders)
+            elif args.action == "refresh":
+                # Refresh all folders we have seen before, skipping the
+                # directories that have not changed since.
+                db = database.Database(common.path.db())
+                folders = db.folder_get_all()
+                pipe.scan(*folders, incremental=True)
+            elif args.action == "resume":
+                # The JobQueue has already queued whatever was left over.
+                pass
+            elif args.action == "force":
+                db = database.Database(common.path.db())
+                for path in db.file_get_skipped():
+                    pipe.submit(path)
+            else:
+                folders = args.folders or \
+                    database.Database(common.path.db()).folder_get_all()
+                watch(pipe, folders)
+            print("Done.")
+            drain(pipe)
+        except KeyboardInterrupt:
+            pipe.cancel()
+        finally:
+            pipe.stop()
+            if exporter is not None:
+                exporter.stop()
+        stats = pipe.queue.stats()
+        print(f"Read {stats['completed']} files, "
+              f"{stats['rate']:.2f} files/sec ({stats['policy']})")
+        failed: int = pipe.queue.counts()["failed"]
+        if failed > 0:
+            print(f"{failed} files could not be read.")
+        if args.stats:
+            print(metrics.registry.render(), end="")
     elif args.action == "search":
         # pylint: disable-msg=C0103
         db = database.Database(common.path.db())
-        files = db.file_search(args.query)
-        for f in files:
-            print(f.path)
+        files = db.file_search_iter(args.query,
+                                    limit=args.limit,
+                                    content=args.content,
+                                    rank=args.rank,
+                                    snippets=args.snippets)
+        print_results(files, args.format)
+    elif args.action == "cleanup":
+        cleanup(args.folders or [])
 
 
 if __name__ == "__main__":
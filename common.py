@@ -35,13 +35,17 @@ Common
 This module contains definitions commonly used throughout the application.
 """
 
+import atexit
+import configparser
 import logging
 import logging.handlers
 import os
 import os.path
+import queue
+import sys
 
 from threading import Lock
-from typing import Final
+from typing import Final, Optional
 
 APP_NAME: Final[str] = "Memex"
 APP_VERSION: Final[str] = "0.3.1"
@@ -77,55 +81,183 @@ class Path:
         """Return the path to the log file"""
         return os.path.join(self.__base, f"{APP_NAME.lower()}.log")
 
+    def ocr_cache(self) -> str:
+        """Return the path to the OCR cache"""
+        return os.path.join(self.__base, f"{APP_NAME.lower()}.ocr.db")
+
+    def thumbnails(self) -> str:
+        """Return the path to the thumbnail store"""
+        return os.path.join(self.__base, f"{APP_NAME.lower()}.thumbs.db")
+
+    def metrics(self) -> str:
+        """Return the path the metrics are exported to"""
+        return os.path.join(self.__base, f"{APP_NAME.lower()}.prom")
+
+    def config(self) -> str:
+        """Return the path to the configuration file"""
+        return os.path.join(self.__base, f"{APP_NAME.lower()}.conf")
+
 
 path: Path = Path(os.path.expanduser(f"~/.{APP_NAME.lower()}.d"))
 
+LOG_FORMAT: Final[str] = "%(asctime)s (%(name)-16s / line %(lineno)-4d) " + \
+    "- %(levelname)-8s %(message)s"
+LOG_MAX_SIZE: Final[int] = 256 * 2**20
+LOG_MAX_COUNT: Final[int] = 4
+LOG_LEVEL: Final[str] = "INFO"
+
 _lock: Final[Lock] = Lock()  # pylint: disable-msg=C0103
 _cache: Final[dict[str, logging.Logger]] = {}  # pylint: disable-msg=C0103
+_quiet: Final[set[str]] = set()  # pylint: disable-msg=C0103
+
+# Loggers only put their records in _log_queue, the file and the terminal
+# are written to by the listener's thread, so threads that log never wait
+# for I/O.
+_log_queue: Final[queue.SimpleQueue] \
+    = queue.SimpleQueue()  # pylint: disable-msg=C0103
+_log_handler: Final[logging.Handler] \
+    = logging.handlers.QueueHandler(_log_queue)  # pylint: disable-msg=C0103
+_listener: Optional[logging.handlers.QueueListener] \
+    = None  # pylint: disable-msg=C0103
+_level: Optional[int] = None  # pylint: disable-msg=C0103
+_base_ok: Optional[str] = None  # pylint: disable-msg=C0103
 
 
 def set_basedir(folder: str) -> None:
-    """Set the base dir to the speficied path."""
+    """Set the base dir to the speficied path.
+
+    If logging has been set up already, it continues in the new base dir.
+    """
     path.base(folder)
-    init_app()
+    with _lock:
+        init_app()
+        if _listener is not None:
+            _stop_listener()
+            _start_listener()
 
 
 def init_app() -> None:
-    """Initialize the application environment"""
-    print(f"Create base directory {path.base()}")
+    """Initialize the application environment
+
+    This only does any work the first time it is called for a base dir.
+    """
+    global _base_ok  # pylint: disable-msg=W0603
+    if _base_ok == path.base():
+        return
     if not os.path.isdir(path.base()):
+        print(f"Create base directory {path.base()}", file=sys.stderr)
         os.mkdir(path.base())
+    _base_ok = path.base()
 
 
-def get_logger(name: str, terminal: bool = True) -> logging.Logger:
-    """Create and return a logger with the given name"""
+def load_config() -> configparser.ConfigParser:
+    """Read the configuration file.
+
+    A missing file is not an error, every setting has a default.
+    """
+    cfg = configparser.ConfigParser()
+    cfg.read(path.config(), encoding="UTF-8")
+    return cfg
+
+
+def log_level(cfg: Optional[configparser.ConfigParser] = None) -> int:
+    """Return the log level from the configuration file.
+
+    The level is set in the [log] section, e.g. level = DEBUG.
+    """
+    if cfg is None:
+        cfg = load_config()
+    name: str = cfg.get("log", "level", fallback=LOG_LEVEL).upper()
+    level = logging.getLevelName(name)
+    if not isinstance(level, int):
+        print(f"Invalid log level {name}, using {LOG_LEVEL}", file=sys.stderr)
+        return logging.getLevelName(LOG_LEVEL)
+    return level
+
+
+def set_log_level(level: int) -> None:
+    """Set the level of all loggers, including those created later."""
+    global _level  # pylint: disable-msg=W0603
     with _lock:
-        init_app()
+        _level = level
+        for log_obj in _cache.values():
+            log_obj.setLevel(level)
+
+
+def _start_listener() -> None:
+    """Start the thread that writes log records to the file and terminal.
+
+    The caller must hold _lock.
+    """
+    global _listener  # pylint: disable-msg=W0603
+    init_app()
+    log_fmt = logging.Formatter(LOG_FORMAT)
+    log_file_handler = logging.handlers.RotatingFileHandler(path.log(),
+                                                            'a',
+                                                            LOG_MAX_SIZE,
+                                                            LOG_MAX_COUNT)
+    log_file_handler.setFormatter(log_fmt)
+    log_console_handler = logging.StreamHandler()
+    log_console_handler.setFormatter(log_fmt)
+    log_console_handler.addFilter(lambda rec: rec.name not in _quiet)
+    _listener = logging.handlers.QueueListener(_log_queue,
+                                               log_file_handler,
+                                               log_console_handler)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    """Write out all pending log records and stop the listener.
+
+    The caller must hold _lock.
+    """
+    global _listener  # pylint: disable-msg=W0603
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def stop_logging() -> None:
+    """Write out all pending log records.
+
+    This is called when the interpreter exits. Records logged afterwards
+    stay in the queue. They are only written if the listener is started
+    again, which happens when a logger is created that did not exist yet.
+    """
+    with _lock:
+        _stop_listener()
+
 
+atexit.register(stop_logging)
+
+
+def get_logger(name: str, terminal: bool = True) -> logging.Logger:
+    """Create and return a logger with the given name
+
+    If terminal is False, the logger's messages only go to the log file.
+    """
+    log_obj: Optional[logging.Logger] = _cache.get(name)
+    if log_obj is not None:
+        return log_obj
+
+    global _level  # pylint: disable-msg=W0603
+    with _lock:
         if name in _cache:
             return _cache[name]
-
-        log_format = "%(asctime)s (%(name)-16s / line %(lineno)-4d) " + \
-            "- %(levelname)-8s %(message)s"
-        max_log_size = 256 * 2**20
-        max_log_count = 4
+        if _level is None:
+            _level = log_level()
+        if _listener is None:
+            _start_listener()
 
         log_obj = logging.getLogger(name)
-        log_obj.setLevel(logging.DEBUG)
-        log_file_handler = logging.handlers.RotatingFileHandler(path.log(),
-                                                                'a',
-                                                                max_log_size,
-                                                                max_log_count)
-
-        log_fmt = logging.Formatter(log_format)
-        log_file_handler.setFormatter(log_fmt)
-        log_obj.addHandler(log_file_handler)
-
-        if terminal:
-            log_console_handler = logging.StreamHandler()
-            log_console_handler.setFormatter(log_fmt)
-            log_console_handler.setLevel(logging.DEBUG)
-            log_obj.addHandler(log_console_handler)
+        log_obj.setLevel(_level)
+        log_obj.addHandler(_log_handler)
+        log_obj.propagate = False
+        if not terminal:
+            _quiet.add(name)
 
         _cache[name] = log_obj
         return log_obj
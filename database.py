@@ -34,35 +34,38 @@ memex.database
 """
 
 import logging
+import os
 import sqlite3
 import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from enum import Enum, auto
-from typing import Final, List, Optional
+from typing import Callable, Final, Iterator, List, Optional, Sequence
 
 import krylib
 
 from memex import common, image
 
-INIT_QUERIES: Final[List[str]] = [
-    """CREATE TABLE image (
-        id INTEGER PRIMARY KEY,
-        path TEXT UNIQUE NOT NULL,
-        content TEXT NOT NULL DEFAULT '',
-        comment TEXT NOT NULL DEFAULT '',
-        timestamp INTEGER NOT NULL)
-    """,
-
-    "CREATE UNIQUE INDEX img_path_idx ON image (path)",
-    "CREATE INDEX img_time_idx ON image (timestamp)",
-    "CREATE VIRTUAL TABLE img_index USING fts4(path, content, comment)",
+# The full text index is an external content table on top of image, linked
+# by rowid, so it does not keep a second copy of the text. The triggers
+# keep it in sync with the image table.
+FTS_QUERIES: Final[List[str]] = [
+    """
+CREATE VIRTUAL TABLE img_index USING fts5(path,
+                                          content,
+                                          comment,
+                                          content='image',
+                                          content_rowid='id')
+""",
 
     """
 CREATE TRIGGER tr_fts_img_add
 AFTER INSERT ON image
 BEGIN
-    INSERT INTO img_index (path, content, comment)
-    VALUES (new.path, new.content, new.comment);
+    INSERT INTO img_index (rowid, path, content, comment)
+    VALUES (new.id, new.path, new.content, new.comment);
 END;
 """,
 
@@ -70,7 +73,8 @@ END;
 CREATE TRIGGER tr_fts_img_del
 AFTER DELETE ON image
 BEGIN
-    DELETE FROM img_index WHERE path = old.path;
+    INSERT INTO img_index (img_index, rowid, path, content, comment)
+    VALUES ('delete', old.id, old.path, old.content, old.comment);
 END;
 """,
 
@@ -78,63 +82,336 @@ END;
 CREATE TRIGGER tr_fts_img_up
 AFTER UPDATE ON image
 BEGIN
-    DELETE FROM img_index WHERE path = old.path;
-    INSERT INTO img_index (path, content, comment)
-    VALUES (new.path, new.content, new.comment);
+    INSERT INTO img_index (img_index, rowid, path, content, comment)
+    VALUES ('delete', old.id, old.path, old.content, old.comment);
+    INSERT INTO img_index (rowid, path, content, comment)
+    VALUES (new.id, new.path, new.content, new.comment);
+END;
+""",
+]
+
+# The states of a job in the job table.
+JOB_PENDING: Final[int] = 0
+JOB_ACTIVE: Final[int] = 1
+JOB_DONE: Final[int] = 2
+JOB_FAILED: Final[int] = 3
+
+# A job is the path, mtime, size and root of an image.
+Job = tuple[str, int, int, str]
+
+# The job table holds the images waiting to be read, so a scan that is
+# interrupted can be resumed. A job is done once its image is stored.
+JOB_QUERIES: Final[List[str]] = [
+    f"""
+CREATE TABLE job (id        INTEGER PRIMARY KEY,
+                  path      TEXT UNIQUE NOT NULL,
+                  mtime     INTEGER NOT NULL,
+                  size      INTEGER NOT NULL,
+                  root      TEXT NOT NULL DEFAULT '',
+                  state     INTEGER NOT NULL DEFAULT {JOB_PENDING},
+                  attempts  INTEGER NOT NULL DEFAULT 0,
+                  error     TEXT NOT NULL DEFAULT '')
+""",
+    "CREATE INDEX job_state_idx ON job (state)",
+
+    f"""
+CREATE TRIGGER tr_job_add
+AFTER INSERT ON image
+BEGIN
+    UPDATE job SET state = {JOB_DONE} WHERE path = new.path;
+END;
+""",
+
+    f"""
+CREATE TRIGGER tr_job_up
+AFTER UPDATE OF content, timestamp ON image
+BEGIN
+    UPDATE job SET state = {JOB_DONE} WHERE path = new.path;
 END;
 """,
+]
+
+# Each job belongs to the process (by pid) that queued it, so a process
+# only takes over the jobs of processes that are gone.
+JOB_OWNER_QUERIES: Final[List[str]] = [
+    "ALTER TABLE job ADD COLUMN owner INTEGER NOT NULL DEFAULT 0",
+    "CREATE INDEX job_owner_idx ON job (owner, state)",
+]
+
+INIT_QUERIES: Final[List[str]] = [
+    """CREATE TABLE image (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        content TEXT NOT NULL DEFAULT '',
+        comment TEXT NOT NULL DEFAULT '',
+        timestamp INTEGER NOT NULL,
+        skipped INTEGER NOT NULL DEFAULT 0)
+    """,
+
+    "CREATE UNIQUE INDEX img_path_idx ON image (path)",
+    "CREATE INDEX img_time_idx ON image (timestamp)",
+    "CREATE INDEX img_skipped_idx ON image (id) WHERE skipped",
+
+    *FTS_QUERIES,
 
     """
 CREATE TABLE folder (id        INTEGER PRIMARY KEY,
                      path      TEXT UNIQUE NOT NULL,
                      timestamp INTEGER NOT NULL)
 """,
+
+    """
+CREATE TABLE directory (id    INTEGER PRIMARY KEY,
+                        path  TEXT UNIQUE NOT NULL,
+                        mtime INTEGER NOT NULL)
+""",
+
+    *JOB_QUERIES,
+    *JOB_OWNER_QUERIES,
 ]
 
+# The schema version of a freshly created database.
+DB_VERSION: Final[int] = 5
+
+# MIGRATIONS maps each schema version to the queries that bring a database
+# from the previous version up to it.
+MIGRATIONS: Final[dict[int, List[str]]] = {
+    1: [
+        """
+CREATE TABLE directory (id    INTEGER PRIMARY KEY,
+                        path  TEXT UNIQUE NOT NULL,
+                        mtime INTEGER NOT NULL)
+""",
+    ],
+    # Replace the fts4 index, which kept a copy of all the text, with an
+    # external content fts5 index.
+    2: [
+        "DROP TRIGGER IF EXISTS tr_fts_img_add",
+        "DROP TRIGGER IF EXISTS tr_fts_img_del",
+        "DROP TRIGGER IF EXISTS tr_fts_img_up",
+        "DROP TABLE IF EXISTS img_index",
+        *FTS_QUERIES,
+        "INSERT INTO img_index (img_index) VALUES ('rebuild')",
+    ],
+    # Remember which images the prefilter kept away from OCR.
+    3: [
+        "ALTER TABLE image ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX img_skipped_idx ON image (id) WHERE skipped",
+    ],
+    4: JOB_QUERIES,
+    5: JOB_OWNER_QUERIES,
+}
+
+# After an upgrade, the database is vacuumed if more than this fraction of
+# its pages is unused.
+VACUUM_THRESHOLD: Final[float] = 0.25
+
+CHECKPOINT_MODES: Final[tuple[str, ...]] = \
+    ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+# SQLite limits the number of parameters in a single query.
+STAMP_CHUNK_SIZE: Final[int] = 500
+
+# cleanup checks this many images at a time, from as many threads, since
+# on network storage most of the time is spent waiting for stat.
+CLEANUP_CHUNK_SIZE: Final[int] = STAMP_CHUNK_SIZE
+CLEANUP_WORKERS: Final[int] = 16
+
+# The number of rows file_search_iter fetches from SQLite at a time.
+SEARCH_FETCH_SIZE: Final[int] = 256
+
+# The number of searches the Database keeps the results of, and the
+# maximum number of results a search may have to be cached.
+SEARCH_CACHE_SIZE: Final[int] = 64
+SEARCH_CACHE_MAX_ROWS: Final[int] = 10_000
+
+# Sorts after every (timestamp, id) key.
+MAX_KEY: Final[tuple[int, int]] = (2**63 - 1, 2**63 - 1)
+
 open_lock: threading.Lock = threading.Lock()
 
 
+def quote_query(query: str) -> str:
+    """Turn a string into an fts5 query matching all its words literally."""
+    words: list[str] = query.split()
+    return " ".join('"' + w.replace('"', '""') + '"' for w in words)
+
+
+# Marks the start and end of a match in the snippets SQLite returns.
+SNIPPET_START: Final[str] = "\x02"
+SNIPPET_END: Final[str] = "\x03"
+
+
+def parse_snippet(raw: str) -> image.Snippet:
+    """Strip the match markers from a snippet, noting their offsets."""
+    text: list[str] = []
+    matches: list[tuple[int, int]] = []
+    length: int = 0
+    start: int = 0
+    for i, part in enumerate(raw.split(SNIPPET_START)):
+        if i > 0:
+            start = length
+            match, _, part = part.partition(SNIPPET_END)
+            text.append(match)
+            length += len(match)
+            matches.append((start, length))
+        text.append(part)
+        length += len(part)
+    return image.Snippet("".join(text), matches)
+
+
+def search_key(img: image.Image) -> tuple[int, int]:
+    """Return the keyset pagination key for an image.
+
+    Pass the key of the last image of one page of search results as after
+    to file_search_iter to get the next page.
+    """
+    return (int(img.timestamp.timestamp()), img.dbid)
+
+
+def path_range(folder: str) -> tuple[str, str]:
+    """Return the bounds of the paths below folder.
+
+    All paths below folder sort between these two strings, which allows
+    SQLite to use the index on image.path, unlike LIKE or GLOB.
+    """
+    base: str = folder.rstrip(os.sep)
+    return (base + os.sep, base + chr(ord(os.sep) + 1))
+
+
+def process_alive(pid: int) -> bool:
+    """Return True if a process with the given pid is running."""
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
 class Query(Enum):
     """Query provides symbolic constants for database queries."""
 
     FILE_ADD = auto()
     FILE_UPDATE = auto()
     FILE_DELETE = auto()
+    FILE_DELETE_PATH = auto()
+    FILE_DELETE_TREE = auto()
+    FILE_DELETE_MANY = auto()
     FILE_SEARCH = auto()
+    FILE_SEARCH_RANK = auto()
+    FILE_SNIPPETS = auto()
+    FILE_COMMENT = auto()
     FILE_STAMP = auto()
+    FILE_STAMP_COUNT = auto()
+    FILE_STAMP_RANGE = auto()
+    FILE_STAMP_MANY = auto()
     FILE_GET_ALL = auto()
+    FILE_GET_CHUNK = auto()
+    FILE_GET_CHUNK_TREE = auto()
+    FILE_GET_SKIPPED = auto()
     FOLDER_ADD = auto()
     FOLDER_FETCH_ALL = auto()
+    DIR_GET_ALL = auto()
+    DIR_UPDATE = auto()
+    DIR_DELETE = auto()
+    JOB_ADD = auto()
+    JOB_START = auto()
+    JOB_FAIL = auto()
+    JOB_PRUNE = auto()
+    JOB_OWNERS = auto()
+    JOB_ADOPT = auto()
+    JOB_PENDING = auto()
+    JOB_COUNT = auto()
 
 
 DB_QUERIES: Final[dict[Query, str]] = {
     Query.FILE_ADD:
-    """INSERT INTO image (path, content, comment, timestamp)
-    VALUES (?, ?, ?, ?)
+    """INSERT INTO image (path, content, comment, timestamp, skipped)
+    VALUES (?, ?, ?, ?, ?)
     ON CONFLICT(path) DO
         UPDATE SET content=excluded.content,
                    comment=excluded.comment,
-                   timestamp=excluded.timestamp
+                   timestamp=excluded.timestamp,
+                   skipped=excluded.skipped
     RETURNING id""",
     Query.FILE_DELETE:
     "DELETE FROM image WHERE id = ?",
+    Query.FILE_DELETE_PATH:
+    "DELETE FROM image WHERE path = ?",
+    Query.FILE_DELETE_TREE:
+    "DELETE FROM image WHERE path >= ? AND path < ?",
+    # The placeholders are filled in by cleanup
+    Query.FILE_DELETE_MANY:
+    "DELETE FROM image WHERE id IN ({})",
     Query.FILE_UPDATE:
     "UPDATE image SET content = ?, comment = ?, timestamp = ? WHERE id = ?",
+    # {content} is filled in by file_search_iter, so callers that do not
+    # need the text do not have to load it.
     Query.FILE_SEARCH:
     """
 SELECT
     f.id,
     f.path,
-    f.content,
+    {content},
+    COALESCE(f.comment, '') AS comment,
+    f.timestamp
+FROM img_index i
+INNER JOIN image f ON i.rowid = f.id
+WHERE img_index MATCH ? AND (f.timestamp, f.id) < (?, ?)
+ORDER BY f.timestamp DESC, f.id DESC
+LIMIT ?
+    """,
+    Query.FILE_SEARCH_RANK:
+    """
+SELECT
+    f.id,
+    f.path,
+    {content},
     COALESCE(f.comment, '') AS comment,
     f.timestamp
 FROM img_index i
-INNER JOIN image f ON i.path = f.path
+INNER JOIN image f ON i.rowid = f.id
 WHERE img_index MATCH ?
-ORDER BY f.timestamp DESC
+ORDER BY i.rank
+LIMIT ?
+    """,
+    # snippet() picks the column with the best matches by itself.
+    # The placeholders are filled in by file_search_iter.
+    Query.FILE_SNIPPETS:
+    """
+SELECT rowid, snippet(img_index, -1, char(2), char(3), '…', 16)
+FROM img_index
+WHERE img_index MATCH ? AND rowid IN ({})
     """,
+    Query.FILE_COMMENT: "UPDATE image SET comment = ? WHERE id = ?",
     Query.FILE_STAMP: "SELECT timestamp FROM image WHERE path = ?",
+    Query.FILE_STAMP_COUNT:
+    "SELECT COUNT(id) FROM image WHERE path >= ? AND path < ?",
+    Query.FILE_STAMP_RANGE: """
+SELECT path, timestamp
+FROM image
+WHERE path >= ? AND path < ?
+ORDER BY path
+    """,
+    # The placeholders are filled in by file_stamps_for
+    Query.FILE_STAMP_MANY:
+    "SELECT path, timestamp FROM image WHERE path IN ({})",
     Query.FILE_GET_ALL: "SELECT id, path, content, comment, timestamp FROM image",  # noqa: E501
+    Query.FILE_GET_CHUNK:
+    "SELECT id, path FROM image WHERE id > ? ORDER BY id LIMIT ?",
+    Query.FILE_GET_CHUNK_TREE: """
+SELECT id, path
+FROM image
+WHERE id > ? AND path >= ? AND path < ?
+ORDER BY id
+LIMIT ?
+    """,
+    Query.FILE_GET_SKIPPED:
+    "SELECT path FROM image WHERE skipped ORDER BY id",
     Query.FOLDER_ADD: """
     INSERT INTO folder (path, timestamp)
     VALUES             (   ?,         ?)
@@ -143,18 +420,84 @@ ORDER BY f.timestamp DESC
     RETURNING id
     """,
     Query.FOLDER_FETCH_ALL: "SELECT path FROM folder",
+    Query.DIR_GET_ALL: """
+SELECT path, mtime
+FROM directory
+WHERE path = ? OR (path >= ? AND path < ?)
+    """,
+    Query.DIR_UPDATE: """
+    INSERT INTO directory (path, mtime)
+    VALUES                (   ?,     ?)
+    ON CONFLICT(path) DO
+        UPDATE SET mtime=excluded.mtime
+    """,
+    Query.DIR_DELETE: "DELETE FROM directory WHERE path = ?",
+    # A path that is already pending or being read is not queued again.
+    Query.JOB_ADD: f"""
+    INSERT INTO job (path, mtime, size, root, owner)
+    VALUES          (   ?,     ?,    ?,    ?,     ?)
+    ON CONFLICT(path) DO
+        UPDATE SET mtime=excluded.mtime,
+                   size=excluded.size,
+                   root=excluded.root,
+                   owner=excluded.owner,
+                   state={JOB_PENDING},
+                   attempts=0,
+                   error=''
+        WHERE state IN ({JOB_DONE}, {JOB_FAILED})
+    RETURNING path
+    """,
+    Query.JOB_START: f"""
+    UPDATE job SET state = {JOB_ACTIVE}, attempts = attempts + 1
+    WHERE path = ? AND state = {JOB_PENDING}
+    """,
+    Query.JOB_FAIL:
+    f"UPDATE job SET state = {JOB_FAILED}, error = ? WHERE path = ?",
+    Query.JOB_PRUNE: f"DELETE FROM job WHERE state = {JOB_DONE}",
+    Query.JOB_OWNERS: f"""
+    SELECT DISTINCT owner FROM job WHERE state IN ({JOB_PENDING}, {JOB_ACTIVE})
+    """,
+    Query.JOB_ADOPT: f"""
+    UPDATE job SET owner = ?, state = {JOB_PENDING}
+    WHERE owner = ? AND state IN ({JOB_PENDING}, {JOB_ACTIVE})
+    """,
+    Query.JOB_PENDING: f"""
+    SELECT path, mtime, size, root FROM job
+    WHERE owner = ? AND state = {JOB_PENDING}
+    ORDER BY id
+    """,
+    Query.JOB_COUNT: "SELECT state, COUNT(*) FROM job GROUP BY state",
 }
 
 
-class Database:  # pylint: disable-msg=R0903
-    """Database wraps the database connection."""
+class Database:  # pylint: disable-msg=R0903,R0902
+    """Database wraps the database connection.
+
+    The results of recent searches are cached. The cache is tied to a
+    write generation, which our own writes bump, combined with SQLite's
+    data_version, which changes when other connections commit. A cached
+    result is only used if neither has changed since.
+    """
 
     log: logging.Logger
     path: Final[str]  # pylint: disable-msg=C0103
     db: sqlite3.Connection
-
-    def __init__(self, path: str) -> None:
+    generation: int
+    cache_size: int
+    search_cache: OrderedDict[tuple,
+                              tuple[tuple[int, int], list[image.Image]]]
+    cache_hits: int
+    cache_misses: int
+
+    def __init__(self,
+                 path: str,
+                 cache_size: int = SEARCH_CACHE_SIZE) -> None:
         self.path = path
+        self.generation = 0
+        self.cache_size = cache_size
+        self.search_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.log = common.get_logger("database")
         self.log.debug("Open database at %s", path)
         with open_lock:
@@ -165,16 +508,52 @@ class Database:  # pylint: disable-msg=R0903
             cur: sqlite3.Cursor = self.db.cursor()
             cur.execute("PRAGMA foreign_keys = true")
             cur.execute("PRAGMA journal_mode = WAL")
+            # The journal_mode pragma returns a row, and as long as that
+            # statement is active, we cannot drop tables.
+            cur.close()
 
             if not exist:
                 self.__create_db()
+            else:
+                self.__upgrade_db()
 
     def __create_db(self) -> None:
         """Initialize a fresh database."""
-        with self.db:
+        with self.transaction():
             for query in INIT_QUERIES:
                 cur: sqlite3.Cursor = self.db.cursor()
                 cur.execute(query)
+            self.db.execute(f"PRAGMA user_version = {DB_VERSION}")
+
+    def __upgrade_db(self) -> None:
+        """Bring the schema of an existing database up to date."""
+        version: int = self.__pragma("user_version")
+        if version >= DB_VERSION:
+            return
+        while version < DB_VERSION:
+            version += 1
+            self.log.info("Upgrade database schema to version %d", version)
+            # The connection is in autocommit mode, so we need an explicit
+            # transaction to keep a failed step from leaving half a schema.
+            with self.transaction():
+                for query in MIGRATIONS[version]:
+                    self.db.execute(query)
+                self.db.execute(f"PRAGMA user_version = {version}")
+
+        pages: int = self.__pragma("page_count")
+        free: int = self.__pragma("freelist_count")
+        if pages > 0 and free / pages > VACUUM_THRESHOLD:
+            self.log.info("Vacuum database, %d of %d pages are unused",
+                          free,
+                          pages)
+            self.db.execute("VACUUM")
+
+    def __pragma(self, name: str) -> int:
+        """Return the value of an integer pragma."""
+        cur: sqlite3.Cursor = self.db.cursor()
+        cur.execute(f"PRAGMA {name}")
+        rows = cur.fetchall()
+        return rows[0][0]
 
     def __enter__(self):
         self.db.__enter__()
@@ -182,33 +561,209 @@ class Database:  # pylint: disable-msg=R0903
     def __exit__(self, ex_type, ex_val, traceback):
         return self.db.__exit__(ex_type, ex_val, traceback)
 
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the statements of a with block in a single transaction.
+
+        The connection is in autocommit mode, so using it as a context
+        manager does not group statements, each one is committed (and
+        synced) by itself.
+        """
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
     # pylint: disable-msg=C0301
-    def file_add(self, path: str, content: str, comment: str = "", timestamp: datetime = datetime.min) -> image.Image:  # noqa
+    def file_add(self,
+                 path: str,
+                 content: str,
+                 comment: str = "",
+                 timestamp: datetime = datetime.min,
+                 skipped: bool = False) -> image.Image:
         """Add the file to the database."""
         # self.log.debug("Add image %s", path)
+        self.generation += 1
         with self.db:
             cur: sqlite3.Cursor = self.db.cursor()
             cur.execute(DB_QUERIES[Query.FILE_ADD],
                         (path,
                          content,
                          comment,
-                         int(timestamp.timestamp())))
+                         int(timestamp.timestamp()),
+                         skipped))
             row = cur.fetchone()
-            return image.Image(row[0], path, content, comment, timestamp)
-
-    def file_search(self, query: str) -> list[image.Image]:
-        """Search for files matching the given query"""
+            return image.Image(row[0],
+                               path,
+                               content,
+                               comment,
+                               timestamp,
+                               skipped=skipped)
+
+    def file_add_many(self, images: list[image.Image]) -> None:
+        """Add or update several images in a single transaction."""
+        self.generation += 1
+        with self.transaction():
+            cur: sqlite3.Cursor = self.db.cursor()
+            cur.executemany(DB_QUERIES[Query.FILE_ADD],
+                            [(img.path,
+                              img.content,
+                              img.comment,
+                              int(img.timestamp.timestamp()),
+                              img.skipped)
+                             for img in images])
+
+    def file_search(self,
+                    query: str,
+                    rank: bool = False) -> list[image.Image]:
+        """Search for files matching the given query
+
+        Results are ordered by timestamp, newest first, or by relevance
+        (bm25) if rank is True.
+        """
         # self.log.debug("Searching for images matching '%s'", query)
+        return list(self.file_search_iter(query, rank=rank))
+
+    def __write_generation(self) -> tuple[int, int]:
+        """Return a value that changes whenever the database is modified."""
+        return (self.generation, self.__pragma("data_version"))
+
+    def cache_stats(self) -> dict[str, int]:
+        """Return the hit and miss counts and the size of the search cache"""
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "size": len(self.search_cache),
+        }
+
+    # pylint: disable-msg=R0913
+    def file_search_iter(self,
+                         query: str,
+                         limit: int = -1,
+                         after: Optional[tuple[int, int]] = None,
+                         content: bool = True,
+                         rank: bool = False,
+                         snippets: bool = False) -> Iterator[image.Image]:
+        """Yield the images matching the given query.
+
+        See __search for the meaning of the arguments. Results are served
+        from the search cache if possible, and added to it if the caller
+        consumes all of them.
+        """
+        key: tuple = (" ".join(query.split()),
+                      limit,
+                      after,
+                      content,
+                      rank,
+                      snippets)
+        gen: tuple[int, int] = self.__write_generation()
+        cached = self.search_cache.get(key)
+        if cached is not None and cached[0] == gen:
+            self.cache_hits += 1
+            self.search_cache.move_to_end(key)
+            yield from cached[1]
+            return
+
+        self.cache_misses += 1
         results: list[image.Image] = []
+        for img in self.__search(query,
+                                 limit,
+                                 after,
+                                 content,
+                                 rank,
+                                 snippets):
+            if len(results) <= SEARCH_CACHE_MAX_ROWS:
+                results.append(img)
+            yield img
+
+        if len(results) <= SEARCH_CACHE_MAX_ROWS and self.cache_size > 0:
+            self.search_cache[key] = (gen, results)
+            self.search_cache.move_to_end(key)
+            while len(self.search_cache) > self.cache_size:
+                self.search_cache.popitem(last=False)
+
+    # pylint: disable-msg=R0913,R0914
+    def __search(self,
+                 query: str,
+                 limit: int = -1,
+                 after: Optional[tuple[int, int]] = None,
+                 content: bool = True,
+                 rank: bool = False,
+                 snippets: bool = False) -> Iterator[image.Image]:
+        """Yield the images matching the given query.
+
+        Rows are fetched from SQLite in small batches as the caller consumes
+        them, rather than building the full list of results up front.
+
+        limit caps the number of results, -1 means no limit.
+        after is a key as returned by search_key, only images that come
+        after it are returned. It cannot be combined with rank.
+        If content is False, the OCR text is not loaded, and the images'
+        content is an empty string.
+        Results are ordered by timestamp, newest first, or by relevance
+        (bm25) if rank is True.
+        If snippets is True, each image comes with a Snippet of the text
+        around the matches, computed by SQLite for the rows we return only.
+        """
+        column: str = "f.content" if content else "''"
+        params: list = []
+        if rank:
+            if after is not None:
+                raise ValueError(
+                    "Cannot paginate search results ordered by rank")
+            q: str = DB_QUERIES[Query.FILE_SEARCH_RANK].format(content=column)
+            params = [query, limit]
+        else:
+            key: tuple[int, int] = after if after is not None else MAX_KEY
+            q = DB_QUERIES[Query.FILE_SEARCH].format(content=column)
+            params = [query, key[0], key[1], limit]
+
+        cur: sqlite3.Cursor = self.db.cursor()
+        try:
+            cur.execute(q, params)
+        except sqlite3.OperationalError:
+            # fts5 is a lot pickier about its query syntax than fts4 was,
+            # so if the query does not parse, search for the plain words.
+            params[0] = quote_query(query)
+            if params[0] == "":
+                return
+            cur.execute(q, params)
+
+        while True:
+            rows = cur.fetchmany(SEARCH_FETCH_SIZE)
+            if len(rows) == 0:
+                return
+            found: dict[int, image.Snippet] = {}
+            if snippets:
+                found = self.__snippets(params[0], [row[0] for row in rows])
+            for row in rows:
+                yield image.Image(row[0],
+                                  row[1],
+                                  row[2],
+                                  row[3],
+                                  datetime.fromtimestamp(row[4]),
+                                  found.get(row[0]))
+
+    def __snippets(self,
+                   query: str,
+                   ids: list[int]) -> dict[int, image.Snippet]:
+        """Return the snippets for the given images."""
+        q: str = DB_QUERIES[Query.FILE_SNIPPETS].format(
+            ", ".join("?" * len(ids)))
         cur: sqlite3.Cursor = self.db.cursor()
-        for row in cur.execute(DB_QUERIES[Query.FILE_SEARCH], (query, )):
-            img = image.Image(row[0],
-                              row[1],
-                              row[2],
-                              row[3],
-                              datetime.fromtimestamp(row[4]))
-            results.append(img)
-        return results
+        result: dict[int, image.Snippet] = {}
+        for row in cur.execute(q, [query, *ids]):
+            result[row[0]] = parse_snippet(row[1])
+        return result
+
+    def file_set_comment(self, dbid: int, comment: str) -> None:
+        """Set the comment of an image."""
+        self.generation += 1
+        with self.db:
+            self.db.execute(DB_QUERIES[Query.FILE_COMMENT], (comment, dbid))
 
     def file_timestamp(self, path: str) -> Optional[datetime]:
         """Return the given images timestamp"""
@@ -223,14 +778,131 @@ class Database:  # pylint: disable-msg=R0903
         except UnicodeEncodeError:
             return None
 
-    def cleanup(self) -> None:
-        """Remove non-existent files from the database"""
+    def file_get_skipped(self) -> list[str]:
+        """Return the paths of the images the prefilter kept from OCR."""
+        cur: sqlite3.Cursor = self.db.cursor()
+        cur.execute(DB_QUERIES[Query.FILE_GET_SKIPPED])
+        return [row[0] for row in cur.fetchall()]
+
+    def file_stamp_count(self, folder: str) -> int:
+        """Return the number of images below the given folder."""
+        cur: sqlite3.Cursor = self.db.cursor()
+        cur.execute(DB_QUERIES[Query.FILE_STAMP_COUNT], path_range(folder))
+        return cur.fetchone()[0]
+
+    def file_stamps(self, folder: str) -> Iterator[tuple[str, int]]:
+        """Yield path and timestamp of all images below folder.
+
+        Images are returned ordered by path, rows are fetched lazily.
+        """
+        cur: sqlite3.Cursor = self.db.cursor()
+        cur.execute(DB_QUERIES[Query.FILE_STAMP_RANGE], path_range(folder))
+        while True:
+            rows = cur.fetchmany(STAMP_CHUNK_SIZE)
+            if len(rows) == 0:
+                return
+            for row in rows:
+                yield (row[0], row[1])
+
+    def file_stamps_for(self, paths: list[str]) -> dict[str, int]:
+        """Return the timestamps of those of the given paths we know."""
+        stamps: dict[str, int] = {}
+        cur: sqlite3.Cursor = self.db.cursor()
+        for i in range(0, len(paths), STAMP_CHUNK_SIZE):
+            chunk: list[str] = []
+            for p in paths[i:i+STAMP_CHUNK_SIZE]:
+                try:
+                    p.encode()
+                    chunk.append(p)
+                except UnicodeEncodeError:
+                    continue
+            if len(chunk) == 0:
+                continue
+            query: str = DB_QUERIES[Query.FILE_STAMP_MANY].format(
+                ", ".join("?" * len(chunk)))
+            for row in cur.execute(query, chunk):
+                stamps[row[0]] = row[1]
+        return stamps
+
+    def file_remove(self, path: str) -> None:
+        """Remove the image with the given path from the database."""
+        self.generation += 1
+        with self.db:
+            self.db.execute(DB_QUERIES[Query.FILE_DELETE_PATH], (path, ))
+
+    def file_remove_tree(self, folder: str) -> None:
+        """Remove all images below the given folder from the database."""
+        self.generation += 1
         with self.db:
-            cur = self.db.cursor()
-            for row in cur.execute(DB_QUERIES[Query.FILE_GET_ALL]):
-                path: str = row[1]
-                if not krylib.fexist(path):
-                    self.db.execute(DB_QUERIES[Query.FILE_DELETE], (row[0], ))
+            self.db.execute(DB_QUERIES[Query.FILE_DELETE_TREE],
+                            path_range(folder))
+
+    def cleanup(self,
+                folder: Optional[str] = None,
+                progress: Optional[Callable[[int, int], None]] = None,
+                workers: int = CLEANUP_WORKERS) -> int:
+        """Remove non-existent files from the database
+
+        If folder is given, only images below it are checked.
+        Images are read in chunks ordered by id, and the files of a chunk
+        are checked for in a pool of worker threads. The missing ones
+        are deleted in one short statement per chunk, so the Writer is
+        never locked out for long. After each chunk, progress (if given)
+        is called with the number of images checked and removed so far.
+
+        Returns the number of images removed.
+        """
+        query: str = DB_QUERIES[Query.FILE_GET_CHUNK]
+        bounds: tuple[str, ...] = ()
+        if folder is not None:
+            query = DB_QUERIES[Query.FILE_GET_CHUNK_TREE]
+            bounds = path_range(folder)
+        last: int = 0
+        checked: int = 0
+        removed: int = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                cur: sqlite3.Cursor = self.db.cursor()
+                cur.execute(query, (last, *bounds, CLEANUP_CHUNK_SIZE))
+                rows = cur.fetchall()
+                if len(rows) == 0:
+                    return removed
+                last = rows[-1][0]
+                gone: list[int] = [row[0] for row, exist in
+                                   zip(rows, pool.map(krylib.fexist,
+                                                      (r[1] for r in rows)))
+                                   if not exist]
+                if len(gone) > 0:
+                    self.generation += 1
+                    with self.db:
+                        self.db.execute(
+                            DB_QUERIES[Query.FILE_DELETE_MANY].format(
+                                ", ".join("?" * len(gone))),
+                            gone)
+                checked += len(rows)
+                removed += len(gone)
+                if progress is not None:
+                    progress(checked, removed)
+
+    def set_autocheckpoint(self, pages: int) -> None:
+        """Set the WAL autocheckpoint threshold for this connection.
+
+        0 disables automatic checkpoints, in which case checkpoint() should
+        be called regularly.
+        """
+        self.db.execute(f"PRAGMA wal_autocheckpoint = {int(pages)}")
+
+    def checkpoint(self, mode: str = "PASSIVE") -> tuple[int, int, int]:
+        """Run a WAL checkpoint.
+
+        Returns a tuple of (busy, wal pages, checkpointed pages).
+        """
+        if mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Invalid checkpoint mode {mode}")
+        cur: sqlite3.Cursor = self.db.cursor()
+        cur.execute(f"PRAGMA wal_checkpoint({mode})")
+        row = cur.fetchone()
+        return (row[0], row[1], row[2])
 
     def folder_add(self, path) -> None:
         """Add or update a folder"""
@@ -239,6 +911,83 @@ class Database:  # pylint: disable-msg=R0903
             cur.execute(DB_QUERIES[Query.FOLDER_ADD],
                         (path, datetime.now().timestamp()))
 
+    def dir_get_all(self, folder: str) -> Iterator[tuple[str, int]]:
+        """Yield path and mtime of the directories recorded below folder.
+
+        The folder itself is included.
+        """
+        cur: sqlite3.Cursor = self.db.cursor()
+        lo, hi = path_range(folder)
+        for row in cur.execute(DB_QUERIES[Query.DIR_GET_ALL],
+                               (folder, lo, hi)):
+            yield (row[0], row[1])
+
+    def dir_update(self, dirs: list[tuple[str, int]]) -> None:
+        """Record the mtimes of the given directories."""
+        with self.db:
+            cur: sqlite3.Cursor = self.db.cursor()
+            cur.executemany(DB_QUERIES[Query.DIR_UPDATE], dirs)
+
+    def dir_delete(self, paths: list[str]) -> None:
+        """Forget about the given directories."""
+        with self.db:
+            cur: sqlite3.Cursor = self.db.cursor()
+            cur.executemany(DB_QUERIES[Query.DIR_DELETE],
+                            [(p, ) for p in paths])
+
+    def job_add_many(self, jobs: Sequence[Job], owner: int) -> list[Job]:
+        """Add images to the job table on behalf of the process owner.
+
+        Each job is a tuple of path, mtime, size and root. Returns the jobs
+        that were actually queued, i.e. without those that were already
+        pending or being read.
+        """
+        added: list[Job] = []
+        with self.transaction():
+            cur: sqlite3.Cursor = self.db.cursor()
+            for job in jobs:
+                cur.execute(DB_QUERIES[Query.JOB_ADD], (*job, owner))
+                if cur.fetchone() is not None:
+                    added.append(job)
+        return added
+
+    def job_start_many(self, paths: Sequence[str]) -> None:
+        """Mark a batch of jobs as being processed."""
+        with self.transaction():
+            self.db.executemany(DB_QUERIES[Query.JOB_START],
+                                [(p, ) for p in paths])
+
+    def job_fail(self, path: str, error: str) -> None:
+        """Mark a job as failed."""
+        with self.db:
+            self.db.execute(DB_QUERIES[Query.JOB_FAIL], (error, path))
+
+    def job_recover(self, owner: int) -> list[Job]:
+        """Take over the jobs of dead processes and return the pending jobs.
+
+        Finished jobs are removed. Jobs queued by owner itself, or by a
+        process that no longer runs, are pending again, jobs that were being
+        processed when that process ended did not finish. Jobs of processes
+        that are still running are left alone.
+        """
+        with self.transaction():
+            self.db.execute(DB_QUERIES[Query.JOB_PRUNE])
+            cur: sqlite3.Cursor = self.db.cursor()
+            cur.execute(DB_QUERIES[Query.JOB_OWNERS])
+            owners: list[int] = [row[0] for row in cur.fetchall()]
+            for pid in owners:
+                if pid == owner or not process_alive(pid):
+                    cur.execute(DB_QUERIES[Query.JOB_ADOPT], (owner, pid))
+            cur.execute(DB_QUERIES[Query.JOB_PENDING], (owner, ))
+            return [(row[0], row[1], row[2], row[3])
+                    for row in cur.fetchall()]
+
+    def job_count(self) -> dict[int, int]:
+        """Return the number of jobs in each state."""
+        cur: sqlite3.Cursor = self.db.cursor()
+        cur.execute(DB_QUERIES[Query.JOB_COUNT])
+        return {row[0]: row[1] for row in cur.fetchall()}
+
     def folder_get_all(self) -> list[str]:
         """Load all scanned folders from database."""
         cur: sqlite3.Cursor = self.db.cursor()
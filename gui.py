@@ -35,14 +35,16 @@ memex.gui
 
 import os
 import re
-from queue import Queue
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from threading import Lock, Thread
-from typing import Final
+from typing import Callable, Final, Optional
 
 # pylint: disable-msg=C0413,C0103
 import gi  # type: ignore
 
-from memex import common, database, image, reader, scanner
+from memex import common, database, image, pipeline, thumbnail, watcher
 
 gi.require_version("Gtk", "3.0")
 gi.require_version("Gdk", "3.0")
@@ -56,15 +58,311 @@ from gi.repository import Gtk as gtk  # noqa: E402 # pylint: disable-msg=C0411
 
 state_pat: Final[re.Pattern] = re.compile(r"(\d+)x(\d+)@(\d+),(\d+)")
 
+# The size of the thumbnails we display for search results, the number
+# of threads decoding them, and how many of them we hand to the main loop
+# at a time.
+THUMB_SIZE: Final[int] = thumbnail.THUMB_SIZE
+THUMB_WORKERS: Final[int] = min(4, os.cpu_count() or 1)
+THUMB_BATCH: Final[int] = 8
+# The size of a cell in the result grid, the number of rows above and below
+# the visible ones that get widgets too, the number of results we fetch
+# from the database at a time, and the number of decoded thumbnails we
+# keep around for rows that scrolled out of view.
+CELL_SIZE: Final[int] = THUMB_SIZE + 8
+OVERSCAN: Final[int] = 2
+PAGE_SIZE: Final[int] = 256
+PIXBUF_CACHE: Final[int] = 256
+
+
+def snippet_markup(snippet: image.Snippet) -> str:
+    """Render a snippet as Pango markup, with the matches in bold."""
+    parts: list[str] = []
+    pos: int = 0
+    for start, end in snippet.matches:
+        parts.append(glib.markup_escape_text(snippet.text[pos:start]))
+        parts.append("<b>")
+        parts.append(glib.markup_escape_text(snippet.text[start:end]))
+        parts.append("</b>")
+        pos = end
+    parts.append(glib.markup_escape_text(snippet.text[pos:]))
+    return "".join(parts)
+
+
+class Cell:  # pylint: disable-msg=R0903
+    """A widget in the result grid, along with the result it displays."""
+
+    __slots__ = ["box", "img", "index"]
+
+    box: gtk.EventBox
+    img: gtk.Image
+    index: int
+
+    def __init__(self) -> None:
+        self.box = gtk.EventBox()
+        self.img = gtk.Image()
+        self.index = -1
+        self.box.add(self.img)  # pylint: disable-msg=E1101
+
+
+class ResultGrid:  # pylint: disable-msg=R0902
+    """ResultGrid displays search results as a grid of thumbnails.
+
+    Only the visible rows, plus OVERSCAN rows above and below them, have
+    widgets, which are recycled as the grid is scrolled. Results are
+    fetched from the database a page at a time as the user scrolls towards
+    the end, and thumbnails are decoded in a pool of background threads.
+    """
+
+    # pylint: disable-msg=R0913
+    def __init__(self,
+                 db: database.Database,
+                 on_click: Callable[[image.Image], None]) -> None:
+        self.log = common.get_logger("grid")
+        self.db = db
+        self.on_click = on_click
+        self.thumbs = thumbnail.ThumbnailStore(common.path.thumbnails(),
+                                               THUMB_SIZE)
+        self.thumb_pool = ThreadPoolExecutor(max_workers=THUMB_WORKERS,
+                                             thread_name_prefix="thumb")
+        # Incremented whenever the results are cleared, so thumbnail loads
+        # for an earlier search can tell they are no longer wanted.
+        self.generation: int = 0
+        self.query: str = ""
+        self.results: list[image.Image] = []
+        self.exhausted: bool = True
+        self.columns: int = 1
+        self.cells: dict[int, Cell] = {}
+        # The range of results that have cells, as of the last update.
+        # The thumbnail pool reads this instead of cells, which only the
+        # main loop may touch.
+        self.visible: tuple[int, int] = (0, 0)
+        self.spare: list[Cell] = []
+        self.pixbufs: OrderedDict[int, gpb.Pixbuf] = OrderedDict()
+        self.pending: set[int] = set()
+
+        self.view = gtk.ScrolledWindow()
+        self.layout = gtk.Layout()
+        self.view.set_policy(gtk.PolicyType.NEVER,
+                             gtk.PolicyType.AUTOMATIC)
+        self.view.add(self.layout)  # pylint: disable-msg=E1101
+        self.view.get_vadjustment().connect("value-changed", self.__update)
+        self.layout.connect("size-allocate", self.__resize)
+
+    def search(self, query: str) -> None:
+        """Display the results for a query."""
+        self.clear()
+        self.query = query
+        self.exhausted = False
+        self.__fetch()
+        self.__update()
+
+    def clear(self) -> None:
+        """Remove all results from the grid.
+
+        Thumbnails for the previous search that are still being loaded
+        are discarded.
+        """
+        self.generation += 1
+        for cell in self.cells.values():
+            cell.box.hide()
+            self.spare.append(cell)
+        self.cells.clear()
+        self.visible = (0, 0)
+        self.results.clear()
+        self.pixbufs.clear()
+        self.pending.clear()
+        self.exhausted = True
+        self.view.get_vadjustment().set_value(0)
+        self.__set_height()
+
+    def close(self) -> None:
+        """Cancel pending thumbnail loads and stop the thumbnail pool."""
+        self.generation += 1
+        self.thumb_pool.shutdown(wait=False, cancel_futures=True)
+
+    def __fetch(self) -> None:
+        """Fetch the next page of results from the database."""
+        after: Optional[tuple[int, int]] = None
+        if len(self.results) > 0:
+            after = database.search_key(self.results[-1])
+        page: list[image.Image] = list(
+            self.db.file_search_iter(self.query,
+                                     limit=PAGE_SIZE,
+                                     after=after,
+                                     content=False,
+                                     snippets=True))
+        self.results.extend(page)
+        if len(page) < PAGE_SIZE:
+            self.exhausted = True
+        self.__set_height()
+
+    def __set_height(self) -> None:
+        """Make the layout as large as the results we have so far."""
+        rows: int = -(-len(self.results) // self.columns)
+        self.layout.set_size(self.columns * CELL_SIZE, rows * CELL_SIZE)
+
+    def __resize(self, _: gtk.Layout, alloc: gdk.Rectangle) -> None:
+        """Rearrange the grid when the number of columns changes."""
+        columns: int = max(1, alloc.width // CELL_SIZE)
+        if columns == self.columns:
+            return
+        self.columns = columns
+        self.__set_height()
+        for cell in self.cells.values():
+            self.__place(cell)
+        self.__update()
+
+    def __place(self, cell: Cell) -> None:
+        """Move a cell to the position of its result."""
+        row, col = divmod(cell.index, self.columns)
+        self.layout.move(cell.box, col * CELL_SIZE, row * CELL_SIZE)
+
+    def __update(self, *args) -> None:  # pylint: disable-msg=W0613
+        """Make sure the visible results have widgets, and only those."""
+        adj: gtk.Adjustment = self.view.get_vadjustment()
+        top: float = adj.get_value()
+        first_row: int = max(0, int(top // CELL_SIZE) - OVERSCAN)
+        bottom: float = top + adj.get_page_size()
+        last_row: int = int(bottom // CELL_SIZE) + OVERSCAN
+        end: int = (last_row + 1) * self.columns
+        if end >= len(self.results) and not self.exhausted:
+            self.__fetch()
+        first: int = first_row * self.columns
+        end = min(end, len(self.results))
+        self.visible = (first, end)
+
+        for idx in [i for i in self.cells if i < first or i >= end]:
+            cell = self.cells.pop(idx)
+            cell.box.hide()
+            self.spare.append(cell)
+
+        missing: list[int] = []
+        for idx in range(first, end):
+            if idx in self.cells:
+                continue
+            self.__bind(idx)
+            if idx not in self.pixbufs and idx not in self.pending:
+                missing.append(idx)
+
+        for i in range(0, len(missing), THUMB_BATCH):
+            batch: list[tuple[int, image.Image]] = \
+                [(idx, self.results[idx]) for idx in missing[i:i+THUMB_BATCH]]
+            self.pending.update(idx for idx, _ in batch)
+            self.thumb_pool.submit(self.__load_batch, self.generation, batch)
+
+    def __bind(self, idx: int) -> Cell:
+        """Attach a cell to the result at the given index."""
+        if len(self.spare) > 0:
+            cell = self.spare.pop()
+        else:
+            cell = Cell()
+            cell.box.connect("button-press-event", self.__press, cell)
+            self.layout.put(cell.box, 0, 0)
+        cell.index = idx
+        self.cells[idx] = cell
+        self.__place(cell)
+        img: image.Image = self.results[idx]
+        if img.snippet is not None:
+            cell.box.set_tooltip_markup(snippet_markup(img.snippet))
+        else:
+            cell.box.set_tooltip_text(img.path)
+        pb: Optional[gpb.Pixbuf] = self.pixbufs.get(idx)
+        if pb is not None:
+            self.pixbufs.move_to_end(idx)
+            cell.img.set_from_pixbuf(pb)
+        else:
+            cell.img.clear()
+        cell.box.show_all()
+        return cell
+
+    def __press(self,
+                _: gtk.EventBox,
+                ev: gdk.EventButton,
+                cell: Cell) -> bool:
+        """Pass a click on a cell on to our owner."""
+        if ev.button == 1 and 0 <= cell.index < len(self.results):
+            self.on_click(self.results[cell.index])
+            return True
+        return False
+
+    def __load_thumb(self, img_file: image.Image) -> Optional[gpb.Pixbuf]:
+        """Decode the thumbnail for an image. Runs in the thumbnail pool.
+
+        Thumbnails come from the thumbnail store if possible, we only
+        scale the full image if the store cannot render one. Returns None
+        if neither works, e.g. because the file is gone or the store is
+        locked.
+        """
+        try:
+            data: Optional[bytes] = self.thumbs.thumbnail(img_file.path)
+            if data is not None:
+                loader = gpb.PixbufLoader()
+                loader.write(data)
+                loader.close()
+                return loader.get_pixbuf()
+            return gpb.Pixbuf.new_from_file_at_scale(
+                filename=img_file.path,
+                width=THUMB_SIZE,
+                height=THUMB_SIZE,
+                preserve_aspect_ratio=True)
+        except (glib.GError, sqlite3.Error, OSError) as ex:
+            self.log.debug("Error processing %s: %s",
+                           img_file.path,
+                           ex)
+            return None
+
+    def __load_batch(self,
+                     gen: int,
+                     batch: list[tuple[int, image.Image]]) -> None:
+        """Decode a batch of thumbnails and hand them to the main loop.
+
+        Results that have been scrolled out of view in the meantime are
+        skipped, they are requested again when they come back. The
+        pixbufs are only applied to the cells by __thumbs_ready. Whatever
+        happens, the whole batch is handed back, so no index stays pending.
+        """
+        done: list[tuple[int, Optional[gpb.Pixbuf]]] = []
+        try:
+            for idx, img_file in batch:
+                if gen != self.generation:
+                    return
+                first, end = self.visible
+                if first <= idx < end:
+                    done.append((idx, self.__load_thumb(img_file)))
+                else:
+                    done.append((idx, None))
+        finally:
+            handled: set[int] = {idx for idx, _ in done}
+            done.extend((idx, None) for idx, _ in batch if idx not in handled)
+            glib.idle_add(self.__thumbs_ready, gen, done)
+
+    def __thumbs_ready(self,
+                       gen: int,
+                       batch: list[tuple[int, Optional[gpb.Pixbuf]]]) -> bool:
+        """Display a batch of thumbnails. Runs in the main loop."""
+        if gen != self.generation:
+            return False
+        for idx, pb in batch:
+            self.pending.discard(idx)
+            if pb is None:
+                continue
+            self.pixbufs[idx] = pb
+            self.pixbufs.move_to_end(idx)
+            cell: Optional[Cell] = self.cells.get(idx)
+            if cell is not None:
+                cell.img.set_from_pixbuf(pb)
+        while len(self.pixbufs) > PIXBUF_CACHE:
+            self.pixbufs.popitem(last=False)
+        return False
+
 
 class MemexUI:  # pylint: disable-msg=R0902,R0903
     """MemexUI is the visual frontend of the application."""
 
     def __init__(self) -> None:  # pylint: disable-msg=R0915
         self.log = common.get_logger("GUI")
-        self.queue: Queue[str] = Queue(os.cpu_count())  # type: ignore
-        self.scanner = scanner.Scanner(self.queue)
-        self.reader = reader.Reader(self.queue)
+        self.pipeline = pipeline.Pipeline(thumbnails=True)
+        self.pipeline.start()
         self.lock = Lock()
         self.scan_active = False
         self.db = database.Database(common.path.db())
@@ -81,12 +379,12 @@ class MemexUI:  # pylint: disable-msg=R0902,R0903
         self.search_entry = gtk.Entry()
         self.search_button = gtk.Button.new_from_stock(gtk.STOCK_FIND)  # pylint: disable-msg=E1101 # noqa: E501
         self.clear_button = gtk.Button.new_from_stock(gtk.STOCK_CLEAR)  # pylint: disable-msg=E1101 # noqa: E501
-        self.result_view = gtk.ScrolledWindow()
-        self.img_box = gtk.FlowBox()
-        self.images: list[tuple[image.Image, gtk.Image]] = []
+        self.grid = ResultGrid(self.db, self.__handle_img_click)
 
         self.scan_button = gtk.Button.new_from_icon_name("folder", 5)
         self.refresh_button = gtk.Button.new_from_stock(gtk.STOCK_REFRESH)  # pylint: disable-msg=E1101 # noqa: E501
+        self.watch_button = gtk.ToggleButton.new_with_label("Watch")
+        self.watcher: Optional[watcher.Watcher] = None
 
         self.scan_item = gtk.MenuItem.new_with_mnemonic("_Scan Folder")
         self.quit_item = gtk.MenuItem.new_with_mnemonic("_Quit")
@@ -96,10 +394,6 @@ class MemexUI:  # pylint: disable-msg=R0902,R0903
         self.mw.set_title(title)
 
         self.path_entry.editable = False
-        self.result_view.set_policy(gtk.PolicyType.NEVER, gtk.PolicyType.AUTOMATIC)  # noqa: E501
-        self.img_box.set_valign(gtk.Align.START)
-        self.img_box.set_max_children_per_line(3)
-        self.img_box.set_selection_mode(gtk.SelectionMode.NONE)
 
         # Build window
         # pylint: disable-msg=E1101
@@ -109,8 +403,7 @@ class MemexUI:  # pylint: disable-msg=R0902,R0903
         self.mbox.pack_start(self.button_box, False, True, 0)
         self.mbox.pack_start(self.path_entry, False, True, 0)
         self.mbox.pack_start(self.search_box, False, True, 0)
-        self.mbox.pack_start(self.result_view, True, True, 0)
-        self.result_view.add(self.img_box)
+        self.mbox.pack_start(self.grid.view, True, True, 0)
 
         self.menubar.append(self.file_menu_item)
         self.file_menu_item.set_submenu(self.file_menu)
@@ -119,26 +412,24 @@ class MemexUI:  # pylint: disable-msg=R0902,R0903
 
         self.button_box.pack_start(self.scan_button, False, True, 0)
         self.button_box.pack_start(self.refresh_button, False, True, 0)
+        self.button_box.pack_start(self.watch_button, False, True, 0)
 
         self.search_box.pack_start(self.search_entry, True, True, 0)
         self.search_box.pack_start(self.search_button, False, True, 0)
         self.search_box.pack_start(self.clear_button, False, True, 0)
 
         # Set up signal handlers
-        self.mw.connect("destroy", gtk.main_quit)
-        self.quit_item.connect("activate", gtk.main_quit)
+        self.mw.connect("destroy", self.__quit)
+        self.quit_item.connect("activate", self.__quit)
         self.scan_button.connect("clicked", self.scan_folder)
         self.refresh_button.connect("clicked", self.__refresh_all_folders)
+        self.watch_button.connect("toggled", self.__toggle_watch)
         self.scan_item.connect("activate", self.scan_folder)
         self.search_button.connect("clicked", self.search)
         self.search_entry.connect("activate", self.search)
         self.clear_button.connect("clicked", self.__clear_search)
-        self.quit_item.connect("activate", gtk.main_quit)
         self.mw.connect("window-state-event", self.__save_pos)
 
-        # self.img_box.connect("button-press-event", self.__handle_img_click)
-        self.img_box.connect("child-activated", self.__handle_img_click)
-
         self.mw.show_all()
         self.__restore_pos()
         self.mw.set_focus(self.search_entry)
@@ -171,65 +462,88 @@ class MemexUI:  # pylint: disable-msg=R0902,R0903
 
     def search(self, *args) -> None:  # pylint: disable-msg=W0613
         """Search for images."""
-        for i in self.images:
-            self.img_box.remove(i[1])
-            i[1].destroy()
-        self.images.clear()
-
         query: str = self.search_entry.get_text()
         self.log.debug("Search for images containing \"%s\"", query)
-        results: list[image.Image] = self.db.file_search(query)
-        for img_file in results:
-            try:
-                pb = gpb.Pixbuf.new_from_file_at_scale(filename=img_file.path,
-                                                       width=192,
-                                                       height=192,
-                                                       preserve_aspect_ratio=True)  # noqa: E501
-                img = gtk.Image.new_from_pixbuf(pb)
-                self.img_box.add(img)  # pylint: disable-msg=E1101
-                self.images.append((img_file, img))
-                img.show_all()
-            except glib.GError as ex:
-                self.log.debug("Error processing %s: %s",
-                               img_file.path,
-                               ex)
+        self.grid.search(query)
 
     def __clear_search(self, *args) -> None:  # pylint: disable-msg=W0613
         """Clear the search thingy"""
-        for i in self.images:
-            self.img_box.remove(i[1])
-            i[1].destroy()
-        self.images.clear()
+        self.grid.clear()
         self.search_entry.set_text("")
         self.path_entry.set_text("")
 
+    def __quit(self, *args) -> None:  # pylint: disable-msg=W0613
+        """Cancel pending work and leave the main loop.
+
+        Images that have not been read yet stay in the job table, the next
+        start picks them up again.
+        """
+        self.grid.close()
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.pipeline.cancel()
+        gtk.main_quit()
+
     def __scan_worker(self, path: str) -> None:
         """Perform the actual scanning of folders in the background."""
+        # Gtk may only be used from the main loop's thread.
+        glib.idle_add(self.scan_button.set_sensitive, False)
         with self.lock:
-            self.scan_button.set_sensitive(False)
             self.scan_active = True
 
         try:
-            self.scanner.scan([path])
+            self.pipeline.scan(path)
         finally:
+            glib.idle_add(self.scan_button.set_sensitive, True)
             with self.lock:
-                self.scan_button.set_sensitive(True)
                 self.scan_active = False
-                self.db.folder_add(path)
 
     def __refresh_all_folders(self, _) -> None:
         """Initiate a scan of all folders previously scanned."""
-        self.db.cleanup()
         folders: list[str] = []
         with self.lock:
             folders = self.db.folder_get_all()
         self.log.debug("Refresh the following folders: %s", folders)
-        self.scanner.scan(*folders)
+        thr = Thread(target=self.__refresh_worker, args=(folders, ))
+        thr.start()
 
-    def __handle_img_click(self, box: gtk.FlowBox, child: gtk.FlowBoxChild) -> None:  # noqa: E501 # pylint: disable-msg=W0613
-        """Handle a click into the image box"""
-        idx: int = child.get_index()
-        img: image.Image = self.images[idx][0]
+    def __refresh_worker(self, folders: list[str]) -> None:
+        """Refresh the given folders in the background."""
+        glib.idle_add(self.refresh_button.set_sensitive, False)
+        with self.lock:
+            self.scan_active = True
+
+        try:
+            # The UI thread's connection cannot be used here, and cleaning
+            # up a large index can take a while.
+            database.Database(common.path.db()).cleanup()
+            self.pipeline.scan(*folders, incremental=True)
+        finally:
+            glib.idle_add(self.refresh_button.set_sensitive, True)
+            with self.lock:
+                self.scan_active = False
+
+    def __toggle_watch(self, button: gtk.ToggleButton) -> None:
+        """Start or stop watching all folders previously scanned."""
+        if not button.get_active():
+            if self.watcher is not None:
+                self.watcher.stop()
+                self.watcher = None
+            return
+
+        with self.lock:
+            folders: list[str] = self.db.folder_get_all()
+        try:
+            self.watcher = watcher.Watcher(self.pipeline.queue, folders)
+            self.watcher.start()
+        except OSError as ex:
+            self.log.error("Cannot watch folders: %s", ex)
+            self.watcher = None
+            button.set_active(False)
+
+    def __handle_img_click(self, img: image.Image) -> None:
+        """Handle a click on one of the search results"""
         self.log.debug("You clicked on %s", img.path)
         self.path_entry.set_text(img.path)
         menu: gtk.Menu = gtk.Menu.new()
@@ -289,13 +603,7 @@ class MemexUI:  # pylint: disable-msg=R0902,R0903
             comment: str = buf.get_text(start, end, True)
             if comment != img.comment:
                 # Update database
-                with self.db:
-                    self.db.file_add(
-                        img.path,
-                        img.content,
-                        comment,
-                        img.timestamp,
-                    )
+                self.db.file_set_comment(img.dbid, comment)
         finally:
             dlg.destroy()
 
@@ -34,17 +34,33 @@ memex.image
 """
 
 from datetime import datetime
-from typing import NamedTuple
+from typing import NamedTuple, Optional
+
+
+class Snippet(NamedTuple):  # pylint: disable-msg=R0903
+    """An excerpt of an image's text around the matches of a search.
+
+    matches holds the (start, end) offsets of the matching terms in text.
+    """
+
+    text: str
+    matches: list[tuple[int, int]]
 
 
 class Image(NamedTuple):  # pylint: disable-msg=R0903
-    """Represents one image file"""
+    """Represents one image file
+
+    skipped is True if the prefilter decided the image contains no text,
+    so it was stored without running OCR on it.
+    """
 
     dbid: int
     path: str
     content: str
     comment: str
     timestamp: datetime
+    snippet: Optional[Snippet] = None
+    skipped: bool = False
 
 
 # Local Variables: #
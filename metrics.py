@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 16:05:22 krylon>
+#
+# /data/code/python/memex/metrics.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.metrics
+
+(c) 2026 Benjamin Walkenhorst
+
+Counters, gauges and latency histograms for the stages of the indexing
+pipeline. The stages record into the module level registry, which can be
+read with snapshot, rendered in the Prometheus text format with render,
+and written to a file periodically by an Exporter. The Exporter can be
+enabled in the configuration file:
+
+    [metrics]
+    export = yes
+    interval = 15
+"""
+
+import bisect
+import configparser
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Final, Iterator, Optional, Union
+
+from memex import common
+
+SECTION: Final[str] = "metrics"
+EXPORT_INTERVAL: Final[float] = 15.0  # seconds
+# The upper bounds of the histogram buckets, in seconds.
+BUCKETS: Final[tuple[float, ...]] = (0.0005, 0.001, 0.005, 0.01, 0.05,
+                                     0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    """A value that only ever goes up."""
+
+    __slots__ = ["name", "help", "value", "lock"]
+
+    def __init__(self, name: str, doc: str) -> None:
+        self.name = name
+        self.help = doc
+        self.value: int = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n: int = 1) -> None:
+        """Add n to the Counter."""
+        with self.lock:
+            self.value += n
+
+
+class Gauge:
+    """A value that is looked up whenever it is read, e.g. a queue size."""
+
+    __slots__ = ["name", "help", "func"]
+
+    def __init__(self,
+                 name: str,
+                 doc: str,
+                 func: Callable[[], float]) -> None:
+        self.name = name
+        self.help = doc
+        self.func = func
+
+    def read(self) -> float:
+        """Return the current value, or 0 if it cannot be determined."""
+        try:
+            return self.func()
+        except Exception:  # pylint: disable-msg=W0718
+            return 0
+
+
+class Histogram:
+    """Counts observations, e.g. latencies, in buckets."""
+
+    __slots__ = ["name", "help", "bounds", "counts", "total", "count", "lock"]
+
+    def __init__(self,
+                 name: str,
+                 doc: str,
+                 bounds: tuple[float, ...] = BUCKETS) -> None:
+        self.name = name
+        self.help = doc
+        self.bounds = bounds
+        # The last bucket is for everything beyond the largest bound.
+        self.counts: list[int] = [0] * (len(bounds) + 1)
+        self.total: float = 0.0
+        self.count: int = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Record one observation."""
+        idx: int = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[idx] += 1
+            self.total += value
+            self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Observe how long the body of a with statement takes."""
+        t1: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t1)
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile, returning the upper bound of its bucket."""
+        with self.lock:
+            counts = list(self.counts)
+            count: int = self.count
+        if count == 0:
+            return 0.0
+        rank: float = q * count
+        acc: int = 0
+        for i, n in enumerate(counts):
+            acc += n
+            if acc >= rank:
+                if i < len(self.bounds):
+                    return self.bounds[i]
+                break
+        return float("inf")
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class Registry:
+    """Registry holds the metrics, by name."""
+
+    def __init__(self) -> None:
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def __get(self, name: str, make: Callable[[], Metric]) -> Metric:
+        with self.lock:
+            m: Optional[Metric] = self.metrics.get(name)
+            if m is None:
+                m = make()
+                self.metrics[name] = m
+            return m
+
+    def counter(self, name: str, doc: str) -> Counter:
+        """Return the Counter with the given name, creating it if needed."""
+        m = self.__get(name, lambda: Counter(name, doc))
+        assert isinstance(m, Counter)
+        return m
+
+    def histogram(self, name: str, doc: str) -> Histogram:
+        """Return the Histogram with the given name, creating it if needed."""
+        m = self.__get(name, lambda: Histogram(name, doc))
+        assert isinstance(m, Histogram)
+        return m
+
+    def gauge(self, name: str, doc: str, func: Callable[[], float]) -> Gauge:
+        """Register a Gauge, replacing an earlier one of the same name."""
+        g = Gauge(name, doc, func)
+        with self.lock:
+            self.metrics[name] = g
+        return g
+
+    def unregister(self, m: Metric) -> None:
+        """Remove m, unless it has been replaced by another of its name."""
+        with self.lock:
+            if self.metrics.get(m.name) is m:
+                del self.metrics[m.name]
+
+    def snapshot(self) -> dict[str, Union[float, dict[str, float]]]:
+        """Return the current value of all metrics.
+
+        Histograms are summarized by their count, sum, and estimated
+        median and 99th percentile.
+        """
+        with self.lock:
+            metrics: list[Metric] = list(self.metrics.values())
+        snap: dict[str, Union[float, dict[str, float]]] = {}
+        for m in metrics:
+            if isinstance(m, Counter):
+                snap[m.name] = m.value
+            elif isinstance(m, Gauge):
+                snap[m.name] = m.read()
+            else:
+                snap[m.name] = {
+                    "count": m.count,
+                    "sum": m.total,
+                    "p50": m.quantile(0.5),
+                    "p99": m.quantile(0.99),
+                }
+        return snap
+
+    def render(self) -> str:
+        """Return all metrics in the Prometheus text format."""
+        with self.lock:
+            metrics: list[Metric] = sorted(self.metrics.values(),
+                                           key=lambda m: m.name)
+        lines: list[str] = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            if isinstance(m, Counter):
+                lines.append(f"# TYPE {m.name} counter")
+                lines.append(f"{m.name} {m.value}")
+            elif isinstance(m, Gauge):
+                lines.append(f"# TYPE {m.name} gauge")
+                lines.append(f"{m.name} {m.read()}")
+            else:
+                with m.lock:
+                    counts = list(m.counts)
+                    total: float = m.total
+                    count: int = m.count
+                lines.append(f"# TYPE {m.name} histogram")
+                acc: int = 0
+                for bound, n in zip(m.bounds, counts):
+                    acc += n
+                    lines.append(f'{m.name}_bucket{{le="{bound}"}} {acc}')
+                lines.append(f'{m.name}_bucket{{le="+Inf"}} {count}')
+                lines.append(f"{m.name}_sum {total}")
+                lines.append(f"{m.name}_count {count}")
+        return "\n".join(lines) + "\n"
+
+
+registry: Registry = Registry()
+
+
+class Exporter:
+    """Exporter writes the metrics to a file every interval seconds.
+
+    The file is replaced atomically, so a collector never sees a partial
+    file.
+    """
+
+    log: logging.Logger
+    path: str
+    interval: float
+    stopped: threading.Event
+    worker: threading.Thread
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 interval: float = EXPORT_INTERVAL) -> None:
+        self.log = common.get_logger("metrics")
+        self.path = path or common.path.metrics()
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self) -> None:
+        """Start writing the metrics."""
+        self.worker.start()
+
+    def stop(self) -> None:
+        """Write the metrics one last time and stop."""
+        self.stopped.set()
+        self.worker.join()
+
+    def write(self) -> None:
+        """Write the metrics now."""
+        tmp: str = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="UTF-8") as fh:
+            fh.write(registry.render())
+        os.replace(tmp, self.path)
+
+    def __run(self) -> None:
+        while True:
+            stop: bool = self.stopped.wait(self.interval)
+            try:
+                self.write()
+            except OSError as ex:
+                self.log.error("Cannot write metrics to %s: %s",
+                               self.path,
+                               ex)
+            if stop:
+                return
+
+
+def load_exporter(cfg: Optional[configparser.ConfigParser] = None,
+                  enabled: Optional[bool] = None) -> Optional[Exporter]:
+    """Create the Exporter described by the configuration file.
+
+    enabled overrides the setting from the configuration file. Returns
+    None if exporting the metrics is disabled.
+    """
+    if cfg is None:
+        cfg = common.load_config()
+    interval: float = EXPORT_INTERVAL
+    if cfg.has_section(SECTION):
+        if enabled is None:
+            enabled = cfg[SECTION].getboolean("export", False)
+        interval = cfg[SECTION].getfloat("interval", EXPORT_INTERVAL)
+    if not enabled:
+        return None
+    return Exporter(interval=interval)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
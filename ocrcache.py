@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 16:12:40 krylon>
+#
+# /data/code/python/memex/ocrcache.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.ocrcache
+
+(c) 2026 Benjamin Walkenhorst
+
+Remembers the text extracted from images, keyed by a hash of their
+content, so identical files are only processed once.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Final, List, Optional
+
+from memex import common
+
+MAX_BYTES: Final[int] = 128 << 20
+# How often, in puts, we check if the cache has grown too large, and how
+# far below the limit we shrink it once it has.
+EVICT_INTERVAL: Final[int] = 256
+EVICT_TARGET: Final[float] = 0.9
+# Access times are only updated when they are older than this, so reading
+# from the cache does not turn into a write for every single image.
+ATIME_RESOLUTION: Final[int] = 3600
+
+INIT_QUERIES: Final[List[str]] = [
+    """CREATE TABLE IF NOT EXISTS ocr (
+        digest    TEXT NOT NULL,
+        profile   TEXT NOT NULL,
+        content   TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        bytes     INTEGER NOT NULL DEFAULT 0,
+        atime     INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (digest, profile)
+    ) WITHOUT ROWID""",
+    "CREATE INDEX IF NOT EXISTS ocr_atime_idx ON ocr (atime)",
+]
+
+# Caches created before we kept track of their size.
+UPGRADE_QUERIES: Final[List[str]] = [
+    "ALTER TABLE ocr ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE ocr ADD COLUMN atime INTEGER NOT NULL DEFAULT 0",
+    "UPDATE ocr SET bytes = length(CAST(content AS BLOB)), atime = timestamp",
+]
+
+QUERY_GET: Final[str] = \
+    "SELECT content, atime FROM ocr WHERE digest = ? AND profile = ?"
+QUERY_TOUCH: Final[str] = \
+    "UPDATE ocr SET atime = ? WHERE digest = ? AND profile = ?"
+QUERY_PUT: Final[str] = """
+INSERT INTO ocr (digest, profile, content, timestamp, bytes, atime)
+VALUES          (     ?,       ?,       ?,         ?,     ?,     ?)
+ON CONFLICT(digest, profile) DO
+    UPDATE SET content=excluded.content,
+               timestamp=excluded.timestamp,
+               bytes=excluded.bytes,
+               atime=excluded.atime
+"""
+QUERY_TOTAL: Final[str] = "SELECT COALESCE(SUM(bytes), 0) FROM ocr"
+QUERY_EVICT: Final[str] = """
+DELETE FROM ocr
+WHERE (digest, profile) IN (SELECT digest, profile
+                            FROM (SELECT
+                                      digest,
+                                      profile,
+                                      SUM(bytes) OVER (ORDER BY atime,
+                                                                digest,
+                                                                profile)
+                                          - bytes AS freed
+                                  FROM ocr)
+                            WHERE freed < ?)
+"""
+
+BLOCK_SIZE: Final[int] = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    """Return a hash of the file's content."""
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as fh:
+        while True:
+            block: bytes = fh.read(BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+class OCRCache:
+    """OCRCache stores extracted text by content hash and OCR profile.
+
+    The cache lives in its own SQLite file, separate from the image
+    database, so it survives rebuilding the database and can be shared
+    between several databases. The profile identifies the OCR settings
+    the text was produced with, so changing the language does not return
+    stale results.
+    When the cache grows past max_bytes, the entries used least recently
+    are evicted.
+    Each thread gets its own connection to the cache.
+    """
+
+    log: logging.Logger
+    path: Final[str]  # pylint: disable-msg=C0103
+    max_bytes: int
+    local: threading.local
+    lock: threading.Lock
+    puts: int
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.log = common.get_logger("ocrcache")
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.puts = 0
+
+    def __conn(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it if needed."""
+        conn: Optional[sqlite3.Connection] = getattr(self.local, "conn", None)
+        if conn is None:
+            self.log.debug("Open OCR cache at %s", self.path)
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.isolation_level = None
+            conn.execute("PRAGMA journal_mode = WAL")
+            # Losing the last few entries after a crash is harmless.
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self.__init_schema(conn)
+            self.local.conn = conn
+        return conn
+
+    def __init_schema(self, conn: sqlite3.Connection) -> None:
+        """Create the cache's table, or bring an old one up to date."""
+        # Other threads and processes may open the cache at the same time.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns: set[str] = {row[1] for row in
+                                 conn.execute("PRAGMA table_info(ocr)")}
+            if len(columns) > 0 and "atime" not in columns:
+                self.log.info("Upgrade OCR cache at %s", self.path)
+                for query in UPGRADE_QUERIES:
+                    conn.execute(query)
+            for query in INIT_QUERIES:
+                conn.execute(query)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, digest: str, profile: str) -> Optional[str]:
+        """Return the cached text for the given digest, if any."""
+        conn: sqlite3.Connection = self.__conn()
+        row = conn.execute(QUERY_GET, (digest, profile)).fetchone()
+        if row is None:
+            return None
+        now: int = int(datetime.now().timestamp())
+        if now - row[1] > ATIME_RESOLUTION:
+            conn.execute(QUERY_TOUCH, (now, digest, profile))
+        return row[0]
+
+    def put(self, digest: str, profile: str, content: str) -> None:
+        """Store the text extracted from an image."""
+        now: int = int(datetime.now().timestamp())
+        self.__conn().execute(QUERY_PUT,
+                              (digest,
+                               profile,
+                               content,
+                               now,
+                               len(content.encode("utf-8")),
+                               now))
+        with self.lock:
+            self.puts += 1
+            check: bool = self.puts % EVICT_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def total(self) -> int:
+        """Return the size of all cached text in bytes."""
+        return self.__conn().execute(QUERY_TOTAL).fetchone()[0]
+
+    def evict(self) -> int:
+        """Shrink the cache below its size limit, if it has outgrown it.
+
+        Returns the number of entries removed.
+        """
+        total: int = self.total()
+        if total <= self.max_bytes:
+            return 0
+        excess: int = total - int(self.max_bytes * EVICT_TARGET)
+        cur: sqlite3.Cursor = self.__conn().execute(QUERY_EVICT, (excess, ))
+        self.log.debug("Evicted %d cached texts (%d bytes over the limit)",
+                       cur.rowcount,
+                       total - self.max_bytes)
+        return cur.rowcount
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
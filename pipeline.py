@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 13:48:05 krylon>
+#
+# /data/code/python/memex/pipeline.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.pipeline
+
+(c) 2026 Benjamin Walkenhorst
+
+Ties the Scanner, the Reader and the Writer together, so callers no
+longer have to build a queue and pass it to each of them.
+"""
+
+import logging
+import threading
+import time
+from queue import Queue
+from typing import Any, NamedTuple, Optional
+
+from memex import common, metrics, reader, scanner, scheduler
+from memex.reader import CPU_COUNT
+
+
+class Progress(NamedTuple):  # pylint: disable-msg=R0903
+    """A snapshot of the Pipeline's progress.
+
+    found is the number of images queued so far, stored the number of
+    images committed to the database. rate is in images per second since
+    the Pipeline started, eta in seconds, or None while we cannot tell.
+    """
+
+    found: int
+    stored: int
+    pending: int
+    rate: float
+    eta: Optional[float]
+
+
+def wait_done(q: Queue, deadline: Optional[float]) -> bool:
+    """Wait until every item put in q has been marked as done.
+
+    Like Queue.join, but gives up at deadline (in time.monotonic terms)
+    and returns False if it does.
+    """
+    with q.all_tasks_done:
+        while q.unfinished_tasks > 0:
+            if deadline is None:
+                q.all_tasks_done.wait()
+                continue
+            remaining: float = deadline - time.monotonic()
+            if remaining <= 0 or not q.all_tasks_done.wait(remaining):
+                return q.unfinished_tasks == 0
+    return True
+
+
+class Pipeline:
+    """Pipeline owns the stages that take images from disk to the database.
+
+    The Scanner walks folders and puts the images it finds in a JobQueue,
+    the Reader's workers run OCR on them, and its Writer commits the
+    results. start sets everything up, scan and submit feed it, drain
+    waits until all images have been stored, cancel drops the images that
+    have not been read yet (they stay in the job table and are resumed by
+    the next Pipeline), and stop shuts the stages down.
+    """
+
+    log: logging.Logger
+    queue: scheduler.JobQueue
+    scanner: scanner.Scanner
+    reader: Optional[reader.Reader]
+    worker_cnt: Optional[int]
+    reader_args: dict[str, Any]
+    lock: threading.Lock
+    started: float
+    gauges: list[metrics.Gauge]
+
+    def __init__(self,
+                 worker_cnt: Optional[int] = CPU_COUNT,
+                 policy: Optional[str] = None,
+                 **reader_args: Any) -> None:
+        self.log = common.get_logger("pipeline")
+        self.queue = scheduler.JobQueue(policy)
+        self.scanner = scanner.Scanner(self.queue)
+        self.reader = None
+        self.worker_cnt = worker_cnt
+        self.reader_args = reader_args
+        self.lock = threading.Lock()
+        self.started = 0.0
+        self.gauges = []
+
+    def __result_depth(self) -> int:
+        """Return the number of images waiting for the Writer."""
+        rdr: Optional[reader.Reader] = self.reader
+        return rdr.result_queue.qsize() if rdr is not None else 0
+
+    def is_active(self) -> bool:
+        """Return True if the Pipeline has been started and not stopped."""
+        with self.lock:
+            return self.reader is not None
+
+    def start(self) -> None:
+        """Start the Reader's workers and the Writer."""
+        with self.lock:
+            if self.reader is not None:
+                return
+            self.reader = reader.Reader(self.queue,
+                                        self.worker_cnt,
+                                        **self.reader_args)
+            self.started = time.monotonic()
+            self.gauges = [
+                metrics.registry.gauge("memex_scan_queue_depth",
+                                       "Images waiting to be read",
+                                       self.queue.qsize),
+                metrics.registry.gauge("memex_result_queue_depth",
+                                       "Images waiting to be stored",
+                                       self.__result_depth),
+            ]
+
+    def scan(self, *folders: str, incremental: bool = False) -> None:
+        """Walk the given folders, queueing the images found.
+
+        Returns when the walk is done, the images are read in the
+        background.
+        """
+        self.scanner.scan(*folders, incremental=incremental)
+
+    def submit(self, path: str) -> None:
+        """Queue a single image."""
+        self.queue.put(path)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued image has been read and stored.
+
+        Returns False if that did not happen within timeout seconds.
+        """
+        deadline: Optional[float] = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        if not wait_done(self.queue, deadline):
+            return False
+        rdr: Optional[reader.Reader] = self.reader
+        if rdr is None:
+            return True
+        # Nothing more is coming, so the Writer need not wait for it.
+        rdr.writer.flush()
+        return wait_done(rdr.result_queue, deadline)
+
+    def cancel(self) -> None:
+        """Stop scanning and drop the images that have not been read yet.
+
+        The dropped images stay in the job table, so they are picked up
+        again by the next run.
+        """
+        self.scanner.cancel()
+        dropped: int = self.queue.clear()
+        self.log.info("Cancelled, %d images left for the next run", dropped)
+
+    def stop(self) -> None:
+        """Shut down the Reader and the Writer.
+
+        The images being read are finished and stored, anything still in
+        the queue stays there. Call drain first to process everything.
+        """
+        with self.lock:
+            rdr: Optional[reader.Reader] = self.reader
+            self.reader = None
+            gauges: list[metrics.Gauge] = self.gauges
+            self.gauges = []
+        # The gauges would keep this Pipeline's queues alive, and report
+        # them in place of those of the next Pipeline.
+        for g in gauges:
+            metrics.registry.unregister(g)
+        if rdr is not None:
+            rdr.stop()
+
+    def progress(self) -> Progress:
+        """Return how far the Pipeline has got."""
+        stats = self.queue.stats()
+        rdr: Optional[reader.Reader] = self.reader
+        stored: int = rdr.writer.stored if rdr is not None else 0
+        pending: int = int(stats["pending"])
+        found: int = int(stats["dispatched"]) + pending
+        elapsed: float = time.monotonic() - self.started
+        rate: float = stored / elapsed if stored > 0 and elapsed > 0 else 0.0
+        eta: Optional[float] = None
+        if rate > 0:
+            eta = (found - stored) / rate
+        return Progress(found, stored, pending, rate, eta)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
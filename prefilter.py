@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 17:26:52 krylon>
+#
+# /data/code/python/memex/prefilter.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.prefilter
+
+(c) 2026 Benjamin Walkenhorst
+
+Guesses whether an image contains any text before we spend the time to
+run OCR on it. Text consists of sharp, high-contrast edges, while the
+edges in photos are mostly soft gradients, so the share of strong edges
+among all edges in a downscaled copy of the image is a cheap, if rough,
+indicator. The prefilter is configured in the [prefilter] section of the
+configuration file:
+
+    [prefilter]
+    enabled = yes
+    threshold = 0.02
+
+Images scoring below the threshold are stored with empty content and
+marked as skipped, so they can be run through OCR later on.
+"""
+
+import configparser
+import logging
+from typing import Final, Optional
+
+from memex import common
+
+try:
+    import numpy as np  # type: ignore
+    from PIL import Image as PILImage  # type: ignore
+except ImportError:
+    np = None  # pylint: disable-msg=C0103
+    PILImage = None  # pylint: disable-msg=C0103
+
+SECTION: Final[str] = "prefilter"
+# Images are scaled down to at most SAMPLE_SIZE pixels before we look at
+# them. Differences between neighboring pixels above WEAK_EDGE count as an
+# edge, those above STRONG_EDGE as a strong one.
+SAMPLE_SIZE: Final[int] = 512
+WEAK_EDGE: Final[int] = 8
+STRONG_EDGE: Final[int] = 96
+DEFAULT_THRESHOLD: Final[float] = 0.02
+
+
+def available() -> bool:
+    """Return True if the libraries the prefilter needs are installed."""
+    return np is not None and PILImage is not None
+
+
+def text_score(path: str, size: int = SAMPLE_SIZE) -> float:
+    """Return the share of strong edges among all edges in an image."""
+    if not available():
+        raise RuntimeError("numpy and PIL are required for the prefilter")
+    with PILImage.open(path) as img:
+        img.draft("L", (size, size))
+        img.thumbnail((size, size))
+        px = np.asarray(img.convert("L"), dtype=np.int16)
+    dx = np.abs(np.diff(px, axis=1))
+    dy = np.abs(np.diff(px, axis=0))
+    weak: int = np.count_nonzero(dx > WEAK_EDGE) + \
+        np.count_nonzero(dy > WEAK_EDGE)
+    if weak == 0:
+        return 0.0
+    strong: int = np.count_nonzero(dx > STRONG_EDGE) + \
+        np.count_nonzero(dy > STRONG_EDGE)
+    return strong / weak
+
+
+class Prefilter:
+    """Prefilter decides which images are worth running OCR on."""
+
+    __slots__ = ["log", "threshold"]
+
+    log: logging.Logger
+    threshold: float
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD) -> None:
+        self.log = common.get_logger("prefilter")
+        self.threshold = threshold
+
+    def likely_text(self, path: str) -> bool:
+        """Return False if the image almost certainly contains no text.
+
+        When in doubt, e.g. because the image cannot be read, we return
+        True and let OCR sort it out.
+        """
+        try:
+            score: float = text_score(path)
+        except Exception as ex:  # pylint: disable-msg=W0718
+            self.log.debug("Cannot score %s: %s", path, ex)
+            return True
+        return score >= self.threshold
+
+
+def load(cfg: Optional[configparser.ConfigParser] = None,
+         enabled: Optional[bool] = None) -> Optional[Prefilter]:
+    """Create the Prefilter described by the configuration file.
+
+    enabled overrides the setting from the configuration file. Returns
+    None if the prefilter is disabled or numpy or PIL are missing.
+    """
+    if cfg is None:
+        cfg = common.load_config()
+    threshold: float = DEFAULT_THRESHOLD
+    if cfg.has_section(SECTION):
+        if enabled is None:
+            enabled = cfg[SECTION].getboolean("enabled", False)
+        threshold = cfg[SECTION].getfloat("threshold", DEFAULT_THRESHOLD)
+    if not enabled:
+        return None
+    if not available():
+        common.get_logger("prefilter").warning(
+            "The prefilter needs numpy and PIL, OCR will run on all images")
+        return None
+    return Prefilter(threshold)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
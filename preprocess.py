@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 15:41:09 krylon>
+#
+# /data/code/python/memex/preprocess.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.preprocess
+
+(c) 2026 Benjamin Walkenhorst
+
+Prepares images for OCR. Large images are scaled down, and optionally
+converted to grayscale, binarized and cropped, before Tesseract sees
+them. The settings are read from the [preprocess] section of the
+configuration file:
+
+    [preprocess]
+    max_dim = 3000
+    dpi = 300
+    grayscale = yes
+    binarize = no
+    crop = yes
+"""
+
+import configparser
+from typing import Final, NamedTuple, Optional
+
+from memex import common
+
+try:
+    from PIL import Image as PILImage  # type: ignore
+    from PIL import ImageChops, ImageOps  # type: ignore
+except ImportError:
+    PILImage = None  # pylint: disable-msg=C0103
+
+SECTION: Final[str] = "preprocess"
+# Pixels differing from the border color by no more than this are
+# considered part of the border when cropping.
+CROP_FUZZ: Final[int] = 16
+
+
+class Settings(NamedTuple):  # pylint: disable-msg=R0903
+    """Settings describes the preprocessing applied to images.
+
+    max_dim is the largest width or height an image may have, dpi the
+    resolution images are scaled down to if they say they have a higher
+    one. Zero disables either.
+    """
+
+    max_dim: int = 0
+    dpi: int = 0
+    grayscale: bool = False
+    binarize: bool = False
+    crop: bool = False
+
+    def enabled(self) -> bool:
+        """Return True if any preprocessing is configured."""
+        return self != Settings()
+
+    def profile(self) -> str:
+        """Return a string identifying the settings."""
+        return ",".join(f"{k}={int(v)}" for k, v in self._asdict().items())
+
+
+def load_settings(cfg: Optional[configparser.ConfigParser] = None) -> Settings:
+    """Read the preprocessing settings from the configuration file."""
+    if cfg is None:
+        cfg = common.load_config()
+    if not cfg.has_section(SECTION):
+        return Settings()
+    sec = cfg[SECTION]
+    return Settings(max_dim=sec.getint("max_dim", 0),
+                    dpi=sec.getint("dpi", 0),
+                    grayscale=sec.getboolean("grayscale", False),
+                    binarize=sec.getboolean("binarize", False),
+                    crop=sec.getboolean("crop", False))
+
+
+def scale_factor(size: tuple[int, int],
+                 src_dpi: int,
+                 settings: Settings) -> float:
+    """Return the factor an image of the given size needs to be scaled by.
+
+    Images are only ever scaled down, never up.
+    """
+    factor: float = 1.0
+    if settings.max_dim > 0 and max(size) > settings.max_dim:
+        factor = settings.max_dim / max(size)
+    if settings.dpi > 0 and src_dpi > settings.dpi:
+        factor = min(factor, settings.dpi / src_dpi)
+    return factor
+
+
+def otsu_threshold(hist: list[int]) -> int:
+    """Return the threshold that best separates a grayscale histogram."""
+    total: int = sum(hist)
+    weighted: int = sum(i * n for i, n in enumerate(hist))
+    best: int = 0
+    best_var: float = -1.0
+    cnt_lo: int = 0
+    sum_lo: int = 0
+    for i, n in enumerate(hist):
+        cnt_lo += n
+        if cnt_lo == 0:
+            continue
+        cnt_hi: int = total - cnt_lo
+        if cnt_hi == 0:
+            break
+        sum_lo += i * n
+        mean_lo: float = sum_lo / cnt_lo
+        mean_hi: float = (weighted - sum_lo) / cnt_hi
+        var: float = cnt_lo * cnt_hi * (mean_lo - mean_hi) ** 2
+        if var > best_var:
+            best_var = var
+            best = i
+    return best
+
+
+def crop_borders(img: "PILImage.Image") -> "PILImage.Image":
+    """Remove uniformly colored borders around an image.
+
+    The color of the top left pixel is taken to be the border color.
+    """
+    gray = img.convert("L")
+    bg = PILImage.new("L", gray.size, gray.getpixel((0, 0)))
+    diff = ImageChops.difference(gray, bg).point(
+        lambda p: 255 if p > CROP_FUZZ else 0)
+    bbox = diff.getbbox()
+    if bbox is None or bbox == (0, 0) + img.size:
+        return img
+    return img.crop(bbox)
+
+
+def prepare(path: str, settings: Settings) -> tuple["PILImage.Image", int]:
+    """Load an image and apply the preprocessing to it.
+
+    Returns the image and its resolution after scaling, which is 0 if the
+    file does not state it.
+    """
+    if PILImage is None:
+        raise RuntimeError("PIL is not available")
+    with PILImage.open(path) as img:
+        src_dpi: float = float(img.info.get("dpi", (0, 0))[0])
+        gray: bool = settings.grayscale or settings.binarize
+
+        if not settings.crop:
+            # JPEGs can be decoded at a fraction of their size right away, as
+            # long as we do not need the full image to find its borders.
+            factor: float = scale_factor(img.size, int(src_dpi), settings)
+            if factor < 1.0:
+                width: int = img.width
+                img.draft("L" if gray else "RGB",
+                          (round(img.width * factor),
+                           round(img.height * factor)))
+                src_dpi = src_dpi * img.width / width
+
+        img = ImageOps.exif_transpose(img)
+        if settings.crop:
+            img = crop_borders(img)
+
+        factor = scale_factor(img.size, int(src_dpi), settings)
+        if factor < 1.0:
+            size = (max(1, round(img.width * factor)),
+                    max(1, round(img.height * factor)))
+            img = img.resize(size,
+                             PILImage.Resampling.LANCZOS,
+                             reducing_gap=3.0)
+            src_dpi = src_dpi * factor
+
+        if gray:
+            img = img.convert("L")
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        if settings.binarize:
+            threshold: int = otsu_threshold(img.histogram())
+            img = img.point(lambda p: 255 if p > threshold else 0, mode="1")
+
+        # Make sure the pixels are loaded before the file is closed.
+        img.load()
+        return img, round(src_dpi)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
@@ -36,7 +36,11 @@ Attempts to extract text from image files.
 """
 
 import logging
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from queue import Queue
 from threading import Thread
@@ -46,9 +50,155 @@ from typing import Final, List, Optional
 # from PIL import Image  # type: ignore
 import tesserocr  # type: ignore
 
-from memex import common, database, image
+from memex import (common, image, metrics, ocrcache, prefilter, preprocess,
+                   scheduler, thumbnail, writer)
 
 CPU_COUNT: Final[Optional[int]] = os.cpu_count()
+DEFAULT_LANG: Final[str] = "eng"
+BACKENDS: Final[tuple[str, ...]] = ("thread", "process")
+
+_ocr_time = metrics.registry.histogram(
+    "memex_ocr_seconds",
+    "Time to extract the text from an image")
+_read = metrics.registry.counter(
+    "memex_ocr_images_total",
+    "Images run through OCR")
+_errors = metrics.registry.counter(
+    "memex_ocr_errors_total",
+    "Images that could not be read")
+_skipped = metrics.registry.counter(
+    "memex_ocr_skipped_total",
+    "Images the prefilter kept away from OCR")
+
+
+class Engine:
+    """Engine wraps a long-lived Tesseract API instance.
+
+    Setting up the Tesseract API loads the traineddata for the language,
+    which is expensive, so a worker keeps its Engine around and only
+    reinitializes it when the language or the configuration changes.
+    If preprocessing is enabled, images are prepared with PIL and handed
+    to Tesseract in memory, otherwise Tesseract reads the file itself.
+    An Engine must not be shared between threads.
+    """
+
+    __slots__ = ["api", "lang", "config", "prep"]
+
+    api: Optional[tesserocr.PyTessBaseAPI]  # pylint: disable-msg=I1101
+    lang: str
+    config: dict[str, str]
+    prep: preprocess.Settings
+
+    def __init__(self,
+                 lang: str = DEFAULT_LANG,
+                 config: Optional[dict[str, str]] = None,
+                 prep: Optional[preprocess.Settings] = None) -> None:
+        self.api = None
+        self.lang = lang
+        self.config = dict(config or {})
+        self.prep = prep or preprocess.Settings()
+
+    def configure(self,
+                  lang: str,
+                  config: Optional[dict[str, str]] = None,
+                  prep: Optional[preprocess.Settings] = None) -> None:
+        """Set the language, Tesseract variables and preprocessing to use.
+
+        The API is torn down only if the language or variables actually
+        changed, it will be set up again lazily for the next image.
+        """
+        cfg: dict[str, str] = dict(config or {})
+        self.prep = prep or preprocess.Settings()
+        if lang == self.lang and cfg == self.config:
+            return
+        self.close()
+        self.lang = lang
+        self.config = cfg
+
+    def read(self, path: str) -> str:
+        """Extract the text from an image file."""
+        if self.api is None:
+            self.api = self.__init_api()
+        try:
+            if self.prep.enabled():
+                img, dpi = preprocess.prepare(path, self.prep)
+                self.api.SetImage(img)
+                if dpi > 0:
+                    self.api.SetSourceResolution(dpi)
+            else:
+                self.api.SetImageFile(path)
+            return self.api.GetUTF8Text()
+        finally:
+            # Clear releases the image and the recognition results, but
+            # keeps the language data loaded.
+            self.api.Clear()
+
+    def profile(self) -> str:
+        """Return a string identifying the settings the Engine uses."""
+        cfg: str = ",".join(f"{k}={v}"
+                            for k, v in sorted(self.config.items()))
+        if self.prep.enabled():
+            return f"{self.lang};{cfg};{self.prep.profile()}"
+        return f"{self.lang};{cfg}"
+
+    def close(self) -> None:
+        """Release the Tesseract API, if there is one."""
+        if self.api is not None:
+            self.api.End()
+            self.api = None
+
+    # pylint: disable-msg=I1101,E1101
+    def __init_api(self) -> tesserocr.PyTessBaseAPI:
+        """Create and initialize a Tesseract API instance."""
+        api = tesserocr.PyTessBaseAPI(lang=self.lang)
+        for key, val in self.config.items():
+            if not api.SetVariable(key, val):
+                api.End()
+                raise ValueError(f"Invalid Tesseract variable {key}")
+        return api
+
+
+def ocr_file(eng: Engine,
+             cache: Optional[ocrcache.OCRCache],
+             path: str) -> str:
+    """Extract the text from an image, consulting the cache first."""
+    if cache is None:
+        return eng.read(path)
+
+    digest: str = ocrcache.file_digest(path)
+    profile: str = eng.profile()
+    content: Optional[str] = cache.get(digest, profile)
+    if content is None:
+        content = eng.read(path)
+        cache.put(digest, profile, content)
+    return content
+
+
+# The Engine and OCRCache of a worker process in the process backend.
+_process_engine: Optional[Engine] = None  # pylint: disable-msg=C0103
+_process_cache: Optional[ocrcache.OCRCache] \
+    = None  # pylint: disable-msg=C0103
+
+
+def _process_init(lang: str,
+                  config: dict[str, str],
+                  cache_path: Optional[str]) -> None:
+    """Set up the Engine of a freshly started worker process."""
+    global _process_engine, _process_cache  # pylint: disable-msg=W0603,C0103
+    _process_engine = Engine(lang, config)
+    if cache_path is not None:
+        _process_cache = ocrcache.OCRCache(cache_path)
+
+
+def _process_read(path: str,
+                  lang: str,
+                  config: dict[str, str],
+                  prep: preprocess.Settings) -> image.Image:
+    """Read one image inside a worker process."""
+    assert _process_engine is not None
+    _process_engine.configure(lang, config, prep)
+    content: str = ocr_file(_process_engine, _process_cache, path)
+    return image.Image(0, path, content, "", datetime.now())
 
 
 # pylint: disable-msg=R0903
@@ -61,19 +211,66 @@ class Reader:
     log: logging.Logger
     workers: List[Thread]
     file_queue: Queue[str]
-    result_queue: Queue[image.Image]
+    result_queue: Queue[Optional[image.Image]]
+    writer: writer.Writer
+    settings: tuple[str, dict[str, str], preprocess.Settings]
+    local: threading.local
+    backend: str
+    worker_cnt: int
+    pool: Optional[ProcessPoolExecutor]
+    pool_lock: threading.Lock
+    cache_path: Optional[str]
+    cache: Optional[ocrcache.OCRCache]
+    thumbs: Optional[thumbnail.ThumbnailStore]
+    filter: Optional[prefilter.Prefilter]
 
-    def __init__(self, queue: Queue[str], worker_cnt=CPU_COUNT) -> None:
+    # pylint: disable-msg=R0913
+    def __init__(self,
+                 queue: Queue[str],
+                 worker_cnt=CPU_COUNT,
+                 lang: str = DEFAULT_LANG,
+                 config: Optional[dict[str, str]] = None,
+                 backend: str = "thread",
+                 cache: bool = True,
+                 cache_path: Optional[str] = None,
+                 thumbnails: bool = False,
+                 prep: Optional[preprocess.Settings] = None,
+                 skip_textless: Optional[bool] = None) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"Invalid backend {backend}")
         self.log = common.get_logger("reader")
         self.file_queue = queue
         self.workers = []
         self.result_queue = Queue()
+        if prep is None:
+            prep = preprocess.load_settings()
+        self.settings = (lang, dict(config or {}), prep)
+        self.local = threading.local()
+        self.backend = backend
+        self.worker_cnt = worker_cnt
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.cache_path = None
+        self.cache = None
+        self.thumbs = None
+        # None means we go with the configuration file.
+        self.filter = prefilter.load(enabled=skip_textless)
+
+        if thumbnails:
+            self.thumbs = thumbnail.ThumbnailStore(common.path.thumbnails())
 
-        self.log.debug("Starting %d worker threads", worker_cnt)
+        if cache:
+            self.cache_path = cache_path or common.path.ocr_cache()
+            self.cache = ocrcache.OCRCache(self.cache_path)
 
-        res_handler = Thread(target=self.__result_handler)
-        res_handler.daemon = True
-        res_handler.start()
+        if backend == "process":
+            self.pool = self.__make_pool()
+
+        self.log.debug("Starting %d worker threads (%s backend)",
+                       worker_cnt,
+                       backend)
+
+        self.writer = writer.Writer(self.result_queue)
 
         for i in range(worker_cnt):
             worker: Thread = Thread(target=self.__worker, args=(i, ))
@@ -81,44 +278,183 @@ class Reader:
             worker.start()
             self.workers.append(worker)
 
+    def stop(self) -> None:
+        """Stop the workers and the Writer.
+
+        Each worker finishes the image it is reading, the images still in
+        the queue are left alone. Each worker releases its Engine on the
+        way out. Returns once everything the workers produced has been
+        stored.
+        """
+        for _ in self.workers:
+            self.file_queue.put(None)  # type: ignore
+        for worker in self.workers:
+            worker.join()
+        self.workers.clear()
+        self.writer.stop()
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
     def __worker(self, worker_id: int) -> None:
-        """Process image files as they arrive at the queue."""
+        """Process image files as they arrive at the queue, until None."""
         self.log.debug("Worker %02d starting up", worker_id)
+        try:
+            while self.__process_next(worker_id):
+                pass
+        finally:
+            # Release this thread's Tesseract API, no one else can.
+            eng: Optional[Engine] = getattr(self.local, "engine", None)
+            if eng is not None:
+                eng.close()
+                self.local.engine = None
+
+    def __process_next(self, worker_id: int) -> bool:
+        """Process one image from the queue.
+
+        Returns False if we got None, i.e. the worker should stop.
+        """
+        path: Optional[str] = None
+        got: bool = False
+        try:
+            path = self.file_queue.get()
+            got = True
+            if path is None:
+                self.log.debug("Worker %02d stopping", worker_id)
+                return False
+            # self.log.debug("Worker %02d: Got one file from queue: %s",
+            #                worker_id,
+            #                path)
+            img: image.Image = self.process_image(path)
+            if self.thumbs is not None:
+                self.__thumbnail(path)
+            self.result_queue.put(img)
+        except Exception as e:  # pylint: disable-msg=W0718,C0103
+            self.log.error("Failed to process image %s: %s",
+                           path,
+                           e)
+            if path is not None and \
+               isinstance(self.file_queue, scheduler.JobQueue):
+                self.file_queue.fail(path, str(e))
+        finally:
+            if got:
+                self.file_queue.task_done()
+        return True
+
+    def __thumbnail(self, path: str) -> None:
+        """Render the thumbnail for an image we just read.
+
+        The file is still in the page cache, so this is cheap. A thumbnail
+        that cannot be rendered or stored is not worth failing the image
+        for, the GUI falls back to scaling the image itself.
+        """
+        assert self.thumbs is not None
+        try:
+            self.thumbs.thumbnail(path)
+        except Exception as ex:  # pylint: disable-msg=W0718
+            self.log.warning("Cannot store thumbnail for %s: %s", path, ex)
+
+    def __make_pool(self) -> ProcessPoolExecutor:
+        """Create the pool of worker processes for the process backend."""
+        lang, config, _ = self.settings
+        # Spawn rather than fork, the parent has plenty of threads running.
+        return ProcessPoolExecutor(
+            max_workers=self.worker_cnt,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_process_init,
+            initargs=(lang, config, self.cache_path))
+
+    def __restart_pool(self, broken: ProcessPoolExecutor) -> None:
+        """Replace a pool that lost a worker process.
+
+        Several threads may notice the broken pool at once, only the first
+        one replaces it.
+        """
+        with self.pool_lock:
+            if self.pool is not broken:
+                return
+            self.log.error("An OCR worker process died, restarting the pool")
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.pool = self.__make_pool()
+
+    def __read_in_pool(self, path: str) -> image.Image:
+        """Hand an image to a worker process and wait for the result.
+
+        When a worker process crashes, every image in flight in the pool
+        fails with it, so each image is retried once on a fresh pool.
+        """
+        lang, config, prep = self.settings
+        retry: bool = True
         while True:
+            pool = self.pool
+            assert pool is not None
             try:
-                path: str = self.file_queue.get()
-                # self.log.debug("Worker %02d: Got one file from queue: %s",
-                #                worker_id,
-                #                path)
-                content: str = self.read_image(path)
-                img = image.Image(0, path, content, "", datetime.now())
-                self.result_queue.put(img)
-            except Exception as e:  # pylint: disable-msg=W0718,C0103
-                self.log.error("Failed to process image %s: %s",
-                               path,
-                               e)
-
-    def __result_handler(self) -> None:
-        """Store processed images into the database."""
-        self.log.debug("Result handler starting up.")
-        db: database.Database \
-            = database.Database(common.path.db())  # pylint: disable-msg=C0103
-        while True:
-            with db:
-                try:
-                    img: image.Image = self.result_queue.get()
-                    db.file_add(img.path, img.content, img.comment, img.timestamp)  # noqa: E501
-                except Exception as ex:  # pylint: disable-msg=W0718
-                    self.log.error("Error processing image %s: %s",
-                                   img.path,
-                                   ex)
+                return pool.submit(_process_read,
+                                   path,
+                                   lang,
+                                   config,
+                                   prep).result()
+            except BrokenProcessPool:
+                self.__restart_pool(pool)
+                if not retry:
+                    raise
+                retry = False
+
+    def process_image(self, path: str) -> image.Image:
+        """Extract the text from an image using the configured backend.
+
+        Images the prefilter considers free of text are not read at all,
+        they are returned with empty content and marked as skipped.
+        """
+        if self.filter is not None and not self.filter.likely_text(path):
+            self.log.debug("Skip OCR for %s, it appears to contain no text",
+                           path)
+            _skipped.inc()
+            return image.Image(0, path, "", "", datetime.now(), skipped=True)
+        try:
+            with _ocr_time.time():
+                if self.backend == "process":
+                    img: image.Image = self.__read_in_pool(path)
+                else:
+                    content: str = self.read_image(path)
+                    img = image.Image(0, path, content, "", datetime.now())
+        except Exception:
+            _errors.inc()
+            raise
+        _read.inc()
+        return img
+
+    def configure(self,
+                  lang: str,
+                  config: Optional[dict[str, str]] = None,
+                  prep: Optional[preprocess.Settings] = None) -> None:
+        """Change the OCR language, Tesseract variables and/or preprocessing.
+
+        If prep is None, the preprocessing settings are left unchanged.
+        Each worker picks up the new settings before its next image.
+        """
+        if prep is None:
+            prep = self.settings[2]
+        self.settings = (lang, dict(config or {}), prep)
+
+    def engine(self) -> Engine:
+        """Return the calling thread's Engine, creating it if needed."""
+        eng: Optional[Engine] = getattr(self.local, "engine", None)
+        lang, config, prep = self.settings
+        if eng is None:
+            eng = Engine(lang, config, prep)
+            self.local.engine = eng
+        else:
+            eng.configure(lang, config, prep)
+        return eng
 
     def read_image(self, path: str) -> str:
         """Extract text from an image file and return it as a string."""
         self.log.debug("Process image %s", path)
         try:
             # return pytesseract.image_to_string(Image.open(path))
-            return tesserocr.file_to_text(path)  # pylint: disable-msg=I1101,E1101
+            return ocr_file(self.engine(), self.cache, path)
         except Exception as ex:
             self.log.error("Error processing %s: %s", path, ex)
             raise
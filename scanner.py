@@ -40,12 +40,14 @@ import os
 import os.path
 import re
 import stat
+from array import array
+from bisect import bisect_left
 from datetime import datetime
-from queue import Queue
-from threading import Thread
+from queue import LifoQueue, Queue
+from threading import Event, Thread
 from typing import Final, Optional
 
-from memex import common, database
+from memex import common, database, metrics, scheduler
 
 # pylint: disable-msg=C0103
 
@@ -53,6 +55,34 @@ _picPat: Final[re.Pattern[str]] = \
         re.compile("[.](?:jpe?g|png|webp|avif|gif)$", re.I)
 
 
+_dirs = metrics.registry.counter(
+    "memex_scan_dirs_total",
+    "Directories listed by the Scanner")
+_skipped_dirs = metrics.registry.counter(
+    "memex_scan_dirs_skipped_total",
+    "Unchanged directories skipped by incremental scans")
+_stat_calls = metrics.registry.counter(
+    "memex_scan_stat_calls_total",
+    "stat calls made by the Scanner")
+_images = metrics.registry.counter(
+    "memex_scan_images_total",
+    "Images found by the Scanner")
+_queued = metrics.registry.counter(
+    "memex_scan_queued_total",
+    "New or modified images queued for OCR by the Scanner")
+_list_time = metrics.registry.histogram(
+    "memex_scan_list_seconds",
+    "Time to list a directory and stat its entries")
+_lookup_time = metrics.registry.histogram(
+    "memex_scan_lookup_seconds",
+    "Time to look up the stored timestamps of a directory's images")
+
+
+def is_image(path: str) -> bool:
+    """Return True if path looks like an image file we can process."""
+    return _picPat.search(path) is not None
+
+
 def file_mtime(path: str) -> Optional[datetime]:
     """Return the file's mtime"""
     try:
@@ -64,55 +94,350 @@ def file_mtime(path: str) -> Optional[datetime]:
         return None
 
 
+# A scan preloads the timestamps of at most this many images, for all of
+# its roots together. Roots that do not fit look them up one directory at
+# a time.
+STAMP_INDEX_LIMIT: Final[int] = 250_000
+
+# The mtime recorded for directories whose images have not been stored yet.
+UNRECORDED: Final[int] = 0
+
+# Walking is I/O bound, especially on network file systems, so we can
+# afford more threads than we have CPUs.
+WALKER_COUNT: Final[int] = min(32, (os.cpu_count() or 1) * 4)
+
+
+class StampIndex:
+    """StampIndex holds the timestamps of the images known below a folder.
+
+    The timestamps are loaded with a single query, so checking whether a
+    file has changed does not require a database lookup. To keep the
+    memory footprint down, paths are stored relative to the folder in a
+    sorted list, the timestamps in a parallel array.
+    If there are more than limit images, StampIndex falls back to one
+    query per directory to keep the memory use bounded. Since each
+    preloaded index takes a share of the scan's limit, its length is the
+    number of images it holds.
+    """
+
+    __slots__ = ["prefix", "paths", "stamps", "loaded"]
+
+    prefix: str
+    paths: list[str]
+    stamps: array
+    loaded: bool
+
+    def __init__(self,
+                 db: database.Database,
+                 folder: str,
+                 limit: int = STAMP_INDEX_LIMIT) -> None:
+        self.prefix = database.path_range(folder)[0]
+        self.paths = []
+        self.stamps = array("q")
+        self.loaded = False
+
+        if db.file_stamp_count(folder) > limit:
+            return
+
+        plen: int = len(self.prefix)
+        for path, stamp in db.file_stamps(folder):
+            self.paths.append(path[plen:])
+            self.stamps.append(stamp)
+        self.loaded = True
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def lookup(self,
+               paths: list[str],
+               db: Optional[database.Database]) -> dict[str, int]:
+        """Return the known timestamps for the given paths.
+
+        Paths that are not in the database are missing from the result.
+        db is only used (and required) if the index was too large to
+        preload.
+        """
+        if not self.loaded:
+            assert db is not None
+            return db.file_stamps_for(paths)
+
+        stamps: dict[str, int] = {}
+        plen: int = len(self.prefix)
+        for p in paths:
+            if not p.startswith(self.prefix):
+                continue
+            key: str = p[plen:]
+            idx: int = bisect_left(self.paths, key)
+            if idx < len(self.paths) and self.paths[idx] == key:
+                stamps[p] = self.stamps[idx]
+        return stamps
+
+
+def collapse_roots(folders: list[str]) -> list[str]:
+    """Return the given folders minus those nested inside another one.
+
+    Paths are normalized first, so "/a", "/a/" and "/a/b/.." count as the
+    same folder.
+    """
+    roots: list[str] = sorted(
+        {os.path.normpath(os.path.abspath(os.path.expanduser(f)))
+         for f in folders},
+        key=lambda p: p.split(os.sep))
+    result: list[str] = []
+    for r in roots:
+        if len(result) > 0 and \
+           r.startswith(database.path_range(result[-1])[0]):
+            continue
+        result.append(r)
+    return result
+
+
+class DirIndex:
+    """DirIndex holds the recorded mtimes of the directories below a folder.
+
+    A directory's mtime changes when entries are added to, removed from, or
+    renamed inside it, so if it is unchanged, there is no need to list it
+    again. We still have to visit its subdirectories, which is what
+    children is for.
+    """
+
+    __slots__ = ["mtimes", "subdirs"]
+
+    mtimes: dict[str, int]
+    subdirs: dict[str, list[str]]
+
+    def __init__(self, db: database.Database, folder: str) -> None:
+        self.mtimes = {}
+        self.subdirs = {}
+        for path, mtime in db.dir_get_all(folder):
+            self.mtimes[path] = mtime
+            if path != folder:
+                parent: str = os.path.dirname(path)
+                self.subdirs.setdefault(parent, []).append(path)
+
+    def unchanged(self, path: str, mtime: int) -> bool:
+        """Return True if the directory's mtime matches the recorded one."""
+        return self.mtimes.get(path) == mtime
+
+    def children(self, path: str) -> list[str]:
+        """Return the recorded subdirectories of path."""
+        return self.subdirs.get(path, [])
+
+
+# A work item for the walkers: The index of the root folder, the path of a
+# directory, and its mtime in nanoseconds if we already know it.
+WorkItem = tuple[int, str, Optional[int]]
+
+
+class _ScanJob:  # pylint: disable-msg=R0903
+    """The state shared by the walkers during one call to Scanner.scan"""
+
+    __slots__ = ["roots", "stamps", "dirs", "incremental", "work", "seen",
+                 "updated"]
+
+    roots: list[str]
+    stamps: list[StampIndex]
+    dirs: list[DirIndex]
+    incremental: bool
+    work: LifoQueue[Optional[WorkItem]]
+    seen: set[str]
+    updated: list[tuple[str, int]]
+
+    def __init__(self,
+                 db: database.Database,
+                 roots: list[str],
+                 incremental: bool) -> None:
+        self.roots = roots
+        self.stamps = []
+        budget: int = STAMP_INDEX_LIMIT
+        for r in roots:
+            idx: StampIndex = StampIndex(db, r, budget)
+            budget -= len(idx)
+            self.stamps.append(idx)
+        self.dirs = [DirIndex(db, r) for r in roots]
+        self.incremental = incremental
+        self.work = LifoQueue()
+        self.seen = set()
+        self.updated = []
+
+
 class Scanner:
     """Scanner walks one or more directory trees, looking for image files"""
 
-    __slots__ = ['logger', 'queue']
+    __slots__ = ['logger', 'queue', 'walker_cnt', 'cancelled']
 
     logger: logging.Logger
     queue: Queue[str]
+    walker_cnt: int
+    cancelled: Event
 
-    def __init__(self, q: Queue[str]) -> None:
+    def __init__(self,
+                 q: Queue[str],
+                 walker_cnt: int = WALKER_COUNT) -> None:
         self.logger = common.get_logger("scanner")
         self.queue = q
+        self.walker_cnt = walker_cnt
+        self.cancelled = Event()
 
-    # pylint: disable-msg=R1702
     def walk_dir(self, path: str) -> None:
         """Walk a single directory tree"""
+        self.scan(path)
+
+    def cancel(self) -> None:
+        """Make a running scan stop as soon as possible.
+
+        The directories already listed are remembered, the rest will be
+        walked by the next scan.
+        """
+        self.cancelled.set()
+
+    def scan(self, *args, incremental: bool = False) -> None:
+        """Walk a list of folders in parallel.
+
+        Folders nested inside another one are only walked once.
+        All folders share one pool of walker threads. Each directory is a
+        separate work item, the subdirectories found in it are handed back
+        to the pool, so a single large tree is walked by all threads.
+
+        The mtime of every directory is recorded, unless images in it were
+        queued: Those are stored later, or not at all if the process dies
+        first, so the directory's mtime is recorded by the next scan that
+        finds nothing new in it. If incremental is True, directories whose
+        mtime has not changed since they were recorded are not listed again,
+        only their subdirectories are visited. Note that this misses images
+        that were modified in place without touching their directory.
+
+        Returns when all folders have been processed, or the scan has been
+        cancelled.
+        """
+        self.cancelled.clear()
+        roots: list[str] = collapse_roots(list(args))
         db: database.Database = database.Database(common.path.db())
         try:
-            for folder, _, files in os.walk(path):
-                try:
-                    for f in files:
-                        full_path: str = os.path.join(folder, f)
-                        if _picPat.search(full_path):
-                            scur = file_mtime(full_path)
-                            sdb = db.file_timestamp(full_path)
-                            if (sdb is None) or (scur > sdb):  # type: ignore # noqa: E501
-                                self.queue.put(full_path)
-                except Exception as e:  # pylint: disable-msg=W0718
-                    self.logger.debug("Error scanning %s: %s",
-                                      folder,
-                                      e)
-                    continue
+            job: _ScanJob = _ScanJob(db, roots, incremental)
+            for i, f in enumerate(roots):
+                self.logger.debug("Scan %s", f)
+                job.work.put((i, f, None))
+
+            walkers: list[Thread] = []
+            for _ in range(self.walker_cnt):
+                w: Thread = Thread(target=self.__walker, args=(job, ))
+                w.daemon = True
+                w.start()
+                walkers.append(w)
+
+            job.work.join()
+            for w in walkers:
+                job.work.put(None)
+            for w in walkers:
+                w.join()
+
+            db.dir_update(job.updated)
+            if not self.cancelled.is_set():
+                # After a cancelled scan, we cannot tell which directories
+                # are gone and which we just did not get to.
+                gone: list[str] = [p
+                                   for idx in job.dirs
+                                   for p in idx.mtimes
+                                   if p not in job.seen]
+                db.dir_delete(gone)
         finally:
             with db:
-                db.folder_add(path)
+                for f in roots:
+                    db.folder_add(f)
 
-    def scan(self, *args) -> None:
-        """Walk a list of folders in parallel.
+    def __walker(self, job: _ScanJob) -> None:
+        """Process directories from the work queue until we get None."""
+        db: Optional[database.Database] = None
+        if not all(idx.loaded for idx in job.stamps):
+            db = database.Database(common.path.db())
+
+        while True:
+            item: Optional[WorkItem] = job.work.get()
+            try:
+                if item is None:
+                    return
+                if self.cancelled.is_set():
+                    continue
+                self.__scan_dir(job, item, db)
+            except Exception as e:  # pylint: disable-msg=W0718
+                self.logger.debug("Error scanning %s: %s",
+                                  item,
+                                  e)
+            finally:
+                job.work.task_done()
 
-        Returns when all folders have been processed.
+    def __scan_dir(self,
+                   job: _ScanJob,
+                   item: WorkItem,
+                   db: Optional[database.Database]) -> None:
+        """Scan a single directory.
+
+        Subdirectories are put back in the work queue, new or modified
+        images are put in the queue. The stat results of the DirEntry are
+        reused, so each file is stat'ed at most once.
         """
-        workers: list[Thread] = []
-        for f in args:
-            self.logger.debug("Start worker for %s", f)
-            w: Thread = Thread(target=self.walk_dir, args=(f, ))
-            w.start()
-            workers.append(w)
-
-        for w in workers:
-            w.join()
+        root, folder, mtime = item
+        if mtime is None:
+            mtime = os.stat(folder).st_mtime_ns
+            _stat_calls.inc()
+        job.seen.add(folder)
+
+        dirs: DirIndex = job.dirs[root]
+        if job.incremental and dirs.unchanged(folder, mtime):
+            _skipped_dirs.inc()
+            for sub in dirs.children(folder):
+                job.work.put((root, sub, None))
+            return
+
+        candidates: list[tuple[str, int, int]] = []
+        stats: int = 0
+        with _list_time.time(), os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stats += 1
+                        job.work.put(
+                            (root,
+                             entry.path,
+                             entry.stat(follow_symlinks=False).st_mtime_ns))
+                    elif _picPat.search(entry.name) and entry.is_file():
+                        stats += 1
+                        st = entry.stat()
+                        candidates.append((entry.path,
+                                           int(st.st_mtime),
+                                           st.st_size))
+                except OSError:
+                    continue
+        _dirs.inc()
+        _stat_calls.inc(stats)
+        _images.inc(len(candidates))
+
+        if len(candidates) > 0:
+            with _lookup_time.time():
+                known: dict[str, int] = \
+                    job.stamps[root].lookup([c[0] for c in candidates], db)
+            tasks: list[scheduler.Task] = []
+            for full_path, scur, size in candidates:
+                sdb = known.get(full_path)
+                if (sdb is None) or (scur > sdb):
+                    tasks.append(scheduler.Task(full_path,
+                                                scur,
+                                                size,
+                                                job.roots[root]))
+            _queued.inc(len(tasks))
+            if isinstance(self.queue, scheduler.Scheduler):
+                # A JobQueue records the whole directory at once.
+                self.queue.submit_many(tasks)
+            else:
+                for t in tasks:
+                    self.queue.put(t.path)
+            if len(tasks) > 0:
+                # The directory is recorded, so the next incremental scan
+                # visits it, but with an mtime that never matches.
+                mtime = UNRECORDED
+
+        job.updated.append((folder, mtime))
 
 # Local Variables: #
 # python-indent: 4 #
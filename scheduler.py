@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 10:12:37 krylon>
+#
+# /data/code/python/memex/scheduler.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.scheduler
+
+(c) 2026 Benjamin Walkenhorst
+
+Decides in which order the images found by the Scanner are handed to the
+Reader, and keeps track of them in the database so an interrupted scan
+can be resumed. The policy is picked with the --schedule option or in the
+[scheduler] section of the configuration file:
+
+    [scheduler]
+    policy = newest
+"""
+
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from queue import Queue
+from typing import (Callable, Final, NamedTuple, Optional, Sequence,
+                    Union)
+
+from memex import common, database
+
+SECTION: Final[str] = "scheduler"
+DEFAULT_POLICY: Final[str] = "newest"
+# The number of jobs JobQueue marks as active in one transaction.
+JOB_START_BATCH: Final[int] = 64
+
+
+class Task(NamedTuple):  # pylint: disable-msg=R0903
+    """An image waiting to be read, along with what we know about it.
+
+    root is the folder the scan that found the image started from.
+    """
+
+    path: str
+    mtime: int
+    size: int
+    root: str = ""
+
+
+def make_task(path: str, root: str = "") -> Task:
+    """Create the Task for an image we only know the path of."""
+    try:
+        st = os.stat(path)
+        return Task(path, int(st.st_mtime), st.st_size, root)
+    except OSError:
+        return Task(path, 0, 0, root)
+
+
+class Policy(ABC):
+    """Policy is the base class of the scheduling policies.
+
+    A Policy only keeps the pending Tasks in order, the Scheduler takes
+    care of locking.
+    """
+
+    @abstractmethod
+    def push(self, task: Task) -> None:
+        """Add a Task."""
+
+    @abstractmethod
+    def pop(self) -> Task:
+        """Remove and return the next Task."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Return the number of pending Tasks."""
+
+
+class FifoPolicy(Policy):
+    """Hand out images in the order they were found."""
+
+    def __init__(self) -> None:
+        self.tasks: deque[Task] = deque()
+
+    def push(self, task: Task) -> None:
+        self.tasks.append(task)
+
+    def pop(self) -> Task:
+        return self.tasks.popleft()
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+
+class HeapPolicy(Policy):
+    """Hand out the image with the lowest key first.
+
+    Images with the same key come out in the order they were found.
+    """
+
+    def __init__(self, key: Callable[[Task], int]) -> None:
+        self.key = key
+        self.heap: list[tuple[int, int, Task]] = []
+        self.cnt: int = 0
+
+    def push(self, task: Task) -> None:
+        heapq.heappush(self.heap, (self.key(task), self.cnt, task))
+        self.cnt += 1
+
+    def pop(self) -> Task:
+        return heapq.heappop(self.heap)[2]
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+
+class RoundRobinPolicy(Policy):
+    """Take turns between the roots, so no root has to wait for another.
+
+    Within a root, images are handed out in the order they were found.
+    """
+
+    def __init__(self) -> None:
+        self.lanes: dict[str, deque[Task]] = {}
+        self.turns: deque[str] = deque()
+        self.cnt: int = 0
+
+    def push(self, task: Task) -> None:
+        lane: Optional[deque[Task]] = self.lanes.get(task.root)
+        if lane is None:
+            lane = deque()
+            self.lanes[task.root] = lane
+            self.turns.append(task.root)
+        lane.append(task)
+        self.cnt += 1
+
+    def pop(self) -> Task:
+        root: str = self.turns.popleft()
+        lane: deque[Task] = self.lanes[root]
+        task: Task = lane.popleft()
+        if len(lane) > 0:
+            self.turns.append(root)
+        else:
+            del self.lanes[root]
+        self.cnt -= 1
+        return task
+
+    def __len__(self) -> int:
+        return self.cnt
+
+
+POLICIES: Final[dict[str, Callable[[], Policy]]] = {
+    "fifo": FifoPolicy,
+    "newest": lambda: HeapPolicy(lambda t: -t.mtime),
+    "smallest": lambda: HeapPolicy(lambda t: t.size),
+    "roundrobin": RoundRobinPolicy,
+}
+
+
+def load_policy() -> str:
+    """Return the policy named in the configuration file."""
+    cfg = common.load_config()
+    if cfg.has_section(SECTION):
+        return cfg[SECTION].get("policy", DEFAULT_POLICY)
+    return DEFAULT_POLICY
+
+
+class Scheduler(Queue):
+    """Scheduler is a Queue that hands out images according to a Policy.
+
+    By default, it is unbounded, since it can only pick the best image to
+    read next from those it has seen. The price is that nothing slows
+    down the Scanner, so a full rescan of a large tree keeps every pending
+    image in memory. A maxsize greater than 0 limits the number of pending
+    images, put then blocks until there is room again, trading the quality
+    of the order for memory. Images put into it
+    by path are stat'ed to find their mtime and size; the Scanner, which
+    knows them already, uses submit instead.
+    Consumers should call task_done for each image they got, from the
+    thread that got it, the Scheduler uses that to keep track of its
+    throughput.
+    Putting None tells one consumer to stop. It is handed out before any
+    pending image, and it does not count as a completed image.
+    """
+
+    policy: str
+    dispatched: int
+    completed: int
+    started: float
+    finished: float
+    held: threading.local
+
+    def __init__(self,
+                 policy: Optional[str] = None,
+                 maxsize: int = 0) -> None:
+        if policy is None:
+            policy = load_policy()
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid scheduling policy {policy}")
+        self.policy = policy
+        self.dispatched = 0
+        self.completed = 0
+        self.started = 0.0
+        self.finished = 0.0
+        # Whether the last item a thread got was a None.
+        self.held = threading.local()
+        super().__init__(maxsize)
+
+    # The following methods are called by Queue with the mutex held.
+
+    def _init(self, maxsize: int) -> None:
+        self.tasks: Policy = POLICIES[self.policy]()
+        self.stops: int = 0
+
+    def _qsize(self) -> int:
+        return len(self.tasks) + self.stops
+
+    def _put(self, item: Union[str, Task, None]) -> None:
+        if item is None:
+            self.stops += 1
+            return
+        if isinstance(item, str):
+            item = make_task(item)
+        self.tasks.push(item)
+
+    def _get(self) -> Optional[str]:
+        if self.stops > 0:
+            self.stops -= 1
+            return None
+        if self.dispatched == 0:
+            self.started = time.monotonic()
+        self.dispatched += 1
+        return self.tasks.pop().path
+
+    def submit(self,
+               path: str,
+               mtime: int,
+               size: int,
+               root: str = "") -> None:
+        """Add an image whose mtime and size we already know."""
+        self.put(Task(path, mtime, size, root))  # type: ignore
+
+    def submit_many(self, tasks: Sequence[Task]) -> None:
+        """Add several images whose mtime and size we already know."""
+        for task in tasks:
+            self.put(task)  # type: ignore
+
+    def clear(self) -> int:
+        """Drop all pending images and return how many there were."""
+        with self.mutex:
+            cnt: int = len(self.tasks)
+            self.tasks = POLICIES[self.policy]()
+            self.not_full.notify_all()
+            self.unfinished_tasks -= cnt
+            if self.unfinished_tasks <= 0:
+                self.unfinished_tasks = 0
+                self.all_tasks_done.notify_all()
+            return cnt
+
+    def get(self,
+            block: bool = True,
+            timeout: Optional[float] = None) -> Optional[str]:
+        path: Optional[str] = super().get(block, timeout)
+        self.held.stop = path is None
+        return path
+
+    def task_done(self) -> None:
+        super().task_done()
+        if getattr(self.held, "stop", False):
+            self.held.stop = False
+            return
+        with self.mutex:
+            self.completed += 1
+            self.finished = time.monotonic()
+
+    def stats(self) -> dict[str, Union[str, int, float]]:
+        """Return the number of images handed out and processed so far.
+
+        rate is the number of images processed per second since the first
+        one was handed out.
+        """
+        with self.mutex:
+            elapsed: float = self.finished - self.started
+            return {
+                "policy": self.policy,
+                "pending": len(self.tasks),
+                "dispatched": self.dispatched,
+                "completed": self.completed,
+                "rate": self.completed / elapsed if elapsed > 0 else 0.0,
+            }
+
+
+class JobQueue(Scheduler):
+    """JobQueue is a Scheduler that records its images in the job table.
+
+    Images are written to the database before they are queued, and a path
+    that is already pending or being read is not queued a second time.
+    The database marks a job as done when its image is stored. Jobs
+    belong to the process that queued them. When a JobQueue is created, it
+    takes over the jobs left over by earlier runs that are no longer
+    running, so an interrupted scan picks up where it stopped, while the
+    jobs of another running process are left alone.
+    A JobQueue is always unbounded, the jobs it resumes are queued before
+    anyone reads from it.
+    Jobs handed out are marked as active in batches, to keep the number
+    of transactions down. Errors from the database are logged and do not
+    get in the way of handing out images.
+    Each thread gets its own connection to the database.
+    """
+
+    log: logging.Logger
+    path: str
+    owner: int
+    local: threading.local
+    lock: threading.Lock
+    batch: list[str]
+
+    def __init__(self,
+                 policy: Optional[str] = None,
+                 path: Optional[str] = None) -> None:
+        self.log = common.get_logger("jobqueue")
+        self.path = path or common.path.db()
+        self.owner = os.getpid()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.batch = []
+        super().__init__(policy)
+        pending: list[database.Job] = self.__db().job_recover(self.owner)
+        if len(pending) > 0:
+            self.log.info("Resume %d jobs left over from the last run",
+                          len(pending))
+        for job in pending:
+            super().put(Task(*job))
+
+    def __db(self) -> database.Database:
+        """Return the calling thread's database, opening it if needed."""
+        db: Optional[database.Database] = getattr(self.local, "db", None)
+        if db is None:
+            db = database.Database(self.path)
+            self.local.db = db
+        return db
+
+    def put(self,
+            item: Union[str, Task, None],
+            block: bool = True,
+            timeout: Optional[float] = None) -> None:
+        if item is None:
+            super().put(None, block, timeout)
+            return
+        if isinstance(item, str):
+            item = make_task(item)
+        if len(self.__add([item])) > 0:
+            super().put(item, block, timeout)
+
+    def submit_many(self, tasks: Sequence[Task]) -> None:
+        for task in self.__add(tasks):
+            super().put(Task(*task))
+
+    def __add(self, tasks: Sequence[Task]) -> Sequence[database.Job]:
+        """Record tasks in the job table and return those to queue.
+
+        If the database cannot be written, all tasks are queued anyway,
+        they are neither deduplicated nor resumed after a crash then.
+        """
+        try:
+            return self.__db().job_add_many(tasks, self.owner)
+        except sqlite3.Error as err:
+            self.log.warning("Cannot record %d jobs: %s", len(tasks), err)
+            return tasks
+
+    def get(self,
+            block: bool = True,
+            timeout: Optional[float] = None) -> Optional[str]:
+        path: Optional[str] = super().get(block, timeout)
+        if path is not None:
+            with self.lock:
+                self.batch.append(path)
+                full: bool = len(self.batch) >= JOB_START_BATCH
+            if full or self.empty():
+                self.flush()
+        return path
+
+    def flush(self) -> None:
+        """Mark the jobs handed out since the last flush as active.
+
+        If the database cannot be written, e.g. because it is locked for
+        too long, the batch is dropped. The jobs stay pending, which only
+        matters if the process dies before they are done.
+        """
+        with self.lock:
+            paths: list[str] = self.batch
+            self.batch = []
+        if len(paths) == 0:
+            return
+        try:
+            self.__db().job_start_many(paths)
+        except sqlite3.Error as err:
+            self.log.warning("Cannot mark %d jobs as active: %s",
+                             len(paths),
+                             err)
+
+    def fail(self, path: str, error: str) -> None:
+        """Record that an image could not be processed."""
+        self.flush()
+        try:
+            self.__db().job_fail(path, error)
+        except sqlite3.Error as err:
+            self.log.warning("Cannot record failure of %s: %s", path, err)
+
+    def counts(self) -> dict[str, int]:
+        """Return the number of jobs in each state."""
+        names: Final[dict[int, str]] = {
+            database.JOB_PENDING: "pending",
+            database.JOB_ACTIVE: "active",
+            database.JOB_DONE: "done",
+            database.JOB_FAILED: "failed",
+        }
+        self.flush()
+        counts: dict[int, int] = self.__db().job_count()
+        return {name: counts.get(state, 0) for state, name in names.items()}
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
@@ -36,13 +36,16 @@ memex.test_database
 # pylint: disable-msg=C0103
 
 import os
+import sqlite3
+import subprocess
 import unittest
 from datetime import datetime
 from typing import Final, Optional
+from unittest import mock
 
 from krylib import isdir
 
-from memex import common, database
+from memex import common, database, image, ocrcache, scheduler, thumbnail
 
 # TMP_ROOT: Final[str] = "/data/ram"
 TEST_ROOT: str = "/tmp/"
@@ -54,6 +57,25 @@ TEST_DIR: Final[str] = os.path.join(
     TEST_ROOT,
     datetime.now().strftime("memex_test_database_%Y%m%d_%H%M%S"))
 
+# The schema of databases created before we kept track of versions.
+OLD_SCHEMA: Final[list[str]] = [
+    """CREATE TABLE image (
+        id INTEGER PRIMARY KEY,
+        path TEXT UNIQUE NOT NULL,
+        content TEXT NOT NULL DEFAULT '',
+        comment TEXT NOT NULL DEFAULT '',
+        timestamp INTEGER NOT NULL)""",
+    "CREATE VIRTUAL TABLE img_index USING fts4(path, content, comment)",
+    """CREATE TRIGGER tr_fts_img_add AFTER INSERT ON image
+       BEGIN
+           INSERT INTO img_index (path, content, comment)
+           VALUES (new.path, new.content, new.comment);
+       END""",
+    """CREATE TABLE folder (id        INTEGER PRIMARY KEY,
+                           path      TEXT UNIQUE NOT NULL,
+                           timestamp INTEGER NOT NULL)""",
+]
+
 
 class DatabaseTest(unittest.TestCase):
     """Test the database."""
@@ -146,6 +168,316 @@ class DatabaseTest(unittest.TestCase):
         except Exception as e:  # pylint: disable-msg=W0718
             self.fail(f"Error getting all folders: {e}")
 
+    def test_07_image_add_many(self) -> None:
+        """Test adding several images in one go."""
+        db = self.__class__.db()
+        now: Final[datetime] = datetime.now()
+        images: list[image.Image] = [
+            image.Image(0, f"/tmp/batch{i:03d}.png", f"Stapel {i}", "", now)
+            for i in range(16)
+        ]
+        db.file_add_many(images)
+        results = db.file_search("Stapel")
+        self.assertEqual(len(results), len(images))
+        db.file_add_many(images)
+        results = db.file_search("Stapel")
+        self.assertEqual(len(results), len(images))
+
+    def test_08_checkpoint(self) -> None:
+        """Test running a WAL checkpoint by hand."""
+        db = self.__class__.db()
+        db.set_autocheckpoint(0)
+        busy, _, _ = db.checkpoint()
+        self.assertEqual(busy, 0)
+        with self.assertRaises(ValueError):
+            db.checkpoint("BOGUS")
+
+    def test_09_file_stamps(self) -> None:
+        """Test loading the timestamps of all images below a folder."""
+        db = self.__class__.db()
+        self.assertEqual(db.file_stamp_count("/tmp"), 17)
+        self.assertEqual(db.file_stamp_count("/tmp/batch"), 0)
+        stamps = list(db.file_stamps("/tmp/"))
+        self.assertEqual(len(stamps), 17)
+        paths = [s[0] for s in stamps]
+        self.assertEqual(paths, sorted(paths))
+        known = db.file_stamps_for(["/tmp/img001.jpg", "/tmp/nope.png"])
+        self.assertEqual(list(known.keys()), ["/tmp/img001.jpg"])
+
+    def test_10_ocr_cache(self) -> None:
+        """Test storing and retrieving text in the OCR cache."""
+        cache = ocrcache.OCRCache(common.path.ocr_cache())
+        sample: Final[str] = os.path.join(TEST_DIR, "sample.png")
+        with open(sample, "wb") as fh:
+            fh.write(b"Not really a PNG file")
+        digest: str = ocrcache.file_digest(sample)
+        self.assertIsNone(cache.get(digest, "eng;"))
+        cache.put(digest, "eng;", "Wer das liest, ist doof")
+        self.assertEqual(cache.get(digest, "eng;"), "Wer das liest, ist doof")
+        self.assertIsNone(cache.get(digest, "deu;"))
+
+    def test_11_upgrade(self) -> None:
+        """Test upgrading the schema of an existing database."""
+        path: Final[str] = os.path.join(TEST_DIR, "old.db")
+        old = sqlite3.connect(path)
+        with old:
+            for query in OLD_SCHEMA:
+                old.execute(query)
+            old.execute("""INSERT INTO image (path, content, timestamp)
+                           VALUES ('/tmp/old.png', 'Altbestand', 0)""")
+        old.close()
+
+        db = database.Database(path)
+        cur = db.db.execute("PRAGMA user_version")
+        self.assertEqual(cur.fetchone()[0], database.DB_VERSION)
+        self.assertEqual(len(db.file_search("Altbestand")), 1)
+        db.dir_update([("/data/Pictures", 42)])
+        self.assertEqual(list(db.dir_get_all("/data")),
+                         [("/data/Pictures", 42)])
+
+    def test_12_image_update(self) -> None:
+        """Test that the index follows updates and deletions."""
+        db = self.__class__.db()
+        now = datetime.now()
+        db.file_add("/tmp/update.png", "Vorher", "", now)
+        db.file_add("/tmp/update.png", "Nachher", "", now)
+        self.assertEqual(len(db.file_search("Vorher")), 0)
+        self.assertEqual(len(db.file_search("Nachher")), 1)
+        db.file_remove("/tmp/update.png")
+        self.assertEqual(len(db.file_search("Nachher")), 0)
+
+    def test_13_image_search_rank(self) -> None:
+        """Test searching with results ordered by relevance."""
+        db = self.__class__.db()
+        now = datetime.now()
+        db.file_add("/tmp/rank1.png", "Apfel Birne Birne Birne", "", now)
+        db.file_add("/tmp/rank2.png", "Apfel " * 20 + "Birne", "", now)
+        results = db.file_search("Birne", rank=True)
+        self.assertEqual([r.path for r in results],
+                         ["/tmp/rank1.png", "/tmp/rank2.png"])
+        # Not valid fts5 queries, but we still want results.
+        self.assertEqual(len(db.file_search("Apfel-Birne")), 2)
+        self.assertEqual(len(db.file_search("Birne.")), 2)
+
+    def test_14_image_search_iter(self) -> None:
+        """Test paging through search results."""
+        db = self.__class__.db()
+        first = list(db.file_search_iter("Stapel", limit=5, content=False))
+        self.assertEqual(len(first), 5)
+        self.assertTrue(all(img.content == "" for img in first))
+        key: tuple[int, int] = database.search_key(first[-1])
+        rest = list(db.file_search_iter("Stapel", after=key))
+        self.assertEqual(len(rest), 11)
+        self.assertEqual([img.path for img in first + rest],
+                         [img.path for img in db.file_search("Stapel")])
+        with self.assertRaises(ValueError):
+            list(db.file_search_iter("Stapel", after=(0, 0), rank=True))
+
+    def test_15_image_search_snippets(self) -> None:
+        """Test getting snippets with search results."""
+        db = self.__class__.db()
+        results = list(db.file_search_iter("doof",
+                                           content=False,
+                                           snippets=True))
+        self.assertEqual(len(results), 1)
+        snippet = results[0].snippet
+        assert snippet is not None
+        self.assertEqual(snippet.text, "Wer das liest, ist doof")
+        self.assertEqual(snippet.matches, [(19, 23)])
+        self.assertIsNone(db.file_search("doof")[0].snippet)
+
+    def test_16_parse_snippet(self) -> None:
+        """Test parsing the snippets SQLite returns."""
+        snippet = database.parse_snippet("…a \x02b\x03 c \x02dd\x03")
+        self.assertEqual(snippet.text, "…a b c dd")
+        self.assertEqual(snippet.matches, [(3, 4), (7, 9)])
+
+    def test_17_search_cache(self) -> None:
+        """Test caching search results."""
+        db = self.__class__.db()
+        now = datetime.now()
+        db.file_add("/tmp/cache1.png", "Zwetschgenkuchen", "", now)
+        hits: int = db.cache_stats()["hits"]
+        first = db.file_search("Zwetschgenkuchen")
+        second = db.file_search("Zwetschgenkuchen")
+        self.assertEqual(first, second)
+        self.assertEqual(db.cache_stats()["hits"], hits + 1)
+
+        # A partially consumed search is not cached.
+        next(db.file_search_iter("Zwetschgenkuchen", limit=-1, rank=True))
+        db.file_search("Zwetschgenkuchen", rank=True)
+        self.assertEqual(db.cache_stats()["hits"], hits + 1)
+
+        db.file_add("/tmp/cache2.png", "Zwetschgenkuchen mit Sahne", "", now)
+        self.assertEqual(len(db.file_search("Zwetschgenkuchen")), 2)
+        self.assertEqual(db.cache_stats()["hits"], hits + 1)
+
+    def test_18_thumbnail_store(self) -> None:
+        """Test storing, invalidating and evicting thumbnails."""
+        store = thumbnail.ThumbnailStore(common.path.thumbnails(),
+                                         max_bytes=1000)
+        paths: list[str] = []
+        for i in range(4):
+            path: str = os.path.join(TEST_DIR, f"thumb{i:02d}.png")
+            with open(path, "wb") as fh:
+                fh.write(b"Not really a PNG file")
+            paths.append(path)
+
+        self.assertIsNone(store.get(paths[0]))
+        store.put(paths[0], b"x" * 400)
+        self.assertEqual(store.get(paths[0]), b"x" * 400)
+
+        # Changing the file invalidates its thumbnail.
+        with open(paths[0], "ab") as fh:
+            fh.write(b", still not")
+        self.assertIsNone(store.get(paths[0]))
+
+        for path in paths:
+            store.put(path, b"x" * 400)
+        self.assertEqual(store.evict(), 2)
+        self.assertLessEqual(store.total(), 1000)
+
+    def test_19_skipped(self) -> None:
+        """Test keeping track of images the prefilter skipped."""
+        db = self.__class__.db()
+        now = datetime.now()
+        img = db.file_add("/tmp/photo.jpg", "", "", now, skipped=True)
+        self.assertTrue(img.skipped)
+        self.assertIn("/tmp/photo.jpg", db.file_get_skipped())
+        db.file_add_many(
+            [image.Image(0, "/tmp/photo.jpg", "Urlaub", "", now)])
+        self.assertNotIn("/tmp/photo.jpg", db.file_get_skipped())
+
+    def test_20_job_queue(self) -> None:
+        """Test recording, deduplicating and resuming jobs."""
+        path: Final[str] = common.path.db()
+        tasks: list[scheduler.Task] = [
+            scheduler.Task("/tmp/job1.png", 100, 1000, "/tmp"),
+            scheduler.Task("/tmp/job2.png", 200, 2000, "/tmp"),
+        ]
+        jq = scheduler.JobQueue("fifo", path)
+        jq.submit_many(tasks)
+        jq.submit_many(tasks[:1])
+        self.assertEqual(jq.qsize(), 2)
+        self.assertEqual(jq.get(), "/tmp/job1.png")
+        self.assertEqual(jq.counts()["active"], 1)
+
+        # The job that was being read when we "crashed" is pending again.
+        jq = scheduler.JobQueue("fifo", path)
+        self.assertEqual(jq.qsize(), 2)
+
+        db = self.__class__.db()
+        db.file_add("/tmp/job1.png", "Erledigt", "", datetime.now())
+        jq = scheduler.JobQueue("fifo", path)
+        self.assertEqual(jq.qsize(), 1)
+        self.assertEqual(jq.get(), "/tmp/job2.png")
+        jq.fail("/tmp/job2.png", "Kaputt")
+        self.assertEqual(jq.counts(),
+                         {"pending": 0, "active": 0, "done": 0, "failed": 1})
+
+    def test_21_cleanup(self) -> None:
+        """Test removing images whose files are gone."""
+        db = self.__class__.db()
+        folder: Final[str] = os.path.join(TEST_DIR, "cleanup")
+        os.mkdir(folder)
+        kept: Final[str] = os.path.join(folder, "kept.png")
+        with open(kept, "w"):  # pylint: disable-msg=W1514
+            pass
+        now = datetime.now()
+        gone: Final[str] = os.path.join(folder, "gone.png")
+        outside: Final[str] = f"{folder}2/gone.png"
+        db.file_add_many([image.Image(0, kept, "Bleibt", "", now),
+                          image.Image(0, gone, "Weg", "", now),
+                          image.Image(0, outside, "Weg", "", now)])
+        calls: list[tuple[int, int]] = []
+        self.assertEqual(db.cleanup(folder,
+                                    lambda c, r: calls.append((c, r))),
+                         1)
+        self.assertEqual(calls, [(2, 1)])
+        self.assertEqual(len(db.file_search("Weg")), 1)
+
+        self.assertGreaterEqual(db.cleanup(), 1)
+        self.assertEqual(len(db.file_search("Weg")), 0)
+        self.assertEqual(len(db.file_search("Bleibt")), 1)
+
+    def test_22_job_owner(self) -> None:
+        """Test that only the jobs of finished processes are taken over."""
+        path: Final[str] = common.path.db()
+        db = self.__class__.db()
+        with subprocess.Popen(["true"]) as proc:
+            proc.wait()
+        db.job_add_many([("/tmp/alive.png", 1, 1, "/tmp")], os.getppid())
+        db.job_add_many([("/tmp/dead.png", 1, 1, "/tmp")], proc.pid)
+        db.job_add_many([("/tmp/legacy.png", 1, 1, "/tmp")], 0)
+        jq = scheduler.JobQueue("fifo", path)
+        self.assertEqual(jq.qsize(), 2)
+        self.assertEqual(sorted([jq.get(), jq.get()]),
+                         ["/tmp/dead.png", "/tmp/legacy.png"])
+        self.assertEqual(jq.counts()["pending"], 1)
+        jq.fail("/tmp/dead.png", "Tot")
+        jq.fail("/tmp/legacy.png", "Alt")
+
+    def test_23_job_queue_locked(self) -> None:
+        """Test that a locked database does not keep jobs from being read."""
+        path: Final[str] = common.path.db()
+        jq = scheduler.JobQueue("fifo", path)
+        jq.submit_many([scheduler.Task("/tmp/locked.png", 1, 1, "/tmp")])
+        lock = sqlite3.connect(path, isolation_level=None)
+        lock.execute("BEGIN IMMEDIATE")
+        try:
+            self.assertEqual(jq.get(), "/tmp/locked.png")
+            jq.fail("/tmp/locked.png", "Gesperrt")
+        finally:
+            lock.execute("ROLLBACK")
+            lock.close()
+        jq.task_done()
+
+        # Jobs that cannot be recorded are still queued.
+        locked = sqlite3.OperationalError("database is locked")
+        with mock.patch.object(database.Database,
+                               "job_add_many",
+                               side_effect=locked):
+            jq.put("/tmp/unrecorded1.png")
+            jq.submit_many([scheduler.Task("/tmp/unrecorded2.png",
+                                           1,
+                                           1,
+                                           "/tmp")])
+        self.assertEqual(jq.qsize(), 2)
+
+    def test_24_upgrade_failed(self) -> None:
+        """Test that a failed migration step leaves the schema unchanged."""
+        path: Final[str] = os.path.join(TEST_DIR, "failed.db")
+        database.Database(path).db.close()
+        broken: Final[list[str]] = [
+            "ALTER TABLE image ADD COLUMN extra INTEGER NOT NULL DEFAULT 0",
+            "THIS IS NOT SQL",
+        ]
+        version: Final[int] = database.DB_VERSION + 1
+        with mock.patch.object(database, "DB_VERSION", version), \
+             mock.patch.dict(database.MIGRATIONS, {version: broken}):
+            with self.assertRaisesRegex(sqlite3.OperationalError, "syntax"):
+                database.Database(path)
+            # The first statement was rolled back, so it runs again.
+            with self.assertRaisesRegex(sqlite3.OperationalError, "syntax"):
+                database.Database(path)
+
+        db = database.Database(path)
+        cur = db.db.execute("PRAGMA user_version")
+        self.assertEqual(cur.fetchone()[0], database.DB_VERSION)
+        columns = [row[1] for row in db.db.execute("PRAGMA table_info(image)")]
+        self.assertNotIn("extra", columns)
+
+        # The same goes for creating a fresh database.
+        path2: Final[str] = os.path.join(TEST_DIR, "failed2.db")
+        init: Final[list[str]] = [database.INIT_QUERIES[0], broken[1]]
+        with mock.patch.object(database, "INIT_QUERIES", init):
+            with self.assertRaisesRegex(sqlite3.OperationalError, "syntax"):
+                database.Database(path2)
+        fresh = sqlite3.connect(path2)
+        cur = fresh.execute("SELECT COUNT(*) FROM sqlite_master")
+        self.assertEqual(cur.fetchone()[0], 0)
+        fresh.close()
+
 # Local Variables: #
 # python-indent: 4 #
 # End: #
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 09:47:05 krylon>
+#
+# /data/code/python/memex/test_ocrcache.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.test_ocrcache
+
+(c) 2026 Benjamin Walkenhorst
+"""
+
+import os
+import sqlite3
+import unittest
+from datetime import datetime
+from typing import Final
+from unittest import mock
+
+from krylib import isdir
+
+from memex import common, ocrcache
+
+TEST_ROOT: str = "/tmp/"
+
+if isdir("/data/ram"):
+    TEST_ROOT = "/data/ram"
+
+TEST_DIR: Final[str] = os.path.join(
+    TEST_ROOT,
+    datetime.now().strftime("memex_test_ocrcache_%Y%m%d_%H%M%S"))
+
+# The schema of caches created before we kept track of their size.
+OLD_SCHEMA: Final[str] = """CREATE TABLE ocr (
+    digest    TEXT NOT NULL,
+    profile   TEXT NOT NULL,
+    content   TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (digest, profile)
+) WITHOUT ROWID"""
+
+
+class OCRCacheTest(unittest.TestCase):
+    """Test the size limit of the OCR cache."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Prepare the test environment."""
+        common.set_basedir(TEST_DIR)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Clean up the test environment."""
+        os.system(f'rm -rf "{TEST_DIR}"')
+
+    def cache_path(self) -> str:
+        """Return the path of a cache file for the current test."""
+        return os.path.join(TEST_DIR, f"{self._testMethodName}.db")
+
+    def set_atime(self, digest: str, atime: int) -> None:
+        """Pretend an entry was last used at atime."""
+        conn = sqlite3.connect(self.cache_path(), isolation_level=None)
+        conn.execute("UPDATE ocr SET atime = ? WHERE digest = ?",
+                     (atime, digest))
+        conn.close()
+
+    def test_evict(self) -> None:
+        """Test that the entries used least recently are evicted."""
+        cache = ocrcache.OCRCache(self.cache_path(), max_bytes=150)
+        for i, digest in enumerate(("a", "b", "c")):
+            cache.put(digest, "eng;", "x" * 100)
+            self.set_atime(digest, i + 1)
+        self.assertEqual(cache.total(), 300)
+        # Reading an entry makes it the most recently used one.
+        self.assertIsNotNone(cache.get("a", "eng;"))
+        self.assertEqual(cache.evict(), 2)
+        self.assertEqual(cache.get("a", "eng;"), "x" * 100)
+        self.assertIsNone(cache.get("b", "eng;"))
+        self.assertIsNone(cache.get("c", "eng;"))
+        self.assertEqual(cache.evict(), 0)
+
+    def test_evict_on_put(self) -> None:
+        """Test that putting entries keeps the cache below its limit."""
+        text: Final[str] = "Wörter " * 10
+        cache = ocrcache.OCRCache(self.cache_path(), max_bytes=1000)
+        with mock.patch.object(ocrcache, "EVICT_INTERVAL", 4):
+            for i in range(40):
+                cache.put(f"{i:02d}", "eng;", text)
+        # Between two checks, the cache can overshoot by a few entries.
+        self.assertLessEqual(cache.total(),
+                             1000 + 4 * len(text.encode("utf-8")))
+        self.assertIsNotNone(cache.get("39", "eng;"))
+        self.assertIsNone(cache.get("00", "eng;"))
+
+    def test_upgrade(self) -> None:
+        """Test that an old cache gets the size columns."""
+        old = sqlite3.connect(self.cache_path(), isolation_level=None)
+        old.execute(OLD_SCHEMA)
+        old.execute("""INSERT INTO ocr (digest, profile, content, timestamp)
+                       VALUES ('a', 'eng;', 'Größe', 42)""")
+        old.close()
+
+        cache = ocrcache.OCRCache(self.cache_path())
+        self.assertEqual(cache.get("a", "eng;"), "Größe")
+        self.assertEqual(cache.total(), len("Größe".encode("utf-8")))
+        # A second connection finds the cache up to date already.
+        cache2 = ocrcache.OCRCache(self.cache_path())
+        self.assertEqual(cache2.get("a", "eng;"), "Größe")
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 06:21:40 krylon>
+#
+# /data/code/python/memex/test_pipeline.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.test_pipeline
+
+(c) 2026 Benjamin Walkenhorst
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import unittest
+from datetime import datetime
+from queue import Queue
+from typing import Any, Final, Optional
+from unittest import mock
+
+from krylib import isdir
+
+from memex import common, database, image, metrics, pipeline, reader, writer
+
+TEST_ROOT: str = "/tmp/"
+
+if isdir("/data/ram"):
+    TEST_ROOT = "/data/ram"
+
+TEST_DIR: Final[str] = os.path.join(
+    TEST_ROOT,
+    datetime.now().strftime("memex_test_pipeline_%Y%m%d_%H%M%S"))
+
+
+class StubOCR:
+    """StubOCR stands in for Reader.read_image, so we need no Tesseract.
+
+    The text of an image is its file name. If gate is given, each call
+    waits for it to be set, and entered is set when the first call comes
+    in.
+    """
+
+    gate: Optional[threading.Event]
+    entered: threading.Event
+
+    def __init__(self, gate: Optional[threading.Event] = None) -> None:
+        self.gate = gate
+        self.entered = threading.Event()
+
+    def __call__(self, path: str) -> str:
+        self.entered.set()
+        if self.gate is not None:
+            self.gate.wait()
+        return f"Seite {os.path.basename(path)}"
+
+
+class PipelineTest(unittest.TestCase):
+    """Test the Pipeline and the Writer with a stub OCR engine."""
+
+    folder: str
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Prepare the test environment."""
+        common.set_basedir(TEST_DIR)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Clean up the test environment."""
+        os.system(f'rm -rf "{TEST_DIR}"')
+
+    def setUp(self) -> None:
+        """Give each test a database and a folder of images of its own."""
+        common.set_basedir(os.path.join(TEST_DIR, self._testMethodName))
+        self.folder = os.path.join(common.path.base(), "images")
+        os.mkdir(self.folder)
+
+    def images(self, cnt: int) -> list[str]:
+        """Create cnt (empty) image files and return their paths."""
+        paths: list[str] = []
+        for i in range(cnt):
+            path: str = os.path.join(self.folder, f"bild{i:02d}.png")
+            with open(path, "w"):  # pylint: disable-msg=W1514
+                pass
+            paths.append(path)
+        return paths
+
+    def make_pipeline(self, ocr: StubOCR, workers: int) -> pipeline.Pipeline:
+        """Start a Pipeline whose Reader uses ocr instead of Tesseract."""
+        patch = mock.patch.object(reader.Reader, "read_image", ocr)
+        patch.start()
+        self.addCleanup(patch.stop)
+        pl = pipeline.Pipeline(workers,
+                               "fifo",
+                               cache=False,
+                               skip_textless=False)
+        pl.start()
+        self.addCleanup(pl.stop)
+        return pl
+
+    def test_drain(self) -> None:
+        """Test that drain returns once every image is stored."""
+        pl = self.make_pipeline(StubOCR(), 2)
+        for path in self.images(5):
+            pl.submit(path)
+        self.assertTrue(pl.drain(10))
+        self.assertEqual(pl.progress().stored, 5)
+        db = database.Database(common.path.db())
+        self.assertEqual(len(db.file_search("Seite")), 5)
+        self.assertEqual(pl.queue.counts()["pending"], 0)
+
+    def test_drain_timeout(self) -> None:
+        """Test that drain gives up when the images take too long."""
+        gate = threading.Event()
+        pl = self.make_pipeline(StubOCR(gate), 1)
+        pl.submit(self.images(1)[0])
+        self.assertFalse(pl.drain(0.2))
+        gate.set()
+        self.assertTrue(pl.drain(10))
+
+    def test_cancel(self) -> None:
+        """Test that cancel drops the images not read yet, but keeps them."""
+        gate = threading.Event()
+        ocr = StubOCR(gate)
+        pl = self.make_pipeline(ocr, 1)
+        for path in self.images(4):
+            pl.submit(path)
+        self.assertTrue(ocr.entered.wait(10))
+        pl.cancel()
+        self.assertEqual(pl.queue.qsize(), 0)
+        gate.set()
+        self.assertTrue(pl.drain(10))
+        self.assertEqual(pl.progress().stored, 1)
+        self.assertEqual(pl.queue.counts()["pending"], 3)
+
+    def test_stop(self) -> None:
+        """Test that stop shuts down the workers and the Writer."""
+        pl = self.make_pipeline(StubOCR(), 2)
+        pl.submit(self.images(1)[0])
+        self.assertTrue(pl.drain(10))
+        rdr: Optional[reader.Reader] = pl.reader
+        assert rdr is not None
+        pl.stop()
+        self.assertFalse(pl.is_active())
+        self.assertEqual(len(rdr.workers), 0)
+        self.assertFalse(rdr.writer.worker.is_alive())
+        pl.stop()
+
+    def test_gauges(self) -> None:
+        """Test that stop removes the Pipeline's gauges, but no others."""
+        name: Final[str] = "memex_scan_queue_depth"
+        old = self.make_pipeline(StubOCR(), 1)
+        new = self.make_pipeline(StubOCR(), 1)
+        gauge = metrics.registry.metrics[name]
+        assert isinstance(gauge, metrics.Gauge)
+        self.assertEqual(gauge.func, new.queue.qsize)
+        old.stop()
+        self.assertIs(metrics.registry.metrics[name], gauge)
+        new.stop()
+        self.assertNotIn(name, metrics.registry.metrics)
+        self.assertNotIn("memex_result_queue_depth", metrics.registry.metrics)
+
+    def test_writer(self) -> None:
+        """Test that the Writer marks images as done and stops cleanly."""
+        q: Queue[Optional[image.Image]] = Queue()
+        wr = writer.Writer(q, batch_delay=60)
+        now = datetime.now()
+        q.put(image.Image(0, "/tmp/eins.png", "Notiz eins", "", now))
+        q.put(image.Image(0, "/tmp/zwei.png", "Notiz zwei", "", now))
+        # Without the flush, the Writer would wait for more images.
+        wr.flush()
+        self.assertTrue(pipeline.wait_done(q, time.monotonic() + 10))
+        self.assertEqual(wr.stored, 2)
+        db = database.Database(common.path.db())
+        self.assertEqual(len(db.file_search("Notiz")), 2)
+
+        q.put(image.Image(0, "/tmp/drei.png", "Notiz drei", "", now))
+        wr.stop()
+        self.assertFalse(wr.worker.is_alive())
+        self.assertEqual(q.unfinished_tasks, 0)
+        self.assertEqual(wr.stored, 3)
+
+    def test_writer_errors(self) -> None:
+        """Test that images the Writer could not store are not counted."""
+        add = database.Database.file_add
+
+        def file_add(db: database.Database,
+                     path: str,
+                     *args: Any) -> image.Image:
+            if path.endswith("kaputt.png"):
+                raise sqlite3.IntegrityError("kaputt")
+            return add(db, path, *args)
+
+        q: Queue[Optional[image.Image]] = Queue()
+        now = datetime.now()
+        with mock.patch.object(database.Database,
+                               "file_add_many",
+                               side_effect=sqlite3.IntegrityError("Stapel")), \
+             mock.patch.object(database.Database, "file_add", file_add):
+            wr = writer.Writer(q, batch_delay=60)
+            q.put(image.Image(0, "/tmp/heil.png", "Heil", "", now))
+            q.put(image.Image(0, "/tmp/kaputt.png", "Kaputt", "", now))
+            wr.stop()
+        self.assertEqual(q.unfinished_tasks, 0)
+        self.assertEqual(wr.stored, 1)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
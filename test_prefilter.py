@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 17:06:51 krylon>
+#
+# /data/code/python/memex/test_prefilter.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.test_prefilter
+
+(c) 2026 Benjamin Walkenhorst
+"""
+
+import configparser
+import os
+import tempfile
+import unittest
+
+from memex import prefilter
+
+
+def config(text: str) -> configparser.ConfigParser:
+    """Return a configuration read from text."""
+    cfg = configparser.ConfigParser()
+    cfg.read_string(text)
+    return cfg
+
+
+class PrefilterTest(unittest.TestCase):
+    """Test the prefilter."""
+
+    def test_load(self) -> None:
+        """Test creating the Prefilter from the configuration."""
+        self.assertIsNone(prefilter.load(config("")))
+        off = config("[prefilter]\nenabled = no\n")
+        self.assertIsNone(prefilter.load(off))
+        on = config("[prefilter]\nenabled = yes\nthreshold = 0.1\n")
+        self.assertIsNone(prefilter.load(on, enabled=False))
+        pf = prefilter.load(on)
+        if not prefilter.available():
+            # Without numpy and PIL, OCR runs on everything.
+            self.assertIsNone(pf)
+            return
+        assert pf is not None
+        self.assertEqual(pf.threshold, 0.1)
+        pf = prefilter.load(config(""), enabled=True)
+        assert pf is not None
+        self.assertEqual(pf.threshold, prefilter.DEFAULT_THRESHOLD)
+
+    def test_unreadable(self) -> None:
+        """Test that images we cannot score are read anyway."""
+        pf = prefilter.Prefilter(1.0)
+        self.assertTrue(pf.likely_text("/does/not/exist.png"))
+
+    @unittest.skipUnless(prefilter.available(), "needs numpy and PIL")
+    def test_text_score(self) -> None:
+        """Test scoring synthetic images."""
+        # pylint: disable-msg=C0415
+        from PIL import Image, ImageDraw  # type: ignore
+
+        with tempfile.TemporaryDirectory() as folder:
+            # A smooth gradient has weak edges only, black bars on white
+            # have strong ones only.
+            smooth = Image.linear_gradient("L").resize((256, 256))
+            bars = Image.new("L", (256, 256), 255)
+            draw = ImageDraw.Draw(bars)
+            for x in range(8, 248, 16):
+                draw.rectangle((x, 16, x + 4, 240), fill=0)
+            paths: dict[str, str] = {}
+            for name, img in (("smooth", smooth), ("bars", bars)):
+                paths[name] = os.path.join(folder, f"{name}.png")
+                img.save(paths[name])
+
+            self.assertLess(prefilter.text_score(paths["smooth"]), 0.01)
+            self.assertGreater(prefilter.text_score(paths["bars"]), 0.5)
+            pf = prefilter.Prefilter()
+            self.assertFalse(pf.likely_text(paths["smooth"]))
+            self.assertTrue(pf.likely_text(paths["bars"]))
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
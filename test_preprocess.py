@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 16:58:30 krylon>
+#
+# /data/code/python/memex/test_preprocess.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.test_preprocess
+
+(c) 2026 Benjamin Walkenhorst
+"""
+
+import configparser
+import unittest
+
+from memex import preprocess
+
+
+class PreprocessTest(unittest.TestCase):
+    """Test the preprocessing helpers that do not need PIL."""
+
+    def test_settings(self) -> None:
+        """Test telling whether preprocessing is enabled, and how."""
+        self.assertFalse(preprocess.Settings().enabled())
+        prep = preprocess.Settings(max_dim=3000, grayscale=True)
+        self.assertTrue(prep.enabled())
+        self.assertEqual(prep.profile(),
+                         "max_dim=3000,dpi=0,grayscale=1,binarize=0,crop=0")
+        self.assertNotEqual(prep.profile(),
+                            prep._replace(crop=True).profile())
+
+    def test_load_settings(self) -> None:
+        """Test reading the settings from the configuration."""
+        cfg = configparser.ConfigParser()
+        self.assertEqual(preprocess.load_settings(cfg),
+                         preprocess.Settings())
+        cfg.read_string("[preprocess]\ndpi = 300\nbinarize = yes\n")
+        self.assertEqual(preprocess.load_settings(cfg),
+                         preprocess.Settings(dpi=300, binarize=True))
+
+    def test_scale_factor(self) -> None:
+        """Test computing how far to scale an image down."""
+        prep = preprocess.Settings(max_dim=1000, dpi=300)
+        self.assertEqual(preprocess.scale_factor((800, 600), 0, prep), 1.0)
+        self.assertEqual(preprocess.scale_factor((4000, 2000), 0, prep),
+                         0.25)
+        self.assertEqual(preprocess.scale_factor((800, 600), 600, prep),
+                         0.5)
+        # The stronger of the two limits wins.
+        self.assertEqual(preprocess.scale_factor((2000, 500), 1200, prep),
+                         0.25)
+        # Images are never scaled up.
+        self.assertEqual(preprocess.scale_factor((100, 100), 72, prep), 1.0)
+        off = preprocess.Settings()
+        self.assertEqual(preprocess.scale_factor((9999, 9999), 9999, off),
+                         1.0)
+
+    def test_otsu_threshold(self) -> None:
+        """Test finding the threshold between dark and light pixels."""
+        hist: list[int] = [0] * 256
+        hist[40] = 300
+        hist[50] = 200
+        hist[200] = 500
+        hist[210] = 100
+        threshold: int = preprocess.otsu_threshold(hist)
+        self.assertGreaterEqual(threshold, 50)
+        self.assertLess(threshold, 200)
+        # A uniform image has nothing to separate.
+        flat: list[int] = [0] * 256
+        flat[128] = 1000
+        self.assertEqual(preprocess.otsu_threshold(flat), 0)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
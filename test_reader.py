@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 09:12:31 krylon>
+#
+# /data/code/python/memex/test_reader.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.test_reader
+
+(c) 2026 Benjamin Walkenhorst
+"""
+
+import os
+import threading
+import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from queue import Queue
+from typing import Any, Final, Optional
+from unittest import mock
+
+from krylib import isdir
+
+from memex import common, image, reader
+
+TEST_ROOT: str = "/tmp/"
+
+if isdir("/data/ram"):
+    TEST_ROOT = "/data/ram"
+
+TEST_DIR: Final[str] = os.path.join(
+    TEST_ROOT,
+    datetime.now().strftime("memex_test_reader_%Y%m%d_%H%M%S"))
+
+
+class FakePool:
+    """FakePool stands in for the ProcessPoolExecutor of the Reader.
+
+    The first broken pools created fail every image, as if a worker
+    process had died. If barrier is given, a broken pool waits for it
+    before failing, so several threads see the same broken pool.
+    """
+
+    broken: int = 0
+    barrier: Optional[threading.Barrier] = None
+    created: list["FakePool"] = []
+
+    def __init__(self, **_: Any) -> None:
+        self.is_broken: bool = len(FakePool.created) < FakePool.broken
+        self.submitted: int = 0
+        self.shut_down: bool = False
+        FakePool.created.append(self)
+
+    def submit(self, _fn: Any, path: str, *_args: Any) -> Future:
+        """Return a future for reading path."""
+        self.submitted += 1
+        fut: Future = Future()
+        if self.is_broken:
+            if FakePool.barrier is not None:
+                FakePool.barrier.wait()
+            fut.set_exception(BrokenProcessPool("A worker died"))
+        else:
+            fut.set_result(image.Image(0, path, "Text", "", datetime.now()))
+        return fut
+
+    def shutdown(self, **_: Any) -> None:
+        """Pretend to shut down."""
+        self.shut_down = True
+
+
+class EngineTest(unittest.TestCase):
+    """Test the Engine and the Reader, with a mocked Tesseract API."""
+
+    api: mock.MagicMock
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Prepare the test environment."""
+        common.set_basedir(TEST_DIR)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Clean up the test environment."""
+        os.system(f'rm -rf "{TEST_DIR}"')
+
+    def setUp(self) -> None:
+        """Replace the Tesseract API with a mock."""
+        patch = mock.patch.object(reader.tesserocr, "PyTessBaseAPI")
+        self.api = patch.start()
+        self.addCleanup(patch.stop)
+        self.api.return_value.GetUTF8Text.return_value = "Text"
+        self.api.return_value.SetVariable.return_value = True
+
+    def test_read(self) -> None:
+        """Test that the API is set up once and reused."""
+        eng = reader.Engine("deu", {"tessedit_do_invert": "0"})
+        self.assertEqual(eng.read("/tmp/a.png"), "Text")
+        self.assertEqual(eng.read("/tmp/b.png"), "Text")
+        self.api.assert_called_once_with(lang="deu")
+        api = self.api.return_value
+        api.SetVariable.assert_called_once_with("tessedit_do_invert", "0")
+        api.SetImageFile.assert_has_calls([mock.call("/tmp/a.png"),
+                                           mock.call("/tmp/b.png")])
+        self.assertEqual(api.Clear.call_count, 2)
+
+    def test_configure(self) -> None:
+        """Test that the API is only set up again if the settings change."""
+        eng = reader.Engine("deu")
+        eng.read("/tmp/a.png")
+        eng.configure("deu")
+        eng.read("/tmp/b.png")
+        self.assertEqual(self.api.call_count, 1)
+        eng.configure("eng", {"user_defined_dpi": "300"})
+        self.api.return_value.End.assert_called_once()
+        eng.read("/tmp/c.png")
+        self.assertEqual(self.api.call_count, 2)
+        self.api.assert_called_with(lang="eng")
+        self.assertEqual(eng.profile(), "eng;user_defined_dpi=300")
+
+    def test_close(self) -> None:
+        """Test releasing the API."""
+        eng = reader.Engine("deu")
+        eng.close()
+        self.api.return_value.End.assert_not_called()
+        eng.read("/tmp/a.png")
+        eng.close()
+        eng.close()
+        self.api.return_value.End.assert_called_once()
+        self.assertIsNone(eng.api)
+
+    def test_invalid_variable(self) -> None:
+        """Test that an unknown Tesseract variable is refused."""
+        self.api.return_value.SetVariable.return_value = False
+        eng = reader.Engine("deu", {"no_such_variable": "1"})
+        with self.assertRaises(ValueError):
+            eng.read("/tmp/a.png")
+        self.api.return_value.End.assert_called_once()
+        self.assertIsNone(eng.api)
+
+    def test_reader_stop(self) -> None:
+        """Test that stopping a Reader releases its workers' Engines."""
+        q: Queue[str] = Queue()
+        rdr = reader.Reader(q, 2, cache=False, skip_textless=False)
+        q.put("/tmp/a.png")
+        q.put("/tmp/b.png")
+        q.join()
+        self.api.return_value.End.assert_not_called()
+        rdr.stop()
+        self.assertEqual(self.api.return_value.End.call_count,
+                         self.api.call_count)
+        self.assertGreater(self.api.call_count, 0)
+
+
+
+class PoolTest(unittest.TestCase):
+    """Test recovering from crashed worker processes."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Prepare the test environment."""
+        common.set_basedir(f"{TEST_DIR}_pool")
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Clean up the test environment."""
+        os.system(f'rm -rf "{TEST_DIR}_pool"')
+
+    def make_reader(self, broken: int, threads: int = 1) -> reader.Reader:
+        """Create a Reader whose first broken pools fail every image."""
+        FakePool.broken = broken
+        FakePool.created = []
+        FakePool.barrier = threading.Barrier(threads) if threads > 1 \
+            else None
+        patch = mock.patch.object(reader, "ProcessPoolExecutor", FakePool)
+        patch.start()
+        self.addCleanup(patch.stop)
+        rdr = reader.Reader(Queue(),
+                            1,
+                            backend="process",
+                            cache=False,
+                            skip_textless=False)
+        self.addCleanup(rdr.stop)
+        return rdr
+
+    def test_retry(self) -> None:
+        """Test that an image is retried once on a fresh pool."""
+        rdr = self.make_reader(1)
+        img = rdr.process_image("/tmp/a.png")
+        self.assertEqual(img.content, "Text")
+        self.assertEqual(len(FakePool.created), 2)
+        self.assertTrue(FakePool.created[0].shut_down)
+        self.assertEqual([p.submitted for p in FakePool.created], [1, 1])
+
+    def test_retry_once(self) -> None:
+        """Test that an image that keeps crashing the pool is given up."""
+        rdr = self.make_reader(2)
+        with self.assertRaises(BrokenProcessPool):
+            rdr.process_image("/tmp/a.png")
+        self.assertEqual(sum(p.submitted for p in FakePool.created), 2)
+
+    def test_restart_once(self) -> None:
+        """Test that threads seeing the same broken pool replace it once."""
+        threads: Final[int] = 4
+        rdr = self.make_reader(1, threads)
+        results: list[str] = []
+
+        def read(path: str) -> None:
+            results.append(rdr.process_image(path).content)
+
+        workers = [threading.Thread(target=read, args=(f"/tmp/{i}.png", ))
+                   for i in range(threads)]
+        for thr in workers:
+            thr.start()
+        for thr in workers:
+            thr.join()
+        self.assertEqual(results, ["Text"] * threads)
+        self.assertEqual(len(FakePool.created), 2)
+        self.assertEqual(FakePool.created[0].submitted, threads)
+        self.assertEqual(FakePool.created[1].submitted, threads)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
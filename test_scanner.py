@@ -37,13 +37,13 @@ import os
 import os.path
 import random
 import unittest
-
-from queue import Queue
+from datetime import datetime
+from queue import Full, Queue
 from typing import Final, List
 
 from krylib import isdir
 
-from memex import scanner
+from memex import common, database, image, metrics, scanner, scheduler
 
 SUFFICES: Final[List[str]] = [
     'jpg',
@@ -115,11 +115,12 @@ class ScannerTest(unittest.TestCase):
         folder: str = f'memex_test_scanner_{random.randint(0, 1<<32):08x}'
         cls.root = os.path.join(TEST_ROOT, folder)
         cls.fcnt = generate_directory_tree(cls.root)
+        common.set_basedir(f"{cls.root}.d")
 
     @classmethod
     def tearDownClass(cls):
         """Clean up the test environment."""
-        os.system(f'rm -rf "{cls.root}"')
+        os.system(f'rm -rf "{cls.root}" "{cls.root}.db"* "{cls.root}.d"')
 
     def test_create(self) -> None:
         """Test creating a Scanner instance."""
@@ -137,6 +138,143 @@ class ScannerTest(unittest.TestCase):
         else:
             self.assertLessEqual(fqueue.qsize(), self.__class__.fcnt)
 
+    def test_stamp_index(self) -> None:
+        """Test looking up timestamps in a StampIndex."""
+        db = database.Database(f"{self.__class__.root}.db")
+        now = datetime.now()
+        root: Final[str] = "/data/Pictures"
+        db.file_add_many([
+            image.Image(0, f"{root}/{i:04d}.png", "", "", now)
+            for i in range(100)
+        ])
+        db.file_add("/data/Pictures2/0001.png", "", "", now)
+        for limit in (scanner.STAMP_INDEX_LIMIT, 0):
+            idx = scanner.StampIndex(db, root, limit)
+            self.assertEqual(idx.loaded, limit > 0)
+            known = idx.lookup([f"{root}/0001.png", f"{root}/0100.png"], db)
+            self.assertEqual(known,
+                             {f"{root}/0001.png": int(now.timestamp())})
+
+    def test_collapse_roots(self) -> None:
+        """Test removing nested folders from a list of roots."""
+        roots = scanner.collapse_roots(["/a/b", "/a-b", "/a/", "/a/c/../d",
+                                        "/b/c", "/b/c2"])
+        self.assertEqual(roots, ["/a", "/a-b", "/b/c", "/b/c2"])
+        self.assertEqual(scanner.collapse_roots(["/x", "/"]), ["/"])
+
+    def test_incremental(self) -> None:
+        """Test skipping unchanged directories in an incremental scan."""
+        tree: Final[str] = f"{self.__class__.root}_inc"
+        os.makedirs(os.path.join(tree, "a", "b"))
+        for p in ("a/1.png", "a/b/2.jpg"):
+            path: str = os.path.join(tree, p)
+            with open(path, "w"):  # pylint: disable-msg=W1514
+                pass
+        q: Queue = Queue()
+        sc = scanner.Scanner(q)
+        try:
+            sc.scan(tree, os.path.join(tree, "a"))
+            self.assertEqual(q.qsize(), 2)
+            db = database.Database(common.path.db())
+            dirs = dict(db.dir_get_all(tree))
+
+            # The mtimes of the directories holding the images are only
+            # recorded once the images have been stored, so an incremental
+            # scan finds both images again.
+            self.assertEqual(len(dirs), 3)
+            self.assertEqual(dirs[os.path.join(tree, "a")],
+                             scanner.UNRECORDED)
+            q.queue.clear()
+            sc.scan(tree, incremental=True)
+            self.assertEqual(q.qsize(), 2)
+
+            while q.qsize() > 0:
+                path: str = q.get()
+                db.file_add(path, "", timestamp=scanner.file_mtime(path))
+            sc.scan(tree, incremental=True)
+            self.assertEqual(q.qsize(), 0)
+            self.assertNotIn(scanner.UNRECORDED,
+                             dict(db.dir_get_all(tree)).values())
+
+            added: str = os.path.join(tree, "a", "b", "3.gif")
+            with open(added, "w"):  # pylint: disable-msg=W1514
+                pass
+            sc.scan(tree, incremental=True)
+            self.assertEqual(q.qsize(), 1)
+        finally:
+            os.system(f'rm -rf "{tree}"')
+
+    def test_scheduler(self) -> None:
+        """Test the order in which the scheduling policies hand out images."""
+        tasks: list[scheduler.Task] = [
+            scheduler.Task("/a/old.png", 100, 3000, "/a"),
+            scheduler.Task("/a/new.png", 300, 2000, "/a"),
+            scheduler.Task("/a/mid.png", 200, 1000, "/a"),
+            scheduler.Task("/b/one.png", 50, 5000, "/b"),
+        ]
+        expect: dict[str, list[str]] = {
+            "fifo": ["old", "new", "mid", "one"],
+            "newest": ["new", "mid", "old", "one"],
+            "smallest": ["mid", "new", "old", "one"],
+            "roundrobin": ["old", "one", "new", "mid"],
+        }
+        for policy, order in expect.items():
+            sched = scheduler.Scheduler(policy)
+            for t in tasks:
+                sched.submit(*t)
+            got: list[str] = []
+            while sched.qsize() > 0:
+                got.append(os.path.basename(sched.get())[:-4])
+                sched.task_done()
+            self.assertEqual(got, order, policy)
+            sched.put(None)
+            self.assertIsNone(sched.get())
+            sched.task_done()
+            self.assertEqual(sched.stats()["completed"], len(tasks))
+        with self.assertRaises(ValueError):
+            scheduler.Scheduler("random")
+
+        # A bounded Scheduler makes the producer wait.
+        sched = scheduler.Scheduler("fifo", maxsize=2)
+        sched.submit_many(tasks[:2])
+        with self.assertRaises(Full):
+            sched.put(tasks[2], timeout=0.01)  # type: ignore
+        self.assertEqual(sched.clear(), 2)
+        sched.put(tasks[2], timeout=0.01)  # type: ignore
+
+    def test_metrics(self) -> None:
+        """Test that scanning updates the scanner's metrics."""
+        tree: Final[str] = f"{self.__class__.root}_metrics"
+        os.makedirs(os.path.join(tree, "a"))
+        path: Final[str] = os.path.join(tree, "a", "1.png")
+        with open(path, "w"):  # pylint: disable-msg=W1514
+            pass
+        before = metrics.registry.snapshot()
+        q: Queue = Queue()
+        sc = scanner.Scanner(q)
+        try:
+            sc.scan(tree)
+        finally:
+            os.system(f'rm -rf "{tree}"')
+        after = metrics.registry.snapshot()
+
+        def grown(name: str) -> float:
+            return after[name] - before[name]  # type: ignore
+
+        self.assertEqual(grown("memex_scan_dirs_total"), 2)
+        self.assertEqual(grown("memex_scan_queued_total"), 1)
+        seconds = after["memex_scan_list_seconds"]
+        self.assertGreater(seconds["count"], 0)  # type: ignore
+        self.assertIn("# TYPE memex_scan_list_seconds histogram",
+                      metrics.registry.render())
+
+        hist = metrics.Histogram("test_seconds", "Test", (1.0, 2.0, 4.0))
+        for v in (0.5, 1.5, 1.5, 3.0):
+            hist.observe(v)
+        self.assertEqual(hist.count, 4)
+        self.assertLessEqual(hist.quantile(0.5), 2.0)
+        self.assertGreater(hist.quantile(0.99), 2.0)
+
 # Local Variables: #
 # python-indent: 4 #
 # End: #
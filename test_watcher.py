@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 16:40:12 krylon>
+#
+# /data/code/python/memex/test_watcher.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.test_watcher
+
+(c) 2026 Benjamin Walkenhorst
+"""
+
+import os
+import os.path
+import unittest
+from datetime import datetime
+from queue import Queue
+from typing import Final
+
+from krylib import isdir
+
+from memex import common, database, watcher
+
+TEST_ROOT: str = "/tmp/"
+
+if isdir("/data/ram"):
+    TEST_ROOT = "/data/ram"
+
+TEST_DIR: Final[str] = os.path.join(
+    TEST_ROOT,
+    datetime.now().strftime("memex_test_watcher_%Y%m%d_%H%M%S"))
+
+
+def event(wd: int, mask: int, name: str = "") -> bytes:
+    """Return an inotify event as the kernel would deliver it.
+
+    The kernel pads names with NUL bytes to a multiple of the header's
+    alignment.
+    """
+    raw: bytes = os.fsencode(name)
+    if len(raw) > 0:
+        raw += b"\0" * (16 - len(raw) % 16)
+    return watcher.EVENT_HEADER.pack(wd, mask, 0, len(raw)) + raw
+
+
+class WatcherTest(unittest.TestCase):
+    """Test handling inotify events, without inotify."""
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        """Prepare the test environment."""
+        common.set_basedir(TEST_DIR)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        """Clean up the test environment."""
+        os.system(f'rm -rf "{TEST_DIR}"')
+
+    def test_parse_events(self) -> None:
+        """Test splitting a buffer into events."""
+        buf: bytes = event(1, watcher.IN_CLOSE_WRITE, "a.png") + \
+            event(2, watcher.IN_Q_OVERFLOW) + \
+            event(3, watcher.IN_CREATE | watcher.IN_ISDIR,
+                  "sixteen_chars_ab")
+        self.assertEqual(list(watcher.parse_events(buf)),
+                         [(1, watcher.IN_CLOSE_WRITE, "a.png"),
+                          (2, watcher.IN_Q_OVERFLOW, ""),
+                          (3, watcher.IN_CREATE | watcher.IN_ISDIR,
+                           "sixteen_chars_ab")])
+
+    def test_dispatch(self) -> None:
+        """Test what the Watcher does with the events it gets."""
+        folder: Final[str] = os.path.join(TEST_DIR, "pics")
+        q: Queue[str] = Queue()
+        w = watcher.Watcher(q, [folder])
+        w.watches[1] = folder
+        db = database.Database(common.path.db())
+        gone: Final[str] = os.path.join(folder, "gone.png")
+        db.file_add(gone, "Weg", timestamp=datetime.now())
+
+        w.dispatch(db,
+                   event(1, watcher.IN_CLOSE_WRITE, "new.png") +
+                   event(1, watcher.IN_MOVED_TO, "notes.txt") +
+                   event(1, watcher.IN_DELETE, "gone.png") +
+                   event(9, watcher.IN_CLOSE_WRITE, "unknown.png") +
+                   event(1, watcher.IN_Q_OVERFLOW))
+        self.assertEqual(list(q.queue), [os.path.join(folder, "new.png")])
+        self.assertIsNone(db.file_timestamp(gone))
+
+        w.dispatch(db, event(1, watcher.IN_IGNORED))
+        self.assertEqual(w.watches, {})
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
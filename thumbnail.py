@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 11:02:41 krylon>
+#
+# /data/code/python/memex/thumbnail.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.thumbnail
+
+(c) 2026 Benjamin Walkenhorst
+
+Keeps small previews of the indexed images, so the GUI does not have to
+decode the full images every time they show up in a search.
+"""
+
+import io
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Final, List, Optional
+
+from memex import common
+
+try:
+    from PIL import Image as PILImage  # type: ignore
+except ImportError:
+    PILImage = None  # pylint: disable-msg=C0103
+
+THUMB_SIZE: Final[int] = 192
+# Thumbnails are mostly photos and screenshots, which JPEG stores in a
+# fraction of the space PNG needs. GdkPixbuf reads JPEG everywhere, WebP
+# only with an extra loader.
+THUMB_QUALITY: Final[int] = 80
+MAX_BYTES: Final[int] = 256 << 20
+# How often, in puts, we check if the store has grown too large, and how
+# far below the limit we shrink it once it has.
+EVICT_INTERVAL: Final[int] = 64
+EVICT_TARGET: Final[float] = 0.9
+# Access times are only updated when they are older than this, so reading
+# thumbnails does not turn into a write for every single one.
+ATIME_RESOLUTION: Final[int] = 3600
+
+INIT_QUERIES: Final[List[str]] = [
+    """CREATE TABLE IF NOT EXISTS thumb (
+        path      TEXT PRIMARY KEY,
+        mtime     INTEGER NOT NULL,
+        size      INTEGER NOT NULL,
+        bytes     INTEGER NOT NULL,
+        atime     INTEGER NOT NULL,
+        data      BLOB NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS thumb_atime_idx ON thumb (atime)",
+]
+
+QUERY_GET: Final[str] = \
+    "SELECT data, atime FROM thumb WHERE path = ? AND mtime = ? AND size = ?"
+QUERY_TOUCH: Final[str] = "UPDATE thumb SET atime = ? WHERE path = ?"
+QUERY_PUT: Final[str] = """
+INSERT INTO thumb (path, mtime, size, bytes, atime, data)
+VALUES            (   ?,     ?,    ?,     ?,     ?,    ?)
+ON CONFLICT(path) DO
+    UPDATE SET mtime=excluded.mtime,
+               size=excluded.size,
+               bytes=excluded.bytes,
+               atime=excluded.atime,
+               data=excluded.data
+"""
+QUERY_TOTAL: Final[str] = "SELECT COALESCE(SUM(bytes), 0) FROM thumb"
+QUERY_EVICT: Final[str] = """
+DELETE FROM thumb
+WHERE path IN (SELECT path FROM (SELECT
+                                     path,
+                                     SUM(bytes) OVER (ORDER BY atime, path)
+                                         - bytes AS freed
+                                 FROM thumb)
+               WHERE freed < ?)
+"""
+
+
+def make_thumbnail(path: str, size: int = THUMB_SIZE) -> bytes:
+    """Render a thumbnail of an image file as JPEG.
+
+    The image is decoded at reduced size where the format allows it, JPEG
+    images are only decoded at a fraction of their full resolution.
+    Transparent areas are filled with white.
+    """
+    if PILImage is None:
+        raise RuntimeError("PIL is not available")
+    with PILImage.open(path) as img:
+        img.draft("RGB", (size, size))
+        img.thumbnail((size, size), reducing_gap=2.0)
+        if img.mode not in ("RGB", "L"):
+            rgba = img.convert("RGBA")
+            img = PILImage.new("RGB", rgba.size, "white")
+            img.paste(rgba, mask=rgba.getchannel("A"))
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=THUMB_QUALITY, optimize=True)
+        return buf.getvalue()
+
+
+class ThumbnailStore:
+    """ThumbnailStore keeps rendered thumbnails in a single SQLite file.
+
+    Thumbnails are keyed by the path of the image and only returned as
+    long as the file's mtime and size are unchanged. When the store grows
+    past max_bytes, the thumbnails used least recently are evicted.
+    Each thread gets its own connection to the store.
+    """
+
+    log: logging.Logger
+    path: Final[str]  # pylint: disable-msg=C0103
+    size: int
+    max_bytes: int
+    local: threading.local
+    lock: threading.Lock
+    puts: int
+
+    def __init__(self,
+                 path: str,
+                 size: int = THUMB_SIZE,
+                 max_bytes: int = MAX_BYTES) -> None:
+        self.path = path
+        self.size = size
+        self.max_bytes = max_bytes
+        self.log = common.get_logger("thumbnail")
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.puts = 0
+
+    def __conn(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it if needed."""
+        conn: Optional[sqlite3.Connection] = getattr(self.local, "conn", None)
+        if conn is None:
+            self.log.debug("Open thumbnail store at %s", self.path)
+            conn = sqlite3.connect(self.path, timeout=30.0)
+            conn.isolation_level = None
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            for query in INIT_QUERIES:
+                conn.execute(query)
+            self.local.conn = conn
+        return conn
+
+    def get(self, path: str) -> Optional[bytes]:
+        """Return the stored thumbnail for an image, if it is up to date."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        conn: sqlite3.Connection = self.__conn()
+        row = conn.execute(QUERY_GET,
+                           (path, st.st_mtime_ns, st.st_size)).fetchone()
+        if row is None:
+            return None
+        now: int = int(datetime.now().timestamp())
+        if now - row[1] > ATIME_RESOLUTION:
+            conn.execute(QUERY_TOUCH, (now, path))
+        return row[0]
+
+    def put(self, path: str, data: bytes) -> None:
+        """Store the thumbnail for an image."""
+        st = os.stat(path)
+        self.__conn().execute(QUERY_PUT,
+                              (path,
+                               st.st_mtime_ns,
+                               st.st_size,
+                               len(data),
+                               int(datetime.now().timestamp()),
+                               data))
+        with self.lock:
+            self.puts += 1
+            check: bool = self.puts % EVICT_INTERVAL == 0
+        if check:
+            self.evict()
+
+    def thumbnail(self, path: str) -> Optional[bytes]:
+        """Return the thumbnail for an image, rendering it if needed.
+
+        Returns None if the thumbnail cannot be rendered, e.g. because PIL
+        is not installed.
+        """
+        data: Optional[bytes] = self.get(path)
+        if data is not None or PILImage is None:
+            return data
+        try:
+            data = make_thumbnail(path, self.size)
+        except Exception as ex:  # pylint: disable-msg=W0718
+            self.log.debug("Cannot render thumbnail for %s: %s", path, ex)
+            return None
+        self.put(path, data)
+        return data
+
+    def total(self) -> int:
+        """Return the size of all stored thumbnails in bytes."""
+        return self.__conn().execute(QUERY_TOTAL).fetchone()[0]
+
+    def evict(self) -> int:
+        """Shrink the store below its size limit, if it has outgrown it.
+
+        Returns the number of thumbnails removed.
+        """
+        total: int = self.total()
+        if total <= self.max_bytes:
+            return 0
+        excess: int = total - int(self.max_bytes * EVICT_TARGET)
+        cur: sqlite3.Cursor = self.__conn().execute(QUERY_EVICT, (excess, ))
+        self.log.debug("Evicted %d thumbnails (%d bytes over the limit)",
+                       cur.rowcount,
+                       total - self.max_bytes)
+        return cur.rowcount
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
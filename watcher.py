@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 17:25:03 krylon>
+#
+# /data/code/python/memex/watcher.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.watcher
+
+(c) 2026 Benjamin Walkenhorst
+
+Watches directory trees for changes using Linux' inotify, so new images
+can be indexed as soon as they appear.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+from queue import Queue
+from threading import Event, Lock, Thread
+from typing import Final, Iterator, Optional
+
+from memex import common, database, scanner
+
+IN_CLOSE_WRITE: Final[int] = 0x00000008
+IN_MOVED_FROM: Final[int] = 0x00000040
+IN_MOVED_TO: Final[int] = 0x00000080
+IN_CREATE: Final[int] = 0x00000100
+IN_DELETE: Final[int] = 0x00000200
+IN_DELETE_SELF: Final[int] = 0x00000400
+IN_Q_OVERFLOW: Final[int] = 0x00004000
+IN_IGNORED: Final[int] = 0x00008000
+IN_ONLYDIR: Final[int] = 0x01000000
+IN_ISDIR: Final[int] = 0x40000000
+IN_NONBLOCK: Final[int] = 0o4000
+IN_CLOEXEC: Final[int] = 0o2000000
+
+WATCH_MASK: Final[int] = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+EVENT_HEADER: Final[struct.Struct] = struct.Struct("iIII")
+BUFFER_SIZE: Final[int] = 64 * 1024
+POLL_INTERVAL: Final[int] = 500  # milliseconds
+
+
+def _libc() -> ctypes.CDLL:
+    """Load the C library and declare the inotify functions."""
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                       use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = \
+        [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def parse_events(buf: bytes) -> Iterator[tuple[int, int, str]]:
+    """Yield the watch descriptor, mask and name of each event in buf."""
+    offset: int = 0
+    while offset < len(buf):
+        wd, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+        offset += EVENT_HEADER.size
+        name: bytes = buf[offset:offset+length].rstrip(b"\0")
+        offset += length
+        yield wd, mask, os.fsdecode(name)
+
+
+class Watcher:
+    """Watcher subscribes to inotify events for a set of directory trees.
+
+    Images that are created, written or moved into a watched tree are put
+    into the queue for the Reader, images that are deleted or moved away
+    are removed from the database. inotify is not recursive, so we add a
+    watch for every directory, including the ones created later on.
+    """
+
+    log: logging.Logger
+    queue: Queue[str]
+    folders: list[str]
+    libc: ctypes.CDLL
+    fd: int
+    watches: dict[int, str]
+    stop_flag: Event
+    lock: Lock
+    worker: Optional[Thread]
+
+    def __init__(self, q: Queue[str], folders: list[str]) -> None:
+        self.log = common.get_logger("watcher")
+        self.queue = q
+        self.folders = scanner.collapse_roots(folders)
+        self.libc = _libc()
+        self.fd = -1
+        self.watches = {}
+        self.stop_flag = Event()
+        self.lock = Lock()
+        self.worker = None
+
+    def is_active(self) -> bool:
+        """Return True if the Watcher is running."""
+        with self.lock:
+            return self.worker is not None
+
+    def start(self) -> None:
+        """Set up the watches and start processing events."""
+        with self.lock:
+            if self.worker is not None:
+                return
+            fd: int = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                err: int = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            self.fd = fd
+            self.watches.clear()
+            for f in self.folders:
+                self.__watch_tree(f)
+            self.log.info("Watching %d directories below %s",
+                          len(self.watches),
+                          ", ".join(self.folders))
+            self.stop_flag.clear()
+            self.worker = Thread(target=self.__run, name="watcher")
+            self.worker.daemon = True
+            self.worker.start()
+
+    def stop(self) -> None:
+        """Stop processing events and release all watches."""
+        with self.lock:
+            if self.worker is None:
+                return
+            self.stop_flag.set()
+            self.worker.join()
+            self.worker = None
+            os.close(self.fd)
+            self.fd = -1
+            self.watches.clear()
+
+    def __watch(self, path: str) -> bool:
+        """Add a watch for a single directory."""
+        wd: int = self.libc.inotify_add_watch(self.fd,
+                                              os.fsencode(path),
+                                              WATCH_MASK)
+        if wd < 0:
+            err: int = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                self.log.error("Cannot watch %s, "
+                               "raise fs.inotify.max_user_watches",
+                               path)
+            elif err != errno.ENOENT:
+                self.log.error("Cannot watch %s: %s", path, os.strerror(err))
+            return False
+        self.watches[wd] = path
+        return True
+
+    def __watch_tree(self, root: str) -> list[str]:
+        """Add watches for a directory tree.
+
+        Returns the images found in the tree, so the caller can pick up
+        files created before the watches were in place.
+        """
+        images: list[str] = []
+        for folder, _, files in os.walk(root):
+            if self.__watch(folder):
+                images.extend(os.path.join(folder, f)
+                              for f in files
+                              if scanner.is_image(f))
+        return images
+
+    def __forget_tree(self, root: str) -> None:
+        """Remove the watches for a directory tree that went away."""
+        prefix: str = database.path_range(root)[0]
+        for wd, path in list(self.watches.items()):
+            if path == root or path.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def __run(self) -> None:
+        """Read and dispatch events until we are told to stop."""
+        db: database.Database = database.Database(common.path.db())
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN)
+        while not self.stop_flag.is_set():
+            if len(poll.poll(POLL_INTERVAL)) == 0:
+                continue
+            try:
+                buf: bytes = os.read(self.fd, BUFFER_SIZE)
+            except BlockingIOError:
+                continue
+            self.dispatch(db, buf)
+
+    def dispatch(self, db: database.Database, buf: bytes) -> None:
+        """Handle the events in a buffer read from inotify."""
+        for wd, mask, name in parse_events(buf):
+            try:
+                self.__handle(db, wd, mask, name)
+            except Exception as ex:  # pylint: disable-msg=W0718
+                self.log.error("Error handling event %#x for %s: %s",
+                               mask,
+                               name,
+                               ex)
+
+    def __handle(self,
+                 db: database.Database,
+                 wd: int,
+                 mask: int,
+                 name: str) -> None:
+        """Process a single inotify event."""
+        if mask & IN_Q_OVERFLOW:
+            self.log.error("inotify queue overflow, events were lost. "
+                           "A refresh will pick up the missing images.")
+            return
+        if mask & IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+
+        folder: Optional[str] = self.watches.get(wd)
+        if folder is None or mask & IN_DELETE_SELF:
+            return
+        path: str = os.path.join(folder, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                for img in self.__watch_tree(path):
+                    self.queue.put(img)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.__forget_tree(path)
+                db.file_remove_tree(path)
+        elif scanner.is_image(name):
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.log.debug("New or modified image %s", path)
+                self.queue.put(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.log.debug("Image %s is gone", path)
+                db.file_remove(path)
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #
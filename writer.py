@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Time-stamp: <2026-10-18 14:40:52 krylon>
+#
+# /data/code/python/memex/writer.py
+# created on 18. 10. 2026
+# (c) 2026 Benjamin Walkenhorst
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY BENJAMIN WALKENHORST ``AS IS'' AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF
+# SUCH DAMAGE.
+
+
+"""
+memex.writer
+
+(c) 2026 Benjamin Walkenhorst
+
+Stores the results of the Reader in the database.
+"""
+
+import logging
+import time
+from queue import Empty, Queue
+from threading import Thread
+from datetime import datetime
+from typing import Final, Optional
+
+from memex import common, database, image, metrics
+
+# Putting FLUSH in the queue makes the Writer commit its batch right away.
+FLUSH: Final[image.Image] = image.Image(0, "", "", "", datetime.min)
+BATCH_SIZE: Final[int] = 512
+BATCH_DELAY: Final[float] = 1.0  # seconds
+CHECKPOINT_INTERVAL: Final[float] = 30.0  # seconds
+
+_commit_time = metrics.registry.histogram(
+    "memex_write_commit_seconds",
+    "Time to store a batch of images")
+_stored = metrics.registry.counter(
+    "memex_write_images_total",
+    "Images stored in the database")
+_errors = metrics.registry.counter(
+    "memex_write_errors_total",
+    "Images that could not be stored")
+_checkpoint_time = metrics.registry.histogram(
+    "memex_write_checkpoint_seconds",
+    "Time to run a WAL checkpoint")
+
+
+class Writer:
+    """Writer drains a queue of processed images into the database.
+
+    Images are grouped into transactions of at most batch_size rows or
+    batch_delay seconds, whichever comes first, so we pay for one commit
+    per batch rather than per image. flush makes the Writer commit what
+    it has without waiting for batch_delay. Automatic WAL checkpoints are
+    disabled on the Writer's connection, instead it checkpoints whenever
+    it finds the queue empty after a commit, and every checkpoint_interval
+    seconds while the queue stays busy.
+    Every image is marked as done in the queue once it has been committed,
+    so Queue.join returns when everything is stored. Putting None in the
+    queue makes the Writer store what it has and stop.
+    """
+
+    log: logging.Logger
+    queue: Queue[Optional[image.Image]]
+    batch_size: int
+    batch_delay: float
+    checkpoint_interval: float
+    worker: Thread
+    stored: int
+
+    def __init__(self,
+                 queue: Queue[Optional[image.Image]],
+                 batch_size: int = BATCH_SIZE,
+                 batch_delay: float = BATCH_DELAY,
+                 checkpoint_interval: float = CHECKPOINT_INTERVAL) -> None:
+        self.log = common.get_logger("writer")
+        self.queue = queue
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.checkpoint_interval = checkpoint_interval
+        self.stored = 0
+        self.worker = Thread(target=self.__run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def stop(self) -> None:
+        """Store the images still in the queue, then stop the Writer."""
+        self.queue.put(None)
+        self.worker.join()
+
+    def flush(self) -> None:
+        """Commit the images collected so far without further delay."""
+        self.queue.put(FLUSH)
+
+    def __collect(self,
+                  first: image.Image) -> tuple[list[image.Image], bool]:
+        """Gather a batch of images, starting with first.
+
+        Also returns True if we were told to stop.
+        """
+        batch: list[image.Image] = [first]
+        deadline: float = time.monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining: float = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                img: Optional[image.Image] = self.queue.get(timeout=remaining)
+            except Empty:
+                break
+            if img is None:
+                return batch, True
+            if img is FLUSH:
+                self.queue.task_done()
+                break
+            batch.append(img)
+        return batch, False
+
+    def __store(self,
+                db: database.Database,
+                batch: list[image.Image]) -> int:
+        """Write a batch of images to the database.
+
+        If the batch as a whole fails, fall back to adding the images one by
+        one, so a single bad image does not take the others down with it.
+        Returns the number of images actually stored.
+        """
+        try:
+            with _commit_time.time():
+                db.file_add_many(batch)
+            _stored.inc(len(batch))
+            return len(batch)
+        except Exception as ex:  # pylint: disable-msg=W0718
+            self.log.error("Error storing batch of %d images: %s",
+                           len(batch),
+                           ex)
+
+        stored: int = 0
+        for img in batch:
+            try:
+                db.file_add(img.path,
+                            img.content,
+                            img.comment,
+                            img.timestamp,
+                            img.skipped)
+                _stored.inc()
+                stored += 1
+            except Exception as ex:  # pylint: disable-msg=W0718
+                _errors.inc()
+                self.log.error("Error processing image %s: %s",
+                               img.path,
+                               ex)
+        return stored
+
+    def __checkpoint(self, db: database.Database) -> None:
+        """Run a passive WAL checkpoint."""
+        try:
+            with _checkpoint_time.time():
+                busy, pages, done = db.checkpoint()
+            if busy != 0 or pages != done:
+                self.log.debug("WAL checkpoint: %d of %d pages written",
+                               done,
+                               pages)
+        except Exception as ex:  # pylint: disable-msg=W0718
+            self.log.error("WAL checkpoint failed: %s", ex)
+
+    def __run(self) -> None:
+        """Store processed images into the database."""
+        self.log.debug("Writer starting up.")
+        db: database.Database \
+            = database.Database(common.path.db())  # pylint: disable-msg=C0103
+        db.set_autocheckpoint(0)
+        dirty: bool = False
+        last_checkpoint: float = time.monotonic()
+        while True:
+            try:
+                first: Optional[image.Image] = self.queue.get_nowait()
+            except Empty:
+                # The queue ran dry, so this is a good time to checkpoint.
+                if dirty:
+                    self.__checkpoint(db)
+                    dirty = False
+                    last_checkpoint = time.monotonic()
+                first = self.queue.get()
+
+            if first is None:
+                self.queue.task_done()
+                break
+            if first is FLUSH:
+                self.queue.task_done()
+                continue
+            batch, stop = self.__collect(first)
+            self.stored += self.__store(db, batch)
+            for _ in batch:
+                self.queue.task_done()
+            dirty = True
+            if stop:
+                self.queue.task_done()
+                break
+
+            if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                self.__checkpoint(db)
+                dirty = False
+                last_checkpoint = time.monotonic()
+
+        if dirty:
+            self.__checkpoint(db)
+        self.log.debug("Writer stopping.")
+
+# Local Variables: #
+# python-indent: 4 #
+# End: #